@@ -1,15 +1,60 @@
 import xlwings as xw
 import numpy as np
 from aisha import Aisha
+from tjloop import tj_attackloop_run, tj_attackloop_batch, SUMMARY_FIELDS
+
+def _ids(values):
+    """单元格值 -> int64 id 数组（与 int() 一样向 0 取整，空单元格跳过）"""
+    arr = np.atleast_1d(np.asarray(values, dtype=object)).ravel()
+    arr = arr[[v is not None for v in arr]] if arr.size else arr
+    return np.trunc(arr.astype(float)).astype(np.int64)
+
+
+def _sumup_weights(attack_loop, data_fetch, n):
+    """
+    sumup 的查表权重：w[k] = data_return[k] 在原双重循环里被累加的次数，
+    即 Σ_{id 映射到 k} (attack_loop 里 id 的个数) × (data_fetch 里 id 的个数)。
+    id 按 Python 下标规则映射（负数从末尾数），只在 [-n, n) 内合法，匹配上越界的 id 时与原实现一样报 IndexError。
+    """
+    a = _ids(attack_loop)
+    f = _ids(data_fetch)
+    ok_f = (f >= -n) & (f < n)
+    if not ok_f.all() and np.isin(f[~ok_f], a).any():
+        raise IndexError("data_fetch 中的 id 超出 data_return 范围")
+    f = f[ok_f]
+    a = a[(a >= -n) & (a < n)]
+    # id ∈ [-n, n) 平移到 [0, 2n) 计数，再把负数 id 折回对应的正下标
+    w = np.bincount(a + n, minlength=2 * n) * np.bincount(f + n, minlength=2 * n)
+    return w[:n] + w[n:]
+
+
+def _column(values):
+    return np.array([0.0 if v is None else v for v in np.atleast_1d(np.asarray(values, dtype=object)).ravel()],
+                    dtype=float)
+
 
 @xw.func
 def sumup(attack_loop, data_fetch, data_return):
-    result = 0
-    for i in attack_loop:
-        for j in data_fetch:
-            if int(i) == int(j):
-                result += data_return[int(j)]
-    return result
+    """
+    Σ_{i ∈ attack_loop} Σ_{j ∈ data_fetch, int(i)==int(j)} data_return[int(j)]
+    按 id 计数一次（bincount）后与 data_return 做点积，复杂度 O(len(attack_loop) + len(data_fetch) + len(data_return))。
+    空单元格：attack_loop / data_fetch 中跳过，data_return 中按 0。
+    """
+    dr = _column(data_return)
+    w = _sumup_weights(attack_loop, data_fetch, len(dr))
+    return float(w @ dr)
+
+@xw.func
+def sumup_multi(attack_loop, data_fetch, data_returns):
+    """
+    sumup 的多列版本：data_returns 为多列区域（每列一组 data_return），
+    查表权重只算一次，返回一行，每列一个和。
+    """
+    if data_returns and not isinstance(data_returns[0], (list, tuple)):
+        data_returns = [[v] for v in data_returns]  # 单列区域 xlwings 会给一维 list
+    table = np.array([[0.0 if v is None else v for v in row] for row in data_returns], dtype=float)
+    w = _sumup_weights(attack_loop, data_fetch, table.shape[0])
+    return [(w @ table).tolist()]
 
 @xw.func
 def customize_interpolate_se(start, end_value, steps, order):
@@ -40,86 +85,32 @@ def customize_interpolate_se(start, end_value, steps, order):
 @xw.func
 def tj_attackloop(energy_total, yj_total, bd_total, attack_1_yj_add, attack_2_yj_add, heavy_attack_yj_cost, attack_1_energy_add, attack_2_energy_add, heavy_attack_energy_add, yj_revert_threshold, normal_attack_time, normal_attack_loop_bd_time, bd_add_time, three_heavy_bd_revert, bd_consume_ratio=1, original_normal_attack_length=5):
     """
-    0表示重击，1表示拔刀斩, 2表示普通攻击
+    0,1,2 表示重击，3 表示拔刀斩，4~8 表示普通攻击，9 表示大招
     优先级：重击>拔刀斩>普通攻击
+    循环本体在 tjloop.tj_attackloop_run（不 print，可脱离 Excel 调用）
     """
-    current_yj_consume = 0
-    current_yj = yj_total
-    current_bd = bd_total
-    skill_tag = True
-    real_attack_loop = []
-    current_energy = 0
-    normal_attack_loop_time_count = 0
-    revert_time = 0
-    final_attack_time = 0
-    heavy_attack_time = 0
-    bd_time = 0
-    heavy_attack_ids = [0,1,2]
-    normal_attack_ids = [4,5,6,7,8]
-    operation_change_time = 0
-    while skill_tag:
-        heavy_attack_id = 0
-        while current_yj >= heavy_attack_yj_cost:
-            real_attack_loop.append([heavy_attack_ids[heavy_attack_id], current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 0 表示重击
-            heavy_attack_id += 1
-            if heavy_attack_id == len(heavy_attack_ids):
-                heavy_attack_id = 0
-                current_bd = min(current_bd + three_heavy_bd_revert, bd_total)
-            current_yj -= heavy_attack_yj_cost
-            print(current_yj)
-            current_yj_consume += heavy_attack_yj_cost
-            current_energy += heavy_attack_energy_add
-            heavy_attack_time += 1
-            if current_yj_consume >= yj_revert_threshold:
-                current_yj = yj_total
-                current_yj_consume = 0
-                revert_time += 1
-            if current_energy >= energy_total:
-                operation_change_time += 1
-                real_attack_loop.append([9, current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 3 表示大招
-                skill_tag = False
-                break
-
-        operation_change_time += 1
-
-        normal_attack_time_count = 0
-        while current_yj < yj_total and skill_tag:
-            if current_bd >= 1:
-                real_attack_loop.append([3, current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 1 表示拔刀斩
-                print("拔刀斩")
-                current_bd -= bd_consume_ratio
-                current_yj = min(current_yj + attack_1_yj_add, yj_total)
-                current_energy += attack_1_energy_add
-                bd_time += 1
-                normal_attack_loop_time_count += 1
-                if normal_attack_loop_time_count == normal_attack_loop_bd_time:
-                    current_bd = min(current_bd + bd_add_time, bd_total) # bd_add_time 表示每n次最后一击的拔刀斩次数回复数量
-                    normal_attack_loop_time_count = 0
-                if current_energy >= energy_total:
-                    real_attack_loop.append([9, current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 3 表示大招
-                    skill_tag = False
-                    break
-            else:
-                real_attack_loop.append([normal_attack_ids[int(original_normal_attack_length - normal_attack_time + normal_attack_time_count)], current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 2 表示普通攻击
-                print("普通攻击")
-                current_yj = min(current_yj + attack_2_yj_add, yj_total)
-                current_energy += attack_2_energy_add
-                normal_attack_time_count += 1
-                if int(original_normal_attack_length - normal_attack_time + normal_attack_time_count) == len(normal_attack_ids):
-                    normal_attack_loop_time_count += 1
-                    normal_attack_time_count = 0
-                    if normal_attack_loop_time_count == normal_attack_loop_bd_time:
-                        current_bd = min(current_bd + bd_add_time, bd_total)
-                        normal_attack_loop_time_count = 0
-                        final_attack_time += 1
-                if current_energy >= energy_total:
-                    real_attack_loop.append([9, current_yj, current_bd, current_energy, revert_time, final_attack_time, heavy_attack_time, bd_time, operation_change_time]) # 3 表示大招
-                    skill_tag = False
-                    break
-        operation_change_time += 1
-                
+    real_attack_loop, _ = tj_attackloop_run(
+        energy_total, yj_total, bd_total, attack_1_yj_add, attack_2_yj_add, heavy_attack_yj_cost,
+        attack_1_energy_add, attack_2_energy_add, heavy_attack_energy_add, yj_revert_threshold,
+        normal_attack_time, normal_attack_loop_bd_time, bd_add_time, three_heavy_bd_revert,
+        bd_consume_ratio, original_normal_attack_length)
     return real_attack_loop
 
+@xw.func
+def tj_attackloop_table(params, max_ops=100000):
+    """
+    参数表（每行一组 tj_attackloop 的参数，14~16 列，顺序同 tj_attackloop）一次算完，
+    返回带表头的汇总表：total_ops / heavy / bd / normal / revert_time / ... / status（见 tjloop）
+    """
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]  # 单行区域 xlwings 会给一维 list
+    rows = [r for r in params if any(v is not None for v in r)]
+    if not rows:
+        return [list(SUMMARY_FIELDS)]
+    out = tj_attackloop_batch([[np.nan if v is None else v for v in r] for r in rows], max_ops=int(max_ops))
+    table = np.column_stack([out[k] for k in SUMMARY_FIELDS]).tolist()
+    return [list(SUMMARY_FIELDS)] + table
+
 
 @xw.func
 def as_attackloop(energy_total, requirements, attack_infos):
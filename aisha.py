@@ -67,6 +67,7 @@ class Aisha:
         self.yy_upper_limit = 5
         self.real_attack_loop = []
         self.max_loop_length = 100
+        self.max_time = None # 可选：按战斗时长截止，timer 达到后不再开始新的动作
         self.tags =[self.skill_tag, self.heavy_attack_tag, self.normal_attack_tag]
     
     def check_tags(self):
@@ -268,7 +269,7 @@ class Aisha:
         self.current_normal_attack_count += 1
 
     def final_attackloop_define(self):
-        while len(self.real_attack_loop) < self.max_loop_length:
+        while len(self.real_attack_loop) < self.max_loop_length and (self.max_time is None or self.timer < self.max_time):
             # 0为大招启动，1为重攻击状态，2为普通攻击状态
             # print(self.normal_attack_tag, self.heavy_attack_tag, self.skill_tag)
             if self.skill_tag == True:
@@ -277,7 +278,6 @@ class Aisha:
                 self.heavy_attack_operation()
             elif self.normal_attack_tag == True:
                 self.normal_attack_operation()
-            print(self.real_attack_loop)
         return [i for i in self.real_attack_loop]
         
 
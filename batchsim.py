@@ -0,0 +1,748 @@
+"""
+批量模拟引擎（struct-of-arrays）：N 个拓扑相同、只有数值不同的角色，一步一步同步推进。
+
+    from batchsim import BatchSim
+
+    sim = BatchSim.from_grid(base, {"op:heavy.base_time": [1.0, 1.2, 1.4],
+                                    "regen:energy.rate_per_sec": [3.0, 4.0]})
+    sim.run_greedy_ops(max_steps=200, op_priority=["burst", "heavy", "light", "rest"])
+    rows = sim.summaries()          # 与 sweep.summarize 相同的列
+
+- 资源 current / upper / 累计量存成 (N, 资源数) 的数组，状态层数 / 计时为 (N, 状态数)，
+  所有 type=2 状态的计时槽打包成 (N, 状态数, 最大 length)，空槽为 NaN
+- 每一步：过期 → 按优先级对所有变体同时 test → 对选中同一个 op 的变体做掩码结算 → 回复 → 触发 → 过期，
+  与 Character.build_rotation_greedy_ops 的结算顺序逐项一致（浮点结果相同）
+- 复用同一套规则类（StateEffect / OperationAccelerate / OperationResourceEfficiency /
+  ResourceRegenRule / ResourceStateRule / OperationTriggeredStateRule ...），只是把数值按变体收集成数组
+
+限制：
+- 只支持单 Operation 贪心（build_rotation_greedy_ops）；元操作的 type=2 影子模拟请用 sweep 的多进程模式
+- 所有变体的结构必须相同（对象数量、引用关系、类型/模式），否则构造时报错
+- 真实执行会报“资源不足”的变体会在该步停下，并在 error 中标记
+"""
+import numpy as np
+
+from character import Character
+
+
+class _Topology:
+    """单个变体的对象列表（顺序与 compile() 的快照布局一致）"""
+    def __init__(self, ch: Character):
+        layout = ch._get_snapshot_layout()
+        self.ch = ch
+        self.res = list(layout.resources)
+        self.states = list(layout.states)
+        self.ops = list(ch.operations)
+        self.regen = list(ch.resource_regen_rules)
+        self.triggers = list(ch.op_triggered_state_rules)
+        self.res_idx = {r: i for i, r in enumerate(self.res)}
+        self.st_idx = {s: i for i, s in enumerate(self.states)}
+        self.op_idx = {op: j for j, op in enumerate(self.ops)}
+        self.managed = [self.st_idx[s] for s in ch.state_manager.states]
+
+        # 与 Character.compile() 相同：规则索引按 state_manager.states 顺序收集
+        self.acc_index = []
+        self.eff_index = []
+        for op in self.ops:
+            acc, eff = [], []
+            for st in ch.state_manager.states:
+                for k, rule in enumerate(getattr(st, "op_accelerate_rules", None) or ()):
+                    if rule.operation is op:
+                        acc.append((self.st_idx[st], k))
+                for k, rule in enumerate(getattr(st, "op_efficiency_rules", None) or ()):
+                    if rule.operation is op:
+                        eff.append((self.st_idx[st], k))
+            self.acc_index.append(acc)
+            self.eff_index.append(eff)
+
+    def _consume_positions(self, op):
+        # 与 _OperationKernel 一致：同一资源重复出现时，位置取首次，数值取最后一次
+        pos = {}
+        for i, res in enumerate(op.resource_requirements):
+            pos[res] = i
+        return list(pos.items())
+
+    def _produce_positions(self, op):
+        pos = {}
+        for i, res in enumerate(op.resource_outputs):
+            pos[res] = i
+        return list(pos.items())
+
+    def signature(self):
+        """结构签名：只包含数量、引用关系和类型/模式，不含数值"""
+        ri, si = self.res_idx, self.st_idx
+        rget = lambda r: None if r is None else ri[r]
+        states = tuple(
+            (s.id, s.type, s.expire_mode, s.length if s.type == 2 else None,
+             tuple((ri[e.resource], e.ratio_on_add is None, e.ratio_on_remove is None) for e in s.resource_effects))
+            for s in self.states
+        )
+        ops = []
+        for j, op in enumerate(self.ops):
+            ops.append((
+                op.id,
+                tuple((ri[r], op.consume_upper_limits[i] is None, op.consume_lower_limits[i] is None)
+                      for r, i in self._consume_positions(op)),
+                tuple(ri[r] for r in op.resource_requirements),
+                tuple(ri[r] for r, _ in self._produce_positions(op)),
+                tuple(si[s] for s in op.statesoutput),
+                tuple(si[s] for s, _ in op.state_requirements),
+                tuple(si[s] for s in op.state_forbids),
+                tuple((si[e.state], e.target, rget(e.resource), e.op, e.max_stack is None) for e in op.state_effects),
+                tuple((ri[r.resource], si[r.state], r.mode, r.once) for r in op.resource_state_rules),
+                tuple((ri[r.resource], si[r.state], r.mode, r.require_active) for r in op.resource_state_remove_rules),
+                tuple(self.acc_index[j]),
+                tuple((s, k, self.states[s].op_efficiency_rules[k].target,
+                       rget(getattr(self.states[s].op_efficiency_rules[k], "resource", None)))
+                      for s, k in self.eff_index[j]),
+            ))
+        regen = tuple((ri[r.resource], tuple(si[s] for s, _ in r.state_requirements),
+                       tuple(si[s] for s in r.state_forbids)) for r in self.regen)
+        triggers = tuple((self.op_idx.get(r.trigger_operation, -1), si.get(r.target_state, -1),
+                          tuple(si[s] for s, _ in r.required_states), tuple(si[s] for s in r.forbidden_states),
+                          tuple((ri[t.resource], t.mode) for t in r.resource_thresholds)) for r in self.triggers)
+        return (tuple(r.id for r in self.res), states, tuple(self.managed), tuple(ops), regen, triggers)
+
+
+def _f(x, default):
+    return default if x is None else float(x)
+
+
+class BatchSim:
+    """
+    N 个同拓扑角色的批量模拟器。
+
+    - characters: [Character, ...]（结构相同、数值可不同；不会被修改）
+    - seed: probability < 1 的掷骰子所用 numpy 随机数种子
+
+    运行后的结果：
+    - now: (N,) 当前时间
+    - cur / consume_total / produce_total: (N, 资源数)
+    - counter: (N, 操作数) 各操作执行次数；steps: (N,) 执行的操作总数
+    - error: (N,) 是否因“资源不足”提前停止
+    """
+    EPS = 1e-9  # 与 ResourceBank.EPS 一致
+
+    def __init__(self, characters, seed=None, params=None):
+        chars = list(characters)
+        if not chars:
+            raise ValueError("BatchSim 至少需要一个角色")
+        topos = [_Topology(ch) for ch in chars]
+        sig = topos[0].signature()
+        for k, t in enumerate(topos[1:], 1):
+            if t.signature() != sig:
+                raise ValueError(f"第 {k} 个角色的结构与第 0 个不同，无法批量模拟")
+        self._topos = topos
+        self.params = list(params) if params is not None else [{} for _ in chars]
+        self.n = len(chars)
+        self.rng = np.random.default_rng(seed)
+        t0 = topos[0]
+        self.res_ids = [r.id for r in t0.res]
+        self.state_ids = [s.id for s in t0.states]
+        self.op_ids = [op.id for op in t0.ops]
+        self._gather()
+
+    @classmethod
+    def from_grid(cls, base, grid, seed=None):
+        """按 sweep 的参数路径展开 grid，每个参数点构建一个变体"""
+        from sweep import expand_grid, apply_params, _make_builder, _build
+        points = expand_grid(grid)
+        builder = _make_builder(base)
+        chars = [apply_params(_build(builder), p) for p in points]
+        return cls(chars, seed=seed, params=points)
+
+    # ---------- 数值收集 ----------
+    def _col(self, get, dtype=float):
+        return np.array([get(t) for t in self._topos], dtype=dtype)
+
+    def _gather(self):
+        t0 = self._topos[0]
+        col = self._col
+        R, S, O = len(t0.res), len(t0.states), len(t0.ops)
+        N = self.n
+
+        # 时间
+        self.now = col(lambda t: t.ch.timer.current_time)
+        self.last_tick = col(lambda t: t.ch._last_tick_time)
+
+        # 资源
+        self.cur = np.empty((N, R))
+        self.upper = np.empty((N, R))
+        self.consume_total = np.empty((N, R))
+        self.produce_total = np.empty((N, R))
+        for r in range(R):
+            self.cur[:, r] = col(lambda t: t.res[r].current)
+            self.upper[:, r] = col(lambda t: t.res[r].upper_limit)
+            self.consume_total[:, r] = col(lambda t: t.res[r].consume_total)
+            self.produce_total[:, r] = col(lambda t: t.res[r].produce_total)
+
+        # 状态
+        self.st_cur = np.empty((N, S))
+        self.st_upper = np.empty((N, S))
+        self.st_time = np.empty((N, S))
+        self.st_start = np.zeros((N, S))  # type=1 的开始时间
+        self.st_type = [s.type for s in t0.states]
+        self.st_resource_mode = [s.expire_mode == "resource" for s in t0.states]
+        # type=2 的计时槽统一放在 (N, K, Lmax) 里：空槽 NaN，length 不足 Lmax 的补位槽为 +inf（永不过期、不计层数）
+        slot_states = [s for s, st in enumerate(t0.states) if st.type == 2]
+        self.slot_of = {s: k for k, s in enumerate(slot_states)}
+        self.slot_len = np.array([t0.states[s].length for s in slot_states], dtype=np.int64)
+        lmax = int(self.slot_len.max(initial=0))
+        self.slots = np.full((N, len(slot_states), lmax), np.inf)
+        self.st_effects = []
+        for s, st in enumerate(t0.states):
+            self.st_cur[:, s] = col(lambda t: t.states[s].current)
+            self.st_upper[:, s] = col(lambda t: t.states[s].upper_limit)
+            self.st_time[:, s] = col(lambda t: t.states[s].time)
+            if st.type == 1:
+                self.st_start[:, s] = col(lambda t: t.states[s].start_time)
+            else:
+                self.slots[:, self.slot_of[s], :st.length] = np.array(
+                    [[np.nan if v is None else v for v in t.states[s].start_time] for t in self._topos],
+                    dtype=float).reshape(N, st.length)
+            effs = []
+            for k, e in enumerate(st.resource_effects):
+                g = lambda t, k=k: t.states[s].resource_effects[k]
+                effs.append({
+                    "res": t0.res_idx[e.resource],
+                    "on_add": col(lambda t: g(t).on_add), "on_remove": col(lambda t: g(t).on_remove),
+                    "per_stack": col(lambda t: bool(g(t).per_stack), bool),
+                    "ratio_on_add": None if e.ratio_on_add is None else col(lambda t: g(t).ratio_on_add),
+                    "ratio_on_remove": None if e.ratio_on_remove is None else col(lambda t: g(t).ratio_on_remove),
+                })
+            self.st_effects.append(effs)
+        self.managed = list(t0.managed)
+
+        # 操作
+        self.base_time = np.empty((N, O))
+        self.max_charges = np.empty((N, O))
+        self.charge_cd = np.empty((N, O))
+        self.charges = np.empty((N, O))
+        self.charge_clock = np.empty((N, O))
+        self.probability = np.empty((N, O))
+        self.counter = np.zeros((N, O))
+        self.ops = []
+        rsr_slots = {}
+        self._rsr_was_active = []
+        for j, op in enumerate(t0.ops):
+            g = lambda t: t.ops[j]
+            self.base_time[:, j] = col(lambda t: getattr(g(t), "base_time", g(t).time))
+            self.max_charges[:, j] = col(lambda t: g(t).max_charges)
+            self.charge_cd[:, j] = col(lambda t: g(t).charge_cd)
+            self.charges[:, j] = col(lambda t: g(t).charges)
+            self.charge_clock[:, j] = col(lambda t: g(t).charge_clock)
+            self.probability[:, j] = col(lambda t: g(t).probability)
+            self.counter[:, j] = col(lambda t: g(t).counter)
+
+            consumes = []
+            for res, i in t0._consume_positions(op):
+                r = t0.res_idx[res]
+                upper = col(lambda t: _f(g(t).consume_upper_limits[i], np.inf))
+                lower = col(lambda t: _f(g(t).consume_lower_limits[i], -np.inf))
+                base = col(lambda t: g(t).resource_consumes[i])
+                base = np.maximum(np.minimum(base, upper), lower)
+                consumes.append((r, base, upper, lower, self._effects_for(j, op, res, "consume")))
+            lowers = []
+            for i, res in enumerate(op.resource_requirements):
+                if op.consume_lower_limits[i] is not None:
+                    lowers.append((t0.res_idx[res], col(lambda t: g(t).consume_lower_limits[i])))
+            produces = []
+            for res, i in t0._produce_positions(op):
+                base = col(lambda t: g(t).resource_produces[i])
+                produces.append((t0.res_idx[res], base, self._effects_for(j, op, res, "produce")))
+
+            rsr = []
+            for k, rule in enumerate(op.resource_state_rules):
+                if id(rule) not in rsr_slots:
+                    rsr_slots[id(rule)] = len(self._rsr_was_active)
+                    self._rsr_was_active.append(col(lambda t: bool(g(t).resource_state_rules[k].was_active), bool))
+                rsr.append((t0.res_idx[rule.resource], t0.st_idx[rule.state], rule.mode, rule.once,
+                            col(lambda t: g(t).resource_state_rules[k].threshold), rsr_slots[id(rule)]))
+            rsrr = []
+            for k, rule in enumerate(op.resource_state_remove_rules):
+                rsrr.append((t0.res_idx[rule.resource], t0.st_idx[rule.state], rule.mode, rule.require_active,
+                             col(lambda t: g(t).resource_state_remove_rules[k].threshold)))
+
+            acc = []
+            for s, k in t0.acc_index[j]:
+                a = lambda t: t.states[s].op_accelerate_rules[k]
+                acc.append((s,
+                            col(lambda t: float(getattr(a(t), "ratio", 0.0) or 0.0)),
+                            col(lambda t: float(getattr(a(t), "ratio_per_stack", 0.0) or 0.0)),
+                            col(lambda t: bool(getattr(a(t), "by_current_stack", True)), bool),
+                            col(lambda t: float(getattr(a(t), "min_ratio", 0.0))),
+                            col(lambda t: float(getattr(a(t), "max_ratio", 0.95)))))
+            eff = []
+            for s, k in t0.eff_index[j]:
+                e = lambda t: t.states[s].op_efficiency_rules[k]
+                rule0 = e(t0)
+                target_res = getattr(rule0, "resource", None)
+                eff.append((s, rule0.target, None if target_res is None else t0.res_idx[target_res],
+                            col(lambda t: float(getattr(e(t), "mul", 1.0) or 1.0)),
+                            col(lambda t: float(getattr(e(t), "mul_per_stack", 0.0) or 0.0)),
+                            col(lambda t: bool(getattr(e(t), "by_current_stack", True)), bool),
+                            col(lambda t: float(getattr(e(t), "min_mul", 0.0))),
+                            col(lambda t: float(getattr(e(t), "max_mul", 10.0)))))
+
+            self.ops.append({
+                "requirements": [(t0.st_idx[s], col(lambda t, k=k: g(t).state_requirements[k][1]))
+                                 for k, (s, _) in enumerate(op.state_requirements)],
+                "forbids": [t0.st_idx[s] for s in op.state_forbids],
+                "lowers": lowers,
+                "consumes": consumes,
+                "produces": produces,
+                "statesoutput": [t0.st_idx[s] for s in op.statesoutput],
+                "rsr": rsr,
+                "rsrr": rsrr,
+                "acc": acc,
+                "eff": eff,
+            })
+
+        # 时间回复
+        self.regen = []
+        for k, rule in enumerate(t0.regen):
+            g = lambda t: t.regen[k]
+            self.regen.append((
+                t0.res_idx[rule.resource],
+                col(lambda t: g(t).rate_per_sec),
+                [(t0.st_idx[s], col(lambda t, q=q: g(t).state_requirements[q][1]))
+                 for q, (s, _) in enumerate(rule.state_requirements)],
+                [t0.st_idx[s] for s in rule.state_forbids],
+            ))
+
+        # 操作触发状态
+        self.triggers = []
+        for k, rule in enumerate(t0.triggers):
+            g = lambda t: t.triggers[k]
+            self.triggers.append((
+                t0.op_idx.get(rule.trigger_operation, -1),
+                t0.st_idx[rule.target_state],
+                [(t0.st_idx[s], col(lambda t, q=q: g(t).required_states[q][1]))
+                 for q, (s, _) in enumerate(rule.required_states)],
+                [t0.st_idx[s] for s in rule.forbidden_states],
+                [(t0.res_idx[th.resource], th.mode, col(lambda t, q=q: g(t).resource_thresholds[q].threshold))
+                 for q, th in enumerate(rule.resource_thresholds)],
+                col(lambda t: max(0, int(g(t).add_stacks))),
+                col(lambda t: getattr(g(t), "probability", 1.0)),
+            ))
+
+        self._prepare_update()
+        self._counter0 = self.counter.copy()
+        self.steps = np.zeros(N, dtype=np.int64)
+        self.error = np.zeros(N, dtype=bool)
+        self.history = []
+
+    def _effects_for(self, j, op, res, kind):
+        t0 = self._topos[0]
+        out = []
+        for k, e in enumerate(op.state_effects):
+            if e.target not in ("both", kind) or not (e.resource is None or e.resource is res):
+                continue
+            g = lambda t, k=k: t.ops[j].state_effects[k]
+            out.append((t0.st_idx[e.state], e.op,
+                        self._col(lambda t: g(t).value),
+                        self._col(lambda t: g(t).min_stack),
+                        self._col(lambda t: _f(g(t).max_stack, np.inf))))
+        return out
+
+    # ---------- 资源 ----------
+    def _res_update(self, mask, r, amount):
+        """与 ResourceBank.update 一致；不足的变体标记 error 并停止"""
+        cur = self.cur[:, r]
+        neg = mask & (amount < 0)
+        if neg.any():
+            short = neg & (cur + amount < -self.EPS)
+            if short.any():
+                self.error |= short
+                self.alive &= ~short
+                neg &= ~short
+            self.consume_total[neg, r] -= amount[neg]
+            v = cur[neg] + amount[neg]
+            cur[neg] = np.where(v > 0, v, 0.0)
+        pos = mask & (amount > 0)
+        if pos.any():
+            old = cur[pos]
+            v = old + amount[pos]
+            up = self.upper[pos, r]
+            new = np.where(v < up, v, up)
+            cur[pos] = new
+            self.produce_total[pos, r] += new - old
+
+    def _compare(self, value, mode, threshold):
+        if mode == ">=":
+            return value >= threshold
+        if mode == "<=":
+            return value <= threshold
+        if mode == "==":
+            return value == threshold
+        raise ValueError(f"未知比较模式: {mode}")
+
+    # ---------- 状态 ----------
+    def _on_change(self, s, mask, dstack, gain):
+        key_ratio, key_amt = ("ratio_on_add", "on_add") if gain else ("ratio_on_remove", "on_remove")
+        m = mask & (dstack > 0)
+        if not m.any():
+            return
+        for eff in self.st_effects[s]:
+            r = eff["res"]
+            if eff[key_ratio] is not None:
+                delta = self.upper[:, r] * eff[key_ratio] - self.cur[:, r]
+                self._res_update(m & (delta != 0) & self.alive, r, delta)
+                continue
+            amount = eff[key_amt] * np.where(eff["per_stack"], dstack, 1.0)
+            self._res_update(m & (amount != 0) & self.alive, r, amount)
+
+    def _state_add(self, s, mask):
+        if not mask.any():
+            return
+        prev = self.st_cur[:, s].copy()
+        up = self.st_upper[:, s]
+        if self.st_resource_mode[s]:
+            self.st_cur[mask, s] = np.minimum(up[mask], prev[mask] + 1)
+        elif self.st_type[s] == 1:
+            self.st_cur[mask, s] = np.minimum(up[mask], prev[mask] + 1)
+            self.st_start[mask, s] = self.now[mask]
+        else:
+            k = self.slot_of[s]
+            rows = np.nonzero(mask)[0]
+            now = self.now[rows]
+            sub = self.slots[rows, k, :]
+            # 先清理过期
+            sub[(now[:, None] - sub) > self.st_time[rows, s][:, None]] = np.nan
+            free = np.isnan(sub)
+            # 有空槽填下标最小的空槽，否则替换最早开始的一层（同时间取下标小的，与堆顺序一致）
+            earliest = np.argmin(np.where(free, np.inf, sub), axis=1)
+            idx = np.where(free.any(axis=1), np.argmax(free, axis=1), earliest)
+            sub[np.arange(len(rows)), idx] = now
+            self.slots[rows, k, :] = sub
+            empty = np.isnan(sub)
+            self.slot_min[rows, k] = np.where(empty, np.inf, sub).min(axis=1)
+            self.st_cur[rows, s] = np.minimum(up[rows], self.slot_len[k] - empty.sum(axis=1))
+        self._on_change(s, mask, self.st_cur[:, s] - prev, gain=True)
+
+    def _reset_slots(self, s, mask):
+        if self.st_type[s] == 1:
+            self.st_start[mask, s] = 0.0
+        else:
+            k = self.slot_of[s]
+            self.slots[mask, k, :self.slot_len[k]] = np.nan
+            self.slot_min[mask, k] = np.inf
+
+    def _force_clear(self, s, mask):
+        prev = self.st_cur[:, s].copy()
+        active = mask & (prev > 0)
+        self.st_cur[active, s] = 0.0
+        self._on_change(s, active, prev, gain=False)
+        self._reset_slots(s, mask)
+
+    def _prepare_update(self):
+        """StateManager.update 用到的下标：按计时模型分组，整组一次性判断过期"""
+        timed = [s for s in self.managed if not self.st_resource_mode[s]]
+        self._upd_t1 = np.array([s for s in timed if self.st_type[s] == 1], dtype=np.int64)
+        t2 = [s for s in timed if self.st_type[s] == 2]
+        self._upd_t2 = np.array(t2, dtype=np.int64)
+        self._upd_k2 = np.array([self.slot_of[s] for s in t2], dtype=np.int64)
+        self._t2_full_sync = True
+        self.slot_min = np.where(np.isnan(self.slots), np.inf, self.slots).min(axis=2) if self.slots.size \
+            else np.full(self.slots.shape[:2], np.inf)
+        # 只有带资源效果的状态需要按登记顺序逐个结算“减少层数”的资源改动
+        self._upd_effect_states = [s for s in timed if self.st_effects[s]]
+
+    def _sync_type2(self, mask, t2, k2):
+        slots = self.slots[:, k2, :]
+        expired = mask[:, None, None] & ((self.now[:, None, None] - slots) > self.st_time[:, t2][:, :, None])
+        slots[expired] = np.nan
+        self.slots[:, k2, :] = slots
+        active = self.slot_len[k2] - np.isnan(slots).sum(axis=2)
+        new = np.minimum(self.st_upper[:, t2], active)
+        self.st_cur[:, t2] = np.where(mask[:, None], new, self.st_cur[:, t2])
+        self.slot_min[:, k2] = np.where(np.isnan(slots), np.inf, slots).min(axis=2)
+
+    def _sync_type2_pairs(self, rows, states, ks):
+        sub = self.slots[rows, ks, :]
+        expired = (self.now[rows][:, None] - sub) > self.st_time[rows, states][:, None]
+        sub[expired] = np.nan
+        self.slots[rows, ks, :] = sub
+        active = self.slot_len[ks] - np.isnan(sub).sum(axis=1)
+        self.st_cur[rows, states] = np.minimum(self.st_upper[rows, states], active)
+        self.slot_min[rows, ks] = np.where(np.isnan(sub), np.inf, sub).min(axis=1)
+
+    def _update_states(self, mask):
+        """
+        StateManager.update：结算已过期的状态。
+        过期判断只依赖时间，所有状态一次性判断；资源改动仍按登记顺序逐个结算。
+        """
+        prev = self.st_cur.copy() if self._upd_effect_states else None
+        now = self.now
+        t1 = self._upd_t1
+        if len(t1):
+            cur = self.st_cur[:, t1]
+            start = self.st_start[:, t1]
+            due = mask[:, None] & (cur > 0) & ((now[:, None] - start) > self.st_time[:, t1])
+            if due.any():
+                cur[due] = 0.0
+                start[due] = 0.0
+                self.st_cur[:, t1] = cur
+                self.st_start[:, t1] = start
+        t2 = self._upd_t2
+        if len(t2):
+            if self._t2_full_sync:
+                # 第一次结算：与 StateManager 注册时一样，层数与计时槽不一致的状态立即按计时槽校正
+                self._t2_full_sync = False
+                self._sync_type2(mask, t2, self._upd_k2)
+            else:
+                # 只处理“最早一层已过期”的 (变体, 状态)，其余的层数不会变化
+                smin = self.slot_min[:, self._upd_k2]
+                due = mask[:, None] & ((now[:, None] - smin) > self.st_time[:, t2])
+                if due.any():
+                    rows, cols = np.nonzero(due)
+                    self._sync_type2_pairs(rows, t2[cols], self._upd_k2[cols])
+        for s in self._upd_effect_states:
+            lost = np.where(mask, prev[:, s] - self.st_cur[:, s], 0.0)
+            self._on_change(s, mask, lost, gain=False)
+
+    # ---------- 操作 ----------
+    def _effects_amount(self, amount, effects):
+        for s, op, value, min_stack, max_stack in effects:
+            cur = self.st_cur[:, s]
+            active = (cur >= min_stack) & (cur <= max_stack)
+            if op == "add":
+                new = amount + value
+            elif op == "sub":
+                new = amount - value
+            elif op == "mul":
+                new = amount * value
+            elif op == "div":
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    new = np.where(value != 0, amount / np.where(value != 0, value, 1.0), amount)
+            else:
+                new = amount
+            amount = np.where(active, new, amount)
+        return amount
+
+    def _efficiency(self, spec, kind, amounts, res_list):
+        for s, target, target_res, mul, mps, by_cur, mn, mx in spec["eff"]:
+            if target not in ("both", kind):
+                continue
+            cur = self.st_cur[:, s]
+            m = np.where((mps != 0.0) & by_cur, mul + mps * cur, mul)
+            m = np.where(m < mn, mn, m)
+            m = np.where(m > mx, mx, m)
+            m = np.where(cur > 0, m, 1.0)
+            for p, r in enumerate(res_list):
+                if target_res is None or target_res == r:
+                    amounts[p] = np.where(cur > 0, amounts[p] * m, amounts[p])
+        return amounts
+
+    def _consume_amounts(self, j):
+        spec = self.ops[j]
+        res_list = [c[0] for c in spec["consumes"]]
+        amounts = [self._effects_amount(base, effs) for _, base, _, _, effs in spec["consumes"]]
+        amounts = self._efficiency(spec, "consume", amounts, res_list)
+        out = []
+        for a, (_, _, upper, lower, _) in zip(amounts, spec["consumes"]):
+            a = np.where(a < 0, 0.0, a)
+            a = np.minimum(a, upper)
+            a = np.maximum(a, lower)
+            out.append(a)
+        return res_list, out
+
+    def _produce_amounts(self, j):
+        spec = self.ops[j]
+        res_list = [p[0] for p in spec["produces"]]
+        amounts = [self._effects_amount(base, effs) for _, base, effs in spec["produces"]]
+        return res_list, self._efficiency(spec, "produce", amounts, res_list)
+
+    def _effective_time(self, j):
+        total = np.zeros(self.n)
+        for s, ratio, rps, by_cur, mn, mx in self.ops[j]["acc"]:
+            cur = self.st_cur[:, s]
+            r = np.where((rps != 0.0) & by_cur, ratio + rps * cur, ratio)
+            r = np.where(r < mn, mn, r)
+            r = np.where(r > mx, mx, r)
+            total = total + np.where(cur > 0, r, 0.0)
+        factor = 1.0 - total
+        factor = np.where(factor < 0.0, 0.0, factor)
+        return self.base_time[:, j] * factor
+
+    def _test(self, j, mask):
+        spec = self.ops[j]
+        ok = mask.copy()
+        for s, need in spec["requirements"]:
+            ok &= self.st_cur[:, s] >= need
+        for s in spec["forbids"]:
+            ok &= ~(self.st_cur[:, s] > 0)
+        mc = self.max_charges[:, j]
+        ok &= ~((mc > 1) & (self.charges[:, j] <= 0))
+        for r, lower in spec["lowers"]:
+            ok &= ~(self.cur[:, r] < lower)
+        if not ok.any():
+            return ok
+        res_list, needs = self._consume_amounts(j)
+        for r, need in zip(res_list, needs):
+            ok &= ~(need > self.cur[:, r])
+        return ok
+
+    def _operate(self, j, m):
+        spec = self.ops[j]
+        self.counter[m, j] += 1
+        self.steps[m] += 1
+        mc = self.max_charges[:, j]
+        self.charges[m & (mc > 1), j] -= 1
+
+        p = self.probability[:, j]
+        if (p[m] < 1.0).any():
+            hit = (p >= 1.0) | (self.rng.random(self.n) < p)
+        else:
+            hit = np.ones(self.n, dtype=bool)
+
+        res_list, consumes = self._consume_amounts(j)
+        for r, c in zip(res_list, consumes):
+            self._res_update(m & self.alive, r, -c)
+        res_list, produces = self._produce_amounts(j)
+        for r, a in zip(res_list, produces):
+            self._res_update(m & hit & self.alive & (a > 0), r, a)
+
+        m = m & self.alive
+        for r, s, mode, once, threshold, slot in spec["rsr"]:
+            active = self._compare(self.cur[:, r], mode, threshold)
+            if once:
+                was = self._rsr_was_active[slot]
+                fire = m & active & ~was
+                self._state_add(s, fire)
+                was[fire] = True
+                was[m & ~active] = False
+            else:
+                self._state_add(s, m & active)
+        for r, s, mode, require_active, threshold in spec["rsrr"]:
+            hit_rm = m & self._compare(self.cur[:, r], mode, threshold)
+            if require_active:
+                hit_rm &= self.st_cur[:, s] > 0
+            if hit_rm.any():
+                self._force_clear(s, hit_rm)
+
+        m = m & self.alive
+        dt = self._effective_time(j)
+        self.now[m] += dt[m]
+        for s in spec["statesoutput"]:
+            self._state_add(s, m & hit)
+
+    def _apply_time_regen(self, m):
+        dt = self.now - self.last_tick
+        m = m & (dt > 0)
+        if not m.any():
+            return
+        for r, rate, reqs, forbids in self.regen:
+            ok = m.copy()
+            for s, need in reqs:
+                ok &= self.st_cur[:, s] >= need
+            for s in forbids:
+                ok &= ~(self.st_cur[:, s] > 0)
+            amount = rate * dt
+            amount = np.where(amount < 0, np.maximum(amount, -self.cur[:, r]), amount)
+            self._res_update(ok & (amount != 0) & self.alive, r, amount)
+        # 充能回复（所有 op 一起算）
+        mc, cd = self.max_charges, self.charge_cd
+        rows = m[:, None]
+        single = rows & (mc <= 1)
+        self.charges[single] = 1
+        self.charge_clock[single] = 0.0
+        multi = rows & (mc > 1) & (cd > 0)
+        full = multi & (self.charges >= mc)
+        self.charge_clock[full] = 0.0
+        tick = multi & ~full
+        if tick.any():
+            clock = np.where(tick, self.charge_clock + dt[:, None], self.charge_clock)
+            gained = np.floor_divide(clock, np.where(cd > 0, cd, 1.0))
+            g = tick & (gained > 0)
+            self.charges = np.where(g, np.minimum(mc, self.charges + gained), self.charges)
+            self.charge_clock = np.where(g, clock - gained * cd, clock)
+        self.last_tick[m] = self.now[m]
+
+    def _after_operation_executed(self, j, m):
+        for op_j, s, reqs, forbids, thresholds, stacks, prob in self.triggers:
+            if op_j != j:
+                continue
+            ok = m & self.alive
+            for st, need in reqs:
+                ok &= self.st_cur[:, st] >= need
+            for st in forbids:
+                ok &= ~(self.st_cur[:, st] > 0)
+            for r, mode, threshold in thresholds:
+                ok &= self._compare(self.cur[:, r], mode, threshold)
+            if (prob[ok] < 1.0).any():
+                ok &= (prob >= 1.0) | (self.rng.random(self.n) < prob)
+            for k in range(int(stacks.max(initial=0))):
+                self._state_add(s, ok & (stacks > k) & self.alive)
+
+    # ---------- 循环 ----------
+    def run_greedy_ops(self, max_steps=9999, op_priority=None, record=False):
+        """
+        与 Character.build_rotation_greedy_ops 相同的逻辑，所有变体同步推进：
+        每步对每个变体取优先级最高、test() 为 True 的 op 执行；没有可执行的 op 的变体停止。
+        record=True 时 history 记录每一步各变体选中的 op 下标（-1 表示已停止）。
+        """
+        if op_priority is not None:
+            order = [self.op_ids.index(i) for i in op_priority if i in self.op_ids]
+        else:
+            order = list(range(len(self.ops)))
+
+        self.alive = ~self.error
+        for _ in range(max_steps):
+            self._update_states(self.alive)
+            chosen = np.full(self.n, -1)
+            undecided = self.alive.copy()
+            for j in order:
+                ok = self._test(j, undecided)
+                chosen[ok] = j
+                undecided &= ~ok
+                if not undecided.any():
+                    break
+            self.alive &= chosen >= 0
+            if record:
+                self.history.append(chosen)
+            if not self.alive.any():
+                break
+            # 各变体互不影响：先按 op 分组结算，再对本步执行过的变体统一做回复、触发与过期，
+            # 对单个变体来说顺序仍是 operate → 回复 → 触发 → 状态过期
+            executed = []
+            for j in order:
+                m = (chosen == j) & self.alive
+                if not m.any():
+                    continue
+                self._operate(j, m)
+                executed.append((j, m))
+            if not executed:
+                continue
+            done = np.zeros(self.n, dtype=bool)
+            for j, m in executed:
+                done |= m
+            done &= self.alive
+            self._apply_time_regen(done)
+            for j, m in executed:
+                self._after_operation_executed(j, m & self.alive)
+            self._update_states(done & self.alive)
+        return self
+
+    def op_sequence(self, k):
+        """第 k 个变体执行过的 op id 序列（需要 record=True）"""
+        return [self.op_ids[c[k]] for c in self.history if c[k] >= 0]
+
+    def summaries(self):
+        """每个变体一行，列与 sweep.summarize 相同（另加 error），并带上构建时的参数"""
+        rows = []
+        for k in range(self.n):
+            row = dict(self.params[k])
+            row["total_time"] = float(self.now[k])
+            row["op_records"] = int(self.steps[k])
+            for j, op_id in enumerate(self.op_ids):
+                n = int(self.counter[k, j] - self._counter0[k, j])
+                if n > 0:
+                    row[f"count:{op_id}"] = n
+            for r, rid in enumerate(self.res_ids):
+                row[f"consume:{rid}"] = float(self.consume_total[k, r])
+                row[f"produce:{rid}"] = float(self.produce_total[k, r])
+                row[f"current:{rid}"] = float(self.cur[k, r])
+            row["error"] = bool(self.error[k])
+            rows.append(row)
+        return rows
@@ -1,5 +1,11 @@
 # ===================== Timer 类 =====================
-from typing import Any
+import heapq
+import math
+import random
+from array import array
+from collections import OrderedDict, deque
+from time import perf_counter_ns
+from typing import Any, NamedTuple
 
 
 class Timer:
@@ -40,6 +46,43 @@ class StateResourceEffect:
         self.ratio_on_remove = ratio_on_remove
 
 
+class MetaPriorityRule(NamedTuple):
+    """
+    状态 → 元操作优先级 规则（规范化后的形式，本身仍是 tuple，兼容 (meta_op, delta, min_stack) 写法）
+    - meta_op: 目标 MetaOperation（加载阶段可暂时是 meta_id 字符串）
+    - priority_delta: 状态满足时叠加的优先级
+    - min_stack: 状态层数至少多少才生效（>=1）
+    """
+    meta_op: Any
+    priority_delta: float
+    min_stack: int = 1
+
+    @classmethod
+    def normalize(cls, rule):
+        """
+        把 (meta_op, delta) / (meta_op, delta, min_stack) 规范化为 MetaPriorityRule。
+        非法写法返回 None（与旧版 get_priority 的跳过行为一致）。
+        """
+        if isinstance(rule, cls):
+            return rule
+        if not isinstance(rule, (list, tuple)):
+            return None
+        if len(rule) >= 3:
+            meta_op, delta, min_stack = rule[0], rule[1], rule[2]
+        elif len(rule) == 2:
+            meta_op, delta = rule
+            min_stack = 1
+        else:
+            return None
+        try:
+            need = int(min_stack)
+        except Exception:
+            need = 1
+        if need < 1:
+            need = 1
+        return cls(meta_op, delta, need)
+
+
 # ===================== State & StateManager =====================
 class State:
     """
@@ -54,7 +97,7 @@ class State:
        2 = 独立计时模型（每一层有自己的过期时间）
     6. length: 最大可同时存在的“计时槽”(对 type=2 有用)
     7. meta_priority_rules: 元操作优先级规则列表
-        - 结构：[(meta_op, priority_delta, min_stack=1), ...]
+        - 结构：[MetaPriorityRule(meta_op, priority_delta, min_stack=1), ...]（也接受普通 tuple，会被规范化）
         - 默认：None 或 [] -> 不修改优先级
         - 状态存在时（current >= min_stack）会对其中的 meta_op 优先级加上 priority_delta
         - 状态结束（current=0）后，优先级自动恢复为 base_priority。
@@ -70,10 +113,10 @@ class State:
         self.resource_effects = list(resource_effects) if resource_effects else []
         self.expire_mode = expire_mode  # "time" 或 "resource"
         # 元操作优先级规则：
-        # 结构：[(meta_op, priority_delta), ...]
+        # 结构：[MetaPriorityRule(meta_op, priority_delta, min_stack), ...]
         # - 默认：None 或 [] -> 不修改优先级
-        # - 状态存在时（current > 0）会对其中的 meta_op 优先级加上 priority_delta
-        self.meta_priority_rules = list(meta_priority_rules) if meta_priority_rules else []
+        # - 状态满足时（current >= min_stack）会对其中的 meta_op 优先级加上 priority_delta
+        self.meta_priority_rules = [r for r in map(MetaPriorityRule.normalize, meta_priority_rules or []) if r is not None]
         self.op_accelerate_rules = list(op_accelerate_rules) if op_accelerate_rules else []
         self.op_efficiency_rules = list(op_efficiency_rules) if op_efficiency_rules else []
         # type=1：只需要一个开始时间
@@ -85,6 +128,38 @@ class State:
             self.start_time = [None] * self.length
         else:
             raise ValueError("未知的状态类型，仅支持 1（攻击保持）和 2（独立计时）")
+        # type=2 的槽索引（与 start_time 同步维护）：
+        # - _slot_heap: 已占用槽的最小堆 [(start_time, slot), ...]，堆顶就是最早开始的一层
+        # - _free_slots: 空槽下标的最小堆
+        self._slot_heap = []
+        self._free_slots = list(range(self.length)) if self.type == 2 else []
+        # 过期调度：所属 StateManager 以及当前登记在其堆里的过期时间
+        self._scheduler = None
+        self._scheduled_at = None
+        # 脏标记（Character.compile() 填充）：层数变化时把依赖本状态的元操作记进 _dirty = (优先级脏集合, 可执行性脏集合)
+        self._dirty = None
+        self._priority_dependents = ()
+        self._feasible_dependents = ()
+
+    # 规则版本号：任何 State 通过 add_*_rule 增加规则时 +1，Character 据此让编译索引失效
+    _rules_version = 0
+
+    def _mark_dirty(self):
+        dirty_priority, dirty_feasible = self._dirty
+        dirty_priority.update(self._priority_dependents)
+        dirty_feasible.update(self._feasible_dependents)
+
+    def add_meta_priority_rule(self, meta_op, priority_delta, min_stack=1):
+        self.meta_priority_rules.append(MetaPriorityRule.normalize((meta_op, priority_delta, min_stack)))
+        State._rules_version += 1
+
+    def add_op_accelerate_rule(self, rule: "OperationAccelerate"):
+        self.op_accelerate_rules.append(rule)
+        State._rules_version += 1
+
+    def add_op_efficiency_rule(self, rule: "OperationResourceEfficiency"):
+        self.op_efficiency_rules.append(rule)
+        State._rules_version += 1
 
     def add(self, timer: Timer):
         if self.expire_mode == "resource":
@@ -92,6 +167,8 @@ class State:
             self.current = min(self.upper_limit, self.current + 1)
             gained = self.current - prev
             if gained > 0:
+                if self._dirty is not None:
+                    self._mark_dirty()
                 self._apply_resource_on_gain(gained)
             return
         
@@ -101,23 +178,25 @@ class State:
             self.current = min(self.upper_limit, self.current + 1)
             self.start_time = timer.current_time
         elif self.type == 2:
+            now = timer.current_time
             # 先清理过期
-            for i, t in enumerate(self.start_time):
-                if t is not None and timer.current_time - t > self.time:
-                    self.start_time[i] = None
-            # 优先填空槽
-            if None in self.start_time:
-                idx = self.start_time.index(None)
-                self.start_time[idx] = timer.current_time
+            self._expire_slots(now)
+            if self._free_slots:
+                # 优先填空槽（下标最小的空槽）
+                idx = heapq.heappop(self._free_slots)
             else:
                 # 全满，替换最早的
-                idx = min(range(len(self.start_time)), key=lambda i: self.start_time[i])
-                self.start_time[idx] = timer.current_time
-            active = sum(1 for t in self.start_time if t is not None and timer.current_time - t <= self.time)
+                _, idx = heapq.heappop(self._slot_heap)
+            self.start_time[idx] = now
+            heapq.heappush(self._slot_heap, (now, idx))
+            active = self.length - len(self._free_slots)
             self.current = min(self.upper_limit, active)
 
+        self._reschedule()
         gained = self.current - prev
         if gained > 0:
+            if self._dirty is not None:
+                self._mark_dirty()
             self._apply_resource_on_gain(gained)
 
 
@@ -131,18 +210,15 @@ class State:
                 self.current = 0
                 self.start_time = 0
         elif self.type == 2:
-            active_count = 0
-            for i, t in enumerate(self.start_time):
-                if t is None:
-                    continue
-                if timer.current_time - t > self.time:
-                    self.start_time[i] = None
-                else:
-                    active_count += 1
+            self._expire_slots(timer.current_time)
+            active_count = self.length - len(self._free_slots)
             self.current = min(self.upper_limit, active_count)
 
+        self._reschedule()
         lost = prev - self.current
         if lost > 0:
+            if self._dirty is not None:
+                self._mark_dirty()
             self._apply_resource_on_lose(lost)
 
     def force_clear(self):
@@ -152,20 +228,95 @@ class State:
         """
         if self.current <= 0:
             # 清一下时间也行，看你需求
-            if self.type == 1:
-                self.start_time = 0
-            elif self.type == 2:
-                self.start_time = [None] * self.length
+            self._reset_slots()
             return
 
         prev = self.current
         self.current = 0
+        if self._dirty is not None:
+            self._mark_dirty()
         self._apply_resource_on_lose(prev)
+        self._reset_slots()
 
+    def resize(self, length):
+        """
+        修改计时槽数量（直接改 length 不会同步计时槽）。
+        type=2：保留最近开始的 length 层，层数随之截断；type=1 只改字段。
+        """
+        length = int(length)
+        self.length = length
+        if self.type != 2:
+            return
+        starts = sorted(t for t in self.start_time if t is not None)[-length:] if length > 0 else []
+        self.start_time = starts + [None] * (length - len(starts))
+        # 已排序的列表本身就是合法的最小堆
+        self._slot_heap = [(t, idx) for idx, t in enumerate(starts)]
+        self._free_slots = list(range(len(starts), length))
+        if starts:
+            self.current = min(self.current, self.upper_limit, len(starts))
+        self._reschedule()
+
+    # ---------- 内部：计时槽与过期调度 ----------
+
+    def _reset_slots(self):
         if self.type == 1:
             self.start_time = 0
         elif self.type == 2:
             self.start_time = [None] * self.length
+            self._slot_heap = []
+            self._free_slots = list(range(self.length))
+        self._reschedule()
+
+    def _expire_slots(self, now):
+        """type=2：从堆顶开始释放所有已过期（now - t > time）的槽"""
+        heap = self._slot_heap
+        while heap and now - heap[0][0] > self.time:
+            _, idx = heapq.heappop(heap)
+            self.start_time[idx] = None
+            heapq.heappush(self._free_slots, idx)
+
+    def next_expire_time(self):
+        """
+        下一次可能发生过期的时间点；None 表示不会因时间过期。
+        （层数与计时槽不一致时返回 -inf，要求尽快结算一次）
+        """
+        if self.expire_mode == "resource":
+            return None
+        if self.type == 1:
+            return self.start_time + self.time if self.current > 0 else None
+        if self.current != min(self.upper_limit, self.length - len(self._free_slots)):
+            return float("-inf")
+        if self._slot_heap:
+            return self._slot_heap[0][0] + self.time
+        return None
+
+    def next_expire_instant(self, now):
+        """
+        下一次真正发生过期的时刻：满足 t - start > time 的最小浮点数（与 remove 的判断一致）；
+        None 表示不会因时间过期，层数与计时槽不一致时返回 now。
+        """
+        key = self.next_expire_time()
+        if key is None:
+            return None
+        if key == float("-inf"):
+            return now
+        start = self.start_time if self.type == 1 else self._slot_heap[0][0]
+        t = key
+        while t - start <= self.time:
+            t = math.nextafter(t, math.inf)
+        return t
+
+    def _reschedule(self):
+        """把下一次过期时间登记到所属 StateManager 的过期堆（未登记则忽略）"""
+        sch = self._scheduler
+        if sch is None:
+            return
+        key = self.next_expire_time()
+        if key is None:
+            self._scheduled_at = None
+        elif key != self._scheduled_at:
+            self._scheduled_at = key
+            sch._push_expiry(key, self)
 
     
     # ---------- 内部：根据层数变化，结算资源改动 ----------
@@ -219,20 +370,172 @@ class State:
 class StateManager:
     """
     状态管理类：统一管理多个 State
+
+    过期采用事件驱动：每个 State 把“下一次过期时间”登记到最小堆
+    [(expire_time, seq, state), ...]，update(timer) 只处理堆顶已到期的状态，
+    而不是每次都轮询所有状态的所有计时槽。
     """
+    # 浮点容差：到期判断最终仍由 State.remove 按 now - t > time 精确决定
+    EXPIRE_EPS = 1e-9
+
     def __init__(self, states=None):
-        self.states = list(states) if states is not None else []
+        self.states = []
+        self._positions = {}
+        self._expiry_heap = []
+        self._seq = 0  # 同一时刻过期的登记按先后顺序出堆（普通 int，保证可 pickle）
+        for st in (states or []):
+            self.add_state(st)
 
     def add_state(self, state: State):
         self.states.append(state)
+        self._register(state)
+
+    def _register(self, state: State):
+        self._positions.setdefault(state, len(self._positions))
+        state._scheduler = self
+        state._scheduled_at = None
+        state._reschedule()
+
+    def reschedule_all(self):
+        """
+        按各状态当前的 start_time / time 重新登记过期堆。
+        直接改了 State.time 等计时字段之后，堆里旧的过期时间已经不对（Character.compile() 会自动调用）。
+        """
+        self._expiry_heap.clear()
+        for st in self.states:
+            self._register(st)
+
+    def _push_expiry(self, key, state: State):
+        self._seq += 1
+        heapq.heappush(self._expiry_heap, (key, self._seq, state))
 
     def update(self, timer: Timer):
-        """每次行动前/后调用一次，用于移除过期状态"""
-        for s in self.states:
-            s.remove(timer)
+        """每次行动前/后调用一次，用于移除过期状态（只处理已到期的状态）"""
+        if len(self._positions) != len(self.states):
+            # 兼容直接往 states 列表里 append 的写法
+            for st in self.states:
+                if st not in self._positions:
+                    self._register(st)
+
+        heap = self._expiry_heap
+        if not heap:
+            return
+        limit = timer.current_time + self.EXPIRE_EPS
+        if heap[0][0] > limit:
+            return
+
+        due = []
+        while heap and heap[0][0] <= limit:
+            key, _, st = heapq.heappop(heap)
+            # 过期登记可能已经被更新（重新叠层 / 被清空），只处理仍然有效的那条
+            if st._scheduled_at == key and st._scheduler is self:
+                st._scheduled_at = None
+                due.append(st)
+        if len(due) > 1:
+            # 与旧版轮询一致：按状态登记顺序结算
+            pos = self._positions
+            due.sort(key=lambda st: pos[st])
+        for st in due:
+            st.remove(timer)
 
 
 # ===================== Resource 类 =====================
+class ResourceBank:
+    """
+    资源库：把一组资源的 current / upper_limit / consume_total 存在连续的 array('d') 向量中，
+    每个 Resource 只是 (bank, idx) 的轻量视图。
+
+    - 快照/回滚：整条向量拷贝（capture / restore），不再逐个资源读写
+    - 批量结算：apply_deltas(indices, amounts) 一次性加减并 clamp 到 [0, upper]
+
+    每个 Resource 创建时先放在自己独占的小资源库里，
+    Character.compile() 时再统一收拢到角色的资源库（adopt）。
+    """
+    EPS = 1e-9
+
+    def __init__(self, resources=()):
+        self.current = array("d")
+        self.upper = array("d")
+        self.consume_total = array("d")
+        self.produce_total = array("d")
+        self.resources = []
+        self.retired = False  # 有资源被别的资源库接管后置 True，持有者需要重新编译
+        # 脏标记（Character.compile() 填充）：_dependents[i] 为依赖第 i 个资源的元操作，变化时记进 _dirty
+        self._dependents = None
+        self._dirty = None
+        for r in resources:
+            self.adopt(r)
+
+    def __len__(self):
+        return len(self.resources)
+
+    def _append(self, res, upper_limit, current, consume_total=0.0, produce_total=0.0):
+        res._bank = self
+        res._idx = len(self.resources)
+        self.resources.append(res)
+        self.upper.append(upper_limit)
+        self.current.append(current)
+        self.consume_total.append(consume_total)
+        self.produce_total.append(produce_total)
+
+    def adopt(self, res):
+        """把资源（连同当前数值）迁入本资源库"""
+        old = res._bank
+        if old is self:
+            return
+        i = res._idx
+        self._append(res, old.upper[i], old.current[i], old.consume_total[i], old.produce_total[i])
+        old.retired = True
+
+    def capture(self):
+        """拷贝 current / consume_total / produce_total 三条向量"""
+        return self.current[:], self.consume_total[:], self.produce_total[:]
+
+    def restore(self, snap):
+        cur, ct, pt = snap
+        self.current[:] = cur
+        self.consume_total[:] = ct
+        self.produce_total[:] = pt
+
+    def update(self, i: int, amount: float):
+        """与 Resource.update 语义一致：amount<0 消耗（不足时报错），amount>0 恢复（clamp 到上限）"""
+        deps = self._dependents
+        if deps is not None and deps[i]:
+            self._dirty.update(deps[i])
+        cur = self.current
+        if amount < 0:
+            if cur[i] + amount < -self.EPS:
+                raise ValueError(f"资源 {self.resources[i].id} 数量不足")
+            self.consume_total[i] -= amount  # amount 是负数，实际消耗是 -amount
+            v = cur[i] + amount
+            cur[i] = v if v > 0 else 0.0
+        elif amount > 0:
+            old = cur[i]
+            v = old + amount
+            up = self.upper[i]
+            cur[i] = v if v < up else up
+            self.produce_total[i] += cur[i] - old
+
+    def apply_deltas(self, indices, amounts):
+        """批量加减（按顺序结算），每一项都 clamp 到 [0, upper]，消耗/实际获得分别计入 consume_total / produce_total"""
+        cur, up, ct, pt = self.current, self.upper, self.consume_total, self.produce_total
+        deps = self._dependents
+        for i, a in zip(indices, amounts):
+            if deps is not None and deps[i]:
+                self._dirty.update(deps[i])
+            if a < 0:
+                if cur[i] + a < -self.EPS:
+                    raise ValueError(f"资源 {self.resources[i].id} 数量不足")
+                ct[i] -= a
+                v = cur[i] + a
+                cur[i] = v if v > 0 else 0.0
+            elif a > 0:
+                old = cur[i]
+                v = old + a
+                cur[i] = v if v < up[i] else up[i]
+                pt[i] += cur[i] - old
+
+
 class Resource:
     """
     资源类，所有资源都需要继承这个类或直接使用这个类
@@ -242,26 +545,59 @@ class Resource:
     2. upper_limit: 资源数量上限
     3. current: 当前数量
     4. consume_total: 累计消耗总量（可用于统计）
+    5. produce_total: 累计实际获得总量（clamp 之后真正加上的量，可用于统计/规划目标）
+
+    数值实际存放在 ResourceBank 的向量里，上面几个数值属性都是对向量的读写视图；
+    向量是 array('d')，所以即使用 int 构造，读出来也总是 float。
     """
     def __init__(self, id, upper_limit, current):
         self.id = id
-        self.upper_limit = upper_limit
-        self.current = current
-        self.consume_total = 0
+        self._bank = None
+        self._idx = -1
+        ResourceBank()._append(self, upper_limit, current)
+
+    @property
+    def current(self):
+        return self._bank.current[self._idx]
+
+    @current.setter
+    def current(self, value):
+        bank = self._bank
+        deps = bank._dependents
+        if deps is not None and deps[self._idx]:
+            bank._dirty.update(deps[self._idx])
+        bank.current[self._idx] = value
+
+    @property
+    def upper_limit(self):
+        return self._bank.upper[self._idx]
+
+    @upper_limit.setter
+    def upper_limit(self, value):
+        self._bank.upper[self._idx] = value
+
+    @property
+    def consume_total(self):
+        return self._bank.consume_total[self._idx]
+
+    @consume_total.setter
+    def consume_total(self, value):
+        self._bank.consume_total[self._idx] = value
+
+    @property
+    def produce_total(self):
+        return self._bank.produce_total[self._idx]
+
+    @produce_total.setter
+    def produce_total(self, value):
+        self._bank.produce_total[self._idx] = value
 
     def update(self, amount: float):
         """
         amount < 0: 消耗资源
         amount > 0: 获得资源（不超过上限）
         """
-        EPS = 1e-9
-        if amount < 0:
-            if self.current + amount < -EPS:
-                raise ValueError(f"资源 {self.id} 数量不足")
-            self.consume_total -= amount  # amount 是负数，实际消耗是 -amount
-            self.current = max(0, self.current + amount)
-        elif amount > 0:
-            self.current = min(self.upper_limit, self.current + amount)
+        self._bank.update(self._idx, amount)
 
     def __repr__(self):
         return f"<Resource id={self.id}, current={self.current}/{self.upper_limit}>"
@@ -318,35 +654,6 @@ class ResourceStateRule:
             if active:
                 self.state.add(timer)
 
-class ShadowResourceProxy:
-    """
-    影子资源代理：接口长得像 Resource，但内部读写的是 temp 数值表。
-    """
-    def __init__(self, real_res: Resource, temp_dict: dict):
-        self._real = real_res
-        self._temp = temp_dict  # {real_res: [cur, upper]}
-        self.id = real_res.id
-
-    @property
-    def upper_limit(self):
-        return self._temp[self._real][1]
-
-    @property
-    def current(self):
-        return self._temp[self._real][0]
-
-    def update(self, amount: float):
-        EPS = 1e-9
-        cur, lim = self._temp[self._real]
-        if amount < 0:
-            if cur + amount < -EPS:
-                raise ValueError(f"[shadow] 资源 {self.id} 数量不足")
-            cur = max(0.0, cur + amount)
-        elif amount > 0:
-            cur = min(lim, cur + amount)
-        self._temp[self._real][0] = cur
-
-
 class ResourceStateRemoveRule:
     """
     资源移除状态规则：
@@ -433,6 +740,9 @@ class ResourceRegenRule:
         if dt <= 0:
             return
         amount = self.rate_per_sec * dt
+        if amount < 0:
+            # 衰减最多衰减到 0，不因时间流逝报“资源不足”
+            amount = max(amount, -self.resource.current)
         if amount != 0:
             self.resource.update(amount)
 
@@ -543,7 +853,10 @@ class StateEffect:
         if self.resource is not None and self.resource is not res:
             return amount
 
-        # 执行运算
+        return self._apply_value(amount)
+
+    def _apply_value(self, amount):
+        """执行 op/value 运算（不做任何条件判断）"""
         op = self.op
         v = self.value
 
@@ -567,6 +880,164 @@ class StateEffect:
 
 
 
+class _OperationKernel:
+    """
+    Operation 的预编译结算内核（由 Character.compile() 生成）：
+    - 消耗 / 产出各一条固定长度的基础数值向量（按资源去重，顺序与旧版 dict 一致）
+    - 每个资源位置上生效的 StateEffect 列表、作用于本 op 的效率规则
+    - 依赖的 State 列表：其层数不变时，test() 与 operate() 之间复用同一次结算结果
+    - 编译时 Operation 配置列表的拷贝（src）：Operation._live_kernel() 每次使用前与现值对比，
+      resource_consumes 等被原地修改或整个替换后按新配置重建，不需要手动 invalidate()
+
+    修正规则以数据（而不是闭包）保存，保证角色可以 pickle / deepcopy。
+    """
+    __slots__ = (
+        "bank", "src",
+        "c_res", "c_idx", "c_base", "c_upper", "c_lower", "c_effects",
+        "p_res", "p_idx", "p_base", "p_effects",
+        "efficiency", "deps",
+        "c_key", "c_val", "p_key", "p_val",
+    )
+
+    def __init__(self, op, bank):
+        self.bank = bank
+        self.src = self._source(op)
+
+        # 消耗：同一资源重复出现时，与旧版 dict 写法一致（位置取首次，数值取最后一次）
+        pos = {}
+        for i, res in enumerate(op.resource_requirements):
+            pos[res] = i
+        self.c_res = list(pos.keys())
+        self.c_idx = [r._idx for r in self.c_res]
+        self.c_upper = [op.consume_upper_limits[pos[r]] for r in self.c_res]
+        self.c_lower = [op.consume_lower_limits[pos[r]] for r in self.c_res]
+        self.c_base = []
+        for r, upper, lower in zip(self.c_res, self.c_upper, self.c_lower):
+            c = op.resource_consumes[pos[r]]
+            if upper is not None:
+                c = min(c, upper)
+            if lower is not None:
+                c = max(c, lower)
+            self.c_base.append(c)
+
+        pmap = {}
+        for out_res, base_prod in zip(op.resource_outputs, op.resource_produces):
+            pmap[out_res] = base_prod
+        self.p_res = list(pmap.keys())
+        self.p_idx = [r._idx for r in self.p_res]
+        self.p_base = list(pmap.values())
+
+        def effects_for(res, kind):
+            return tuple(eff for eff in op.state_effects
+                         if eff.target in ("both", kind) and (eff.resource is None or eff.resource is res))
+
+        self.c_effects = [effects_for(r, "consume") for r in self.c_res]
+        self.p_effects = [effects_for(r, "produce") for r in self.p_res]
+        self.efficiency = list(op._efficiency_index or ())
+
+        deps = {}
+        for eff in op.state_effects:
+            deps[eff.state] = None
+        for st, _ in self.efficiency:
+            deps[st] = None
+        self.deps = tuple(deps)
+
+        self.c_key = self.c_val = None
+        self.p_key = self.p_val = None
+
+    @staticmethod
+    def _source(op):
+        """内核依赖的 Operation 配置列表（拷贝）"""
+        return (list(op.resource_requirements), list(op.resource_consumes), list(op.consume_upper_limits),
+                list(op.consume_lower_limits), list(op.resource_outputs), list(op.resource_produces),
+                list(op.state_effects))
+
+    def matches(self, op):
+        """Operation 的配置列表是否仍与编译时一致"""
+        src = self.src
+        return (op.resource_consumes == src[1] and op.resource_produces == src[5]
+                and op.consume_upper_limits == src[2] and op.consume_lower_limits == src[3]
+                and op.resource_requirements == src[0] and op.resource_outputs == src[4]
+                and op.state_effects == src[6])
+
+    def rebuild(self, op):
+        """按 Operation 的新配置重建；涉及不在本资源库里的资源时返回 None（回退为通用 dict 结算）"""
+        bank = self.bank
+        if all(r._bank is bank for r in op.resource_requirements) and all(r._bank is bank for r in op.resource_outputs):
+            return _OperationKernel(op, bank)
+        return None
+
+    def _key(self, state_manager):
+        return (state_manager is not None,) + tuple(st.current for st in self.deps)
+
+    def _run(self, base, res_list, effects, kind, state_manager):
+        amts = list(base)
+        for p, effs in enumerate(effects):
+            if not effs:
+                continue
+            a = amts[p]
+            for eff in effs:
+                cur = eff.state.current
+                if cur < eff.min_stack:
+                    continue
+                if eff.max_stack is not None and cur > eff.max_stack:
+                    continue
+                a = eff._apply_value(a)
+            amts[p] = a
+
+        if state_manager is not None:
+            for st, rule in self.efficiency:
+                if st.current <= 0:
+                    continue
+                if rule.target not in ("both", kind):
+                    continue
+                m = float(getattr(rule, "mul", 1.0) or 1.0)
+                mps = float(getattr(rule, "mul_per_stack", 0.0) or 0.0)
+                if mps != 0.0 and getattr(rule, "by_current_stack", True):
+                    m = m + mps * st.current
+                mn = float(getattr(rule, "min_mul", 0.0))
+                mx = float(getattr(rule, "max_mul", 10.0))
+                if m < mn: m = mn
+                if m > mx: m = mx
+                target = getattr(rule, "resource", None)
+                if target is None:
+                    for p in range(len(amts)):
+                        amts[p] = amts[p] * m
+                else:
+                    for p, r in enumerate(res_list):
+                        if r is target:
+                            amts[p] = amts[p] * m
+        return amts
+
+    def consume(self, state_manager):
+        """返回与 c_res 对齐的实际消耗量列表（已 clamp）"""
+        key = self._key(state_manager)
+        if key == self.c_key:
+            return self.c_val
+        amts = self._run(self.c_base, self.c_res, self.c_effects, "consume", state_manager)
+        for p, amt in enumerate(amts):
+            if amt < 0:
+                amt = 0
+            upper = self.c_upper[p]
+            lower = self.c_lower[p]
+            if upper is not None:
+                amt = min(amt, upper)
+            if lower is not None:
+                amt = max(amt, lower)
+            amts[p] = amt
+        self.c_key, self.c_val = key, amts
+        return amts
+
+    def produce(self, state_manager):
+        """返回与 p_res 对齐的理论产出量列表（不做上限 clamp）"""
+        key = self._key(state_manager)
+        if key == self.p_key:
+            return self.p_val
+        amts = self._run(self.p_base, self.p_res, self.p_effects, "produce", state_manager)
+        self.p_key, self.p_val = key, amts
+        return amts
+
+
 # ===================== Operation 类 =====================
 class Operation:
     """
@@ -584,6 +1055,8 @@ class Operation:
     9. resource_state_rules: 资源到达某值时触发状态的规则列表 [ResourceStateRule,...]
     10. state_requirements: 状态需求列表 [(State, min_stack), ...]，满足才可释放
     11. state_forbids: 禁止状态列表 [State,...]，若当前有该状态（current > 0）则无法释放
+    12. probability: 产出生效概率（0~1，默认 1）。<1 时每次执行掷一次骰子，
+        未命中则照常消耗、耗时，但不产出资源、不施加 statesoutput
     """
 
     def __init__(
@@ -604,6 +1077,7 @@ class Operation:
         state_effects=None,
         max_charges = 1,
         charge_cd = 0.0,
+        probability: float = 1.0,
     ):
         # 基本信息
         self.id = id
@@ -666,6 +1140,23 @@ class Operation:
         self.charge_cd = cd
         self.charges = mc
         self.charge_clock = 0.0
+        # 产出生效概率
+        self.probability = 1.0 if probability is None else float(probability)
+        # 由 Character.compile() 填充的倒排索引；None 表示未编译，回退为遍历全部状态
+        self._accelerate_index = None
+        self._efficiency_index = None
+        # 由 Character.compile() 生成的结算内核；None 表示走通用 dict 结算
+        self._kernel = None
+
+    def _live_kernel(self):
+        """
+        取预编译内核；编译后 resource_consumes / resource_produces / 上下限 / state_effects 等
+        被修改过（原地或整个替换）时先按新配置重建，保证与直接读列表的结果一致。
+        """
+        kernel = self._kernel
+        if kernel is not None and not kernel.matches(self):
+            kernel = self._kernel = kernel.rebuild(self)
+        return kernel
 
     def configure_charges(self, max_charges: int = 1, charge_cd: float = 0.0, init_charges=None):
         mc = int(max_charges) if max_charges is not None else 1
@@ -738,38 +1229,37 @@ class Operation:
 
         new_map = dict(amount_map)
 
-        for st in state_manager.states:
+        index = self._efficiency_index
+        if index is None:
+            index = [(st, rule) for st in state_manager.states
+                     for rule in getattr(st, "op_efficiency_rules", None) or ()
+                     if rule.operation is self]
+
+        for st, rule in index:
             if st.current <= 0:
                 continue
-            rules = getattr(st, "op_efficiency_rules", None)
-            if not rules:
+            if rule.target not in ("both", target_kind):
                 continue
 
-            for rule in rules:
-                if rule.operation is not self:
-                    continue
-                if rule.target not in ("both", target_kind):
-                    continue
-
-                # 计算 effective_mul（可按层数）
-                m = float(getattr(rule, "mul", 1.0) or 1.0)
-                mps = float(getattr(rule, "mul_per_stack", 0.0) or 0.0)
-                if mps != 0.0 and getattr(rule, "by_current_stack", True):
-                    m = m + mps * st.current
-
-                mn = float(getattr(rule, "min_mul", 0.0))
-                mx = float(getattr(rule, "max_mul", 10.0))
-                if m < mn: m = mn
-                if m > mx: m = mx
-
-                # 应用到指定资源 or 全部资源
-                if getattr(rule, "resource", None) is None:
-                    for res in list(new_map.keys()):
-                        new_map[res] = new_map[res] * m
-                else:
-                    res = rule.resource
-                    if res in new_map:
-                        new_map[res] = new_map[res] * m
+            # 计算 effective_mul（可按层数）
+            m = float(getattr(rule, "mul", 1.0) or 1.0)
+            mps = float(getattr(rule, "mul_per_stack", 0.0) or 0.0)
+            if mps != 0.0 and getattr(rule, "by_current_stack", True):
+                m = m + mps * st.current
+
+            mn = float(getattr(rule, "min_mul", 0.0))
+            mx = float(getattr(rule, "max_mul", 10.0))
+            if m < mn: m = mn
+            if m > mx: m = mx
+
+            # 应用到指定资源 or 全部资源
+            if getattr(rule, "resource", None) is None:
+                for res in list(new_map.keys()):
+                    new_map[res] = new_map[res] * m
+            else:
+                res = rule.resource
+                if res in new_map:
+                    new_map[res] = new_map[res] * m
 
         return new_map
 
@@ -782,6 +1272,10 @@ class Operation:
 
         不考虑当前资源，只考虑配置 + 状态修正。
         """
+        kernel = self._live_kernel() if state_override is None else None
+        if kernel is not None:
+            return dict(zip(kernel.c_res, kernel.consume(state_manager)))
+
         raw_map = {}
         for i, (res, base) in enumerate(zip(self.resource_requirements, self.resource_consumes)):
             c = base
@@ -823,6 +1317,10 @@ class Operation:
         返回：
             produce_map: dict { Resource对象 : 理论产出量 }（可能为 0 或正数）
         """
+        kernel = self._live_kernel() if state_override is None else None
+        if kernel is not None:
+            return dict(zip(kernel.p_res, kernel.produce(state_manager)))
+
         raw_map = {}
         for out_res, base_prod in zip(self.resource_outputs, self.resource_produces):
             raw_map[out_res] = base_prod
@@ -845,35 +1343,34 @@ class Operation:
         if state_manager is None:
             return base_time
 
+        index = self._accelerate_index
+        if index is None:
+            index = [(st, acc) for st in state_manager.states
+                     for acc in getattr(st, "op_accelerate_rules", None) or ()
+                     if acc.operation is self]
+
         total_ratio = 0.0
-        for st in state_manager.states:
+        for st, acc in index:
             if st.current <= 0:
                 continue
-            rules = getattr(st, "op_accelerate_rules", None)
-            if not rules:
-                continue
-
-            for acc in rules:
-                if acc.operation is not self:
-                    continue
 
-                # 1) 固定 ratio
-                r = float(getattr(acc, "ratio", 0.0) or 0.0)
-                # 2) 层数相关
-                rps = float(getattr(acc, "ratio_per_stack", 0.0) or 0.0)
-                if rps != 0.0:
-                    # 默认按当前层数动态决定
-                    if getattr(acc, "by_current_stack", True):
-                        stack = st.current
-                        r += rps * stack
-                # clamp
-                mn = float(getattr(acc, "min_ratio", 0.0))
-                mx = float(getattr(acc, "max_ratio", 0.95))
-                if r < mn:
-                    r = mn
-                if r > mx:
-                    r = mx
-                total_ratio += r
+            # 1) 固定 ratio
+            r = float(getattr(acc, "ratio", 0.0) or 0.0)
+            # 2) 层数相关
+            rps = float(getattr(acc, "ratio_per_stack", 0.0) or 0.0)
+            if rps != 0.0:
+                # 默认按当前层数动态决定
+                if getattr(acc, "by_current_stack", True):
+                    stack = st.current
+                    r += rps * stack
+            # clamp
+            mn = float(getattr(acc, "min_ratio", 0.0))
+            mx = float(getattr(acc, "max_ratio", 0.95))
+            if r < mn:
+                r = mn
+            if r > mx:
+                r = mx
+            total_ratio += r
 
         factor = 1.0 - total_ratio
         if factor < 0.0:
@@ -901,21 +1398,6 @@ class Operation:
 
         return True
 
-    def _check_state_conditions_shadow(self, shadow_state_map):
-        """
-        使用影子 State 检查状态条件。
-        shadow_state_map: { 原始State : 影子State }
-        """
-        for st, need in self.state_requirements:
-            cur = shadow_state_map[st].current
-            if cur < need:
-                return False
-        for st in self.state_forbids:
-            cur = shadow_state_map[st].current
-            if cur > 0:
-                return False
-        return True
-
     # ---------- 综合合法性：资源 + 状态 ----------
     def test(self, state_manager=None):
         """
@@ -937,6 +1419,14 @@ class Operation:
                 return False
 
 
+        kernel = self._live_kernel()
+        if kernel is not None:
+            cur = kernel.bank.current
+            for i, need in zip(kernel.c_idx, kernel.consume(state_manager)):
+                if need > cur[i]:
+                    return False
+            return True
+
         consume_map = self._calc_consume_amounts(state_manager=state_manager)
 
         # 资源不足就放不出技能
@@ -946,9 +1436,10 @@ class Operation:
 
         return True
 
-    def operate(self, timer: Timer, state_manager: StateManager = None, *, apply_statesoutput: bool = True):
+    def operate(self, timer: Timer, state_manager: StateManager = None, *, apply_statesoutput: bool = True, rng=None):
         """
         执行一次操作：
+        rng: probability < 1 时用来掷骰子的 random.Random（None 时用 random 模块的全局随机源）
 
         返回：
             [操作id, 已执行次数, 当前时间, 消耗信息{res_id: consume}]
@@ -964,20 +1455,40 @@ class Operation:
                 raise ValueError(f"操作 {self.id} 充能不足，无法执行")
             self.charges -= 1
 
-        # 1. 资源消耗
-        consume_map = self._calc_consume_amounts(state_manager=state_manager)
-        for res, c in consume_map.items():
-            # 为安全起见再 check 一下
-            if c > res.current:
-                raise ValueError(f"执行 {self.id} 时资源 {res.id} 不足（需要 {c}，当前 {res.current}）")
-            res.update(-c)
-
-        # 2. 资源产出
-        produce_map = self._calc_produce_amounts(state_manager=state_manager)
-        for out_res, amt in produce_map.items():
-            if amt <= 0:
-                continue
-            out_res.update(amt)
+        # 概率产出：只有 probability < 1 时才掷骰子，确定性配置不消耗随机数
+        hit = self.probability >= 1.0 or (rng or random).random() < self.probability
+
+        kernel = self._live_kernel()
+        if kernel is not None:
+            # 1/2. 预编译内核：test() 刚算过且状态没变时直接复用结果
+            bank = kernel.bank
+            consumes = kernel.consume(state_manager)
+            cur = bank.current
+            for res, i, c in zip(kernel.c_res, kernel.c_idx, consumes):
+                if c > cur[i]:
+                    raise ValueError(f"执行 {self.id} 时资源 {res.id} 不足（需要 {c}，当前 {cur[i]}）")
+                bank.update(i, -c)
+            if hit:
+                for i, amt in zip(kernel.p_idx, kernel.produce(state_manager)):
+                    if amt > 0:
+                        bank.update(i, amt)
+            consume_items = zip(kernel.c_res, consumes)
+        else:
+            # 1. 资源消耗
+            consume_map = self._calc_consume_amounts(state_manager=state_manager)
+            for res, c in consume_map.items():
+                # 为安全起见再 check 一下
+                if c > res.current:
+                    raise ValueError(f"执行 {self.id} 时资源 {res.id} 不足（需要 {c}，当前 {res.current}）")
+                res.update(-c)
+
+            # 2. 资源产出
+            produce_map = self._calc_produce_amounts(state_manager=state_manager) if hit else {}
+            for out_res, amt in produce_map.items():
+                if amt <= 0:
+                    continue
+                out_res.update(amt)
+            consume_items = consume_map.items()
 
         # 3. 资源→状态 规则触发（真实执行）
         for rule in self.resource_state_rules:
@@ -992,11 +1503,11 @@ class Operation:
         else:
             dt = getattr(self, "base_time", self.time)
         timer.update(dt)
-        if apply_statesoutput:
+        if apply_statesoutput and hit:
             for st in self.statesoutput:
                 st.add(timer)
 
-        consume_by_id = {res.id: c for res, c in consume_map.items()}
+        consume_by_id = {res.id: c for res, c in consume_items}
         return [self.id, self.counter, timer.current_time, consume_by_id]
 
     def __repr__(self):
@@ -1007,7 +1518,7 @@ class MetaOperation:
     """
     元操作：由若干 Operation 构成的固定序列
     - type=1: 线性资源，检测简单（所有 op.test() 为 True 即可）
-    - type=2: 非线性资源，使用“影子资源 + 影子状态 + 影子时间”完整模拟
+    - type=2: 非线性资源，快照后按真实执行流程完整模拟，再回滚（见 Character.snapshot / restore）
     - meta_state_requirements: [(State, min_stack), ...] 只有满足这些状态时，这个元操作才会进入候选列表
     - meta_state_forbids: [State, ...] 如果这些状态存在，则禁用这个元操作
     - base_priority: 基础优先级（整数，越大越优先）
@@ -1022,6 +1533,8 @@ class MetaOperation:
         self.base_priority = base_priority
         self.on_success_states = list(on_success_states) if on_success_states else []
         self.n = n # 尾部循环长度
+        # 由 Character.compile() 填充：[(State, priority_delta, min_stack), ...]；None 表示未编译
+        self._priority_index = None
         if self.n is not None:
             if self.n <= 0:
                 raise ValueError("MetaOperation 的 n 必须是正整数或 None")
@@ -1069,323 +1582,68 @@ class MetaOperation:
 
         # 3）叠加“状态对元操作优先级的修正”
         if state_manager is not None:
-            for st in state_manager.states:
-                if st.current <= 0:
-                    continue
-                if not getattr(st, "meta_priority_rules", None):
-                    continue
-
-                for rule in st.meta_priority_rules:
-                    # 兼容两种写法：(meta_op, delta) 或 (meta_op, delta, min_stack)
-                    if not isinstance(rule, (list, tuple)):
-                        continue
-                    if len(rule) >= 3:
-                        meta_op, delta, min_stack = rule[0], rule[1], rule[2]
-                    elif len(rule) == 2:
-                        meta_op, delta = rule
-                        min_stack = 1
-                    else:
-                        continue
-
-                    try:
-                        need = int(min_stack)
-                    except Exception:
-                        need = 1
-                    if need < 1:
-                        need = 1
-
-                    if meta_op is self and st.current >= need:
-                        priority += delta
+            index = self._priority_index
+            if index is None:
+                index = self._scan_priority_rules(state_manager)
+            for st, delta, need in index:
+                if st.current >= need:
+                    priority += delta
 
         return priority
 
 
-    def _build_shadow_states(self, state_manager: StateManager, shadow_res_map: dict):
-        """
-        从当前 StateManager 和所有 Operation 中，构建“原始State -> 影子State”的映射，
-        并返回影子 StateManager。
-        """
-        shadow_map = {}
-        def _clone_resource_effects(st: State):
-            if not getattr(st, "resource_effects", None):
-                return []
-            cloned = []
-            for eff in st.resource_effects:
-                real_r = eff.resource
-                if real_r not in shadow_res_map:
-                    # 影子模拟 temp 里没用到这个资源，就跳过（或你也可以强制加入 temp）
-                    continue
-                cloned.append(StateResourceEffect(
-                    resource=shadow_res_map[real_r],
-                    on_add=eff.on_add,
-                    on_remove=eff.on_remove,
-                    per_stack=eff.per_stack,
-                    ratio_on_add=eff.ratio_on_add,
-                    ratio_on_remove=eff.ratio_on_remove,
-                ))
-            return cloned
-
-
-        # 1）先把 state_manager 中的状态都拷一份
+    def _scan_priority_rules(self, state_manager: StateManager):
+        """未编译时：遍历全部状态，找出作用于本元操作的 (State, delta, min_stack)"""
+        index = []
         for st in state_manager.states:
-            shadow = State(
-                st.id, 
-                st.current, 
-                st.upper_limit, 
-                st.time, st.type, 
-                st.length, 
-                resource_effects = _clone_resource_effects(st), 
-                meta_priority_rules = list(st.meta_priority_rules),
-                op_accelerate_rules = list(getattr(st, "op_accelerate_rules", [])),
-                op_efficiency_rules = list(getattr(st, "op_efficiency_rules", [])),
-                expire_mode=getattr(st, "expire_mode", "time"),
-            )
-            # 拷贝 start_time（保持相对时间关系）
-            if st.type == 1:
-                shadow.start_time = st.start_time
-            elif st.type == 2:
-                shadow.start_time = list(st.start_time)
-            shadow_map[st] = shadow
-
-        # 2）确保所有 Operation 用到的 State 都有影子
-        def ensure_shadow(st: State):
-            if st in shadow_map:
-                return
-            shadow = State(
-                st.id, 
-                st.current, 
-                st.upper_limit, 
-                st.time, 
-                st.type, 
-                st.length,
-                resource_effects = _clone_resource_effects(st),
-                meta_priority_rules = list(st.meta_priority_rules),
-                op_accelerate_rules = list(getattr(st, "op_accelerate_rules", [])),
-                op_efficiency_rules = list(getattr(st, "op_efficiency_rules", [])),
-                expire_mode=getattr(st, "expire_mode", "time"),
-            )
-            if st.type == 1:
-                shadow.start_time = st.start_time
-            elif st.type == 2:
-                shadow.start_time = list(st.start_time)
-            shadow_map[st] = shadow
+            for rule in getattr(st, "meta_priority_rules", None) or ():
+                rule = MetaPriorityRule.normalize(rule)
+                if rule is not None and rule.meta_op is self:
+                    index.append((st, rule.priority_delta, rule.min_stack))
+        return index
 
-        for op in self.operations:
-            for st, _ in op.state_requirements:
-                ensure_shadow(st)
-            for st in op.state_forbids:
-                ensure_shadow(st)
-            for eff in op.state_effects:
-                ensure_shadow(eff.state)
-            for st in op.statesoutput:
-                ensure_shadow(st)
-            # 资源-状态，规则里引用到的state也要有影子
-            for rule in getattr(op, "resource_state_rules", []):
-                ensure_shadow(rule.state)
-            # 资源-状态移除规则
-            for rule in getattr(op, "resource_state_remove_rules", []):
-                ensure_shadow(rule.state)
-
-        shadow_manager = StateManager(list(shadow_map.values()))
-        return shadow_map, shadow_manager
-
-    def _simulate_full(self, timer: Timer, state_manager: StateManager, regen_rules = None, op_trigger_rules = None):
-        """
-        使用影子 Resource / Timer / State 来完整模拟整个元操作：
-        - 状态条件用影子State判断
-        - 消耗/产出用影子State参与的 state_effects 计算
-        - 资源在 temp 上扣/加
-        - 时间用影子 Timer 推进并驱动影子 StateManager 过期
-        - 直接施加状态 (statesoutput) 作用在影子State上
-
-        不会修改真实 Resource / State / Timer。
+    def _simulate_full(self, timer: Timer, state_manager: StateManager, character=None):
         """
+        影子模拟整个元操作：
+        - 先对角色（或本元操作涉及的对象）拍一个快照
+        - 直接走真实的 Operation.test / operate / 回复 / 触发 / 过期 流程
+        - 结束后无论成功与否，都用快照回滚
 
-        # ---------- 影子资源 ----------
-        temp = {}
-        for op in self.operations:
-            for res in op.resource_requirements:
-                if res not in temp:
-                    temp[res] = [res.current, res.upper_limit]
-            for out in op.resource_outputs:
-                if out not in temp:
-                    temp[out] = [out.current, out.upper_limit]
-        for st in state_manager.states:
-            for eff in getattr(st, "resource_effects",[]) or []:
-                r = eff.resource
-                if r not in temp:
-                    temp[r] = [r.current, r.upper_limit]
-        
-        # 把resource_state_rules / remove_rules里涉及的资源也加入temp
-        for op in self.operations:
-            for rule in getattr(op, "resource_state_rules", []):
-                r = rule.resource
-                if r not in temp:
-                    temp[r] = [r.current, r.upper_limit]
-            for rule in getattr(op, "resource_state_remove_rules", []):
-                r = rule.resource
-                if r not in temp:
-                    temp[r] = [r.current, r.upper_limit]
-                    
-        shadow_res_map = {r: ShadowResourceProxy(r, temp) for r in temp.keys()}
-        # ---------- 影子状态 ----------
-        shadow_state_map, shadow_state_manager = self._build_shadow_states(state_manager, shadow_res_map)
-
-        # ---------- 影子时间 ----------
-        shadow_timer = Timer(total_time=timer.total_time)
-        shadow_timer.current_time = timer.current_time
-
-        shadow_charge = {}
-
-        for op in self.operations:
-            shadow_charge[op] = [getattr(op, "charges", 1), getattr(op, "charge_clock", 0.0)]
+        因为走的就是真实执行路径，影子模拟与 execute 的结算逻辑天然一致。
+        不会修改真实 Resource / State / Timer（执行完即回滚）。
 
-        def _regen_allowed(rule: ResourceRegenRule):
-            # 检查 regen_rule 的状态条件是否满足
-            for st, need in rule.state_requirements:
-                if shadow_state_map[st].current < need:
-                    return False
-            for st in rule.state_forbids:
-                if shadow_state_map[st].current > 0:
-                    return False
-            return True
+        含概率机制时：模拟成功则随机数状态一并回滚，紧接着的真实执行掷出同样的结果；
+        模拟失败则保留已经掷过的骰子（随机数状态不回滚），否则下一次模拟会掷出同样的失败结果，
+        这个元操作就再也不会被选中。
+        """
+        if character is not None and character.timer is timer:
+            layout = character._get_snapshot_layout()
+        else:
+            layout = SnapshotLayout.collect(timer, operations=self.operations, states=state_manager.states,
+                                            state_manager=state_manager)
 
-         # ✅ shadow: once 触发的“上一次是否满足”记录（不污染真实 rule.was_active）
-        shadow_was_active = {}
-        for op in self.operations:
-            for rule in getattr(op, "resource_state_rules", []) or []:
-                shadow_was_active[rule] = getattr(rule, "was_active", False)
-        
-        # ---------- 按顺序模拟每个 Operation ----------
-        last_tick = shadow_timer.current_time
-        for op in self.operations:
-            # 1. 用影子状态检查状态条件
-            if not op._check_state_conditions_shadow(shadow_state_map):
-                return False
-            
-            if getattr(op, "max_charges", 1) > 1:
-                ch, clk = shadow_charge[op]
-                if ch <= 0:
-                    return False
-                # 执行消耗1层
-                shadow_charge[op][0] = ch - 1
-
-            # 2. 资源门槛：至少要 >= consume_lower_limit（如果有）
-            for i, res in enumerate(op.resource_requirements):
-                lower = op.consume_lower_limits[i]
-                if lower is not None:
-                    cur, _ = temp[res]
-                    if cur < lower:
-                        return False
-            # 3. 计算理论消耗量（使用影子状态参与 state_effects）
-            consume_map = op._calc_consume_amounts(state_override=shadow_state_map, state_manager=shadow_state_manager)
-
-            # 扣除资源：任一步 cur < need ⇒ 整个失败
-            EPS = 1e-9
-            for res, need in consume_map.items():
-                cur, lim = temp[res]
-                if cur + EPS < need:
+        snap = layout.capture()
+        ok = False
+        try:
+            for op in self.operations:
+                if not op.test(state_manager=state_manager):
                     return False
-                temp[res][0] = max(cur - need, 0)
-
-            # 4. 模拟资源产出
-            produce_map = op._calc_produce_amounts(state_override=shadow_state_map, state_manager=shadow_state_manager)
-            for out_res, amount in produce_map.items():
-                if amount <= 0:
-                    continue
-                cur, lim = temp[out_res]
-                cur = min(lim, cur + amount)
-                temp[out_res][0] = cur
-            
-            # 4.5 影子触发：资源-状态（在时间推进前，和真实operate顺序一致）
-            for rule in getattr(op, "resource_state_rules", []) or []:
-                r = rule.resource
-                val = temp[r][0]
-
-                # 条件判断（和 ResourceStateRule._condition 一致）
-                if rule.mode == ">=":
-                    active = val >= rule.threshold
-                elif rule.mode == "<=":
-                    active = val <= rule.threshold
-                else:
-                    raise ValueError(f"未知比较模式: {rule.mode}")
-
-                if rule.once:
-                    prev_active = shadow_was_active.get(rule, False)
-                    if active and not prev_active:
-                        shadow_state_map[rule.state].add(shadow_timer)
-                        shadow_was_active[rule] = True
-                    elif not active:
-                        shadow_was_active[rule] = False
-                else:
-                    if active:
-                        shadow_state_map[rule.state].add(shadow_timer)
-            # 4.6 影子触发：资源-移除状态
-            for rule in getattr(op, "resource_state_remove_rules", []) or []:
-                r = rule.resource
-                val = temp[r][0]
-
-                if rule.mode == "<=":
-                    ok = val <= rule.threshold
-                elif rule.mode == ">=":
-                    ok = val >= rule.threshold
-                elif rule.mode == "==":
-                    ok = val == rule.threshold
+                op.operate(timer, state_manager, rng=getattr(character, "rng", None))
+                if character is not None:
+                    character._apply_time_regen()
+                    character._after_operation_executed(op)
                 else:
-                    raise ValueError(f"未知比较模式: {rule.mode}")
-
-                if not ok:
-                    continue
-
-                st_shadow = shadow_state_map[rule.state]
-                if rule.require_active and st_shadow.current <= 0:
-                    continue
-
-                # 用 State.force_clear()，确保影子资源改动（resource_effects）也会结算
-                st_shadow.force_clear()
-
-            # 5. 推进影子时间 & 状态过期
-            eff_time = op.get_effective_time(shadow_state_manager)
-            shadow_timer.update(eff_time)
-            for st in op.statesoutput:
-                shadow_state_map[st].add(shadow_timer)
-            dt = shadow_timer.current_time - last_tick
-            if dt > 0:
-                if regen_rules:
-                    for rule in regen_rules:
-                        # rule.resource是真实的Resource对象，用它来索引temp
-                        r = rule.resource
-                        if r in temp and _regen_allowed(rule):
-                            rate = rule.rate_per_sec
-                            newv = temp[r][0] + rate * dt
-                            temp[r][0] = max(0.0, min(temp[r][1], newv))  # 不超过上限
-                for op2 in self.operations:
-                    mc = int(getattr(op2, "max_charges", 1) or 1)
-                    cd = float(getattr(op2, "charge_cd", 0.0) or 0.0)
-                    if mc <= 1 or cd <= 0.0:
-                        continue
-                    ch, clk = shadow_charge[op2]
-                    if ch >= mc:
-                        shadow_charge[op2][1] = 0.0
-                        continue
-                    clk += dt
-                    gained = int(clk // cd)
-                    if gained > 0:
-                        ch = min(mc, ch + gained)
-                        clk -= gained * cd
-                    shadow_charge[op2] = [ch, clk]
-                if op_trigger_rules:
-                    for rule in op_trigger_rules:
-                        rule.try_apply(
-                            executed_op = op,
-                            timer = shadow_timer,
-                            state_override = shadow_state_map,
-                            res_override = shadow_res_map,
-                        )
-                last_tick = shadow_timer.current_time
-            shadow_state_manager.update(shadow_timer)
-
-        return True
+                    state_manager.update(timer)
+            ok = True
+            return True
+        except ValueError:
+            # 真实执行会报错（资源不足等）的，视为不可执行
+            return False
+        finally:
+            used = None if ok or not layout.stochastic else character.rng.getstate()
+            layout.restore(snap)
+            if used is not None:
+                character.rng.setstate(used)
 
     def can_execute(self, timer: Timer = None, state_manager: StateManager = None, character = None):
         """
@@ -1402,10 +1660,9 @@ class MetaOperation:
         elif self.type == 2:
             if timer is None or state_manager is None:
                 raise ValueError("MetaOperation(type=2).can_execute() 需要提供 timer 和 state_manager")
-            return self._simulate_full(timer, state_manager, 
-                                    regen_rules=getattr(character, "resource_regen_rules", None),
-                                    op_trigger_rules=getattr(character, "op_triggered_state_rules", None),
-                                    )
+            if character is not None and getattr(character, "feasibility_cache_size", 0) > 0:
+                return character._cached_feasibility(self, timer, state_manager)
+            return self._simulate_full(timer, state_manager, character=character)
         else:
             raise ValueError("MetaOperation.type 只能为 1 或 2")
 
@@ -1434,7 +1691,7 @@ class MetaOperation:
         
         # --- 执行 prefix ---
         for op in prefix_ops:
-            rec = op.operate(timer, state_manager)
+            rec = op.operate(timer, state_manager, rng=getattr(character, "rng", None))
             record_list.append(rec)
             if character is not None:
                 character._apply_time_regen()
@@ -1448,11 +1705,14 @@ class MetaOperation:
             if character is not None and character._has_higher_priority_meta_active(self):
                 break
             
-            # 逐个执行tail操作，任意一个失败就停止tail
+            # 逐个执行tail操作，任意一个失败（或到达 timer.total_time）就停止tail
             broke = False
             for op in tail_ops:
+                if timer.total_time is not None and timer.current_time >= timer.total_time:
+                    broke = True
+                    break
                 try:
-                    rec = op.operate(timer, state_manager)
+                    rec = op.operate(timer, state_manager, rng=getattr(character, "rng", None))
                 except Exception as e:
                     broke = True
                     break
@@ -1502,6 +1762,7 @@ class OperationTriggeredStateRule:
     - 必须不处于 forbidden_states
     - 必须满足 resource_thresholds
     满足则对 target_state add()（或 add 多层）
+    probability < 1 时，条件满足后再掷一次骰子决定是否触发
     """
     def __init__(
         self,
@@ -1513,6 +1774,7 @@ class OperationTriggeredStateRule:
         resource_thresholds=None,              # [ResourceThreshold(y,n,">="), ...]
         add_stacks: int = 1,                   # 满足后给 b 加几层
         once_per_operation_call: bool = True,  # 预留：未来多次触发控制
+        probability: float = 1.0,              # 触发概率
     ):
         self.trigger_operation = trigger_operation
         self.target_state = target_state
@@ -1521,6 +1783,7 @@ class OperationTriggeredStateRule:
         self.resource_thresholds = list(resource_thresholds) if resource_thresholds else []
         self.add_stacks = add_stacks
         self.once_per_operation_call = once_per_operation_call
+        self.probability = 1.0 if probability is None else float(probability)
 
     def _check_states(self, state_override=None) -> bool:
         for st, need in self.required_states:
@@ -1539,7 +1802,7 @@ class OperationTriggeredStateRule:
                 return False
         return True
 
-    def try_apply(self, executed_op: Operation, timer: Timer, *, state_override=None, res_override=None):
+    def try_apply(self, executed_op: Operation, timer: Timer, *, state_override=None, res_override=None, rng=None):
         # 必须是指定操作触发
         if executed_op is not self.trigger_operation:
             return
@@ -1549,6 +1812,8 @@ class OperationTriggeredStateRule:
             return
         if not self._check_resources(res_override=res_override):
             return
+        if self.probability < 1.0 and (rng or random).random() >= self.probability:
+            return
         tgt = state_override.get(self.target_state, self.target_state) if state_override else self.target_state
         # 触发：加 b 状态
         for _ in range(max(0, int(self.add_stacks))):
@@ -1598,6 +1863,735 @@ class OperationResourceEfficiency:
 
 
 
+# ===================== 快照（Snapshot） =====================
+class SnapshotLayout:
+    """
+    快照布局：固定一组对象的顺序，把它们所有“会在模拟中变化”的字段
+    按顺序压平成一个 list（扁平向量），回滚时再按同样的顺序写回。
+
+    覆盖的可变字段：
+    1. Timer.current_time
+    2. Character._last_tick_time（若有角色）
+    3. Resource: current / consume_total / produce_total（有 ResourceBank 时为整条向量的拷贝）
+    4. State: current / start_time（type=2 时逐槽展开）
+    5. Operation: charges / charge_clock / counter
+    6. ResourceStateRule: was_active
+    7. 过期调度：State 的槽堆 / 空槽堆 / 登记时间，StateManager 的过期堆
+    8. Character.rng 的内部状态（仅当存在 probability < 1 的操作或触发规则时）
+    9. Character 的元操作缓存写入次数（若有角色；回滚时据此决定缓存是否作废）
+
+    布局只描述“有哪些对象”，快照本身只是数值，拍快照/回滚都不分配新对象。
+    """
+    def __init__(self, timer: Timer, resources=(), states=(), operations=(), resource_state_rules=(), character=None,
+                 state_manager=None, resource_bank=None, stochastic=False, threshold_rules=()):
+        self.timer = timer
+        self.character = character
+        # 含概率机制时快照要带上随机数状态，影子模拟后回滚，真实执行掷出的结果与模拟一致
+        self.stochastic = stochastic and character is not None
+        self.state_manager = state_manager
+        self.resources = list(resources)
+        # 若所有资源都在同一个资源库里，快照直接整条向量拷贝
+        self.resource_bank = resource_bank
+        self.states = list(states)
+        self.operations = list(operations)
+        self.resource_state_rules = list(resource_state_rules)
+        # ResourceStateRule + ResourceStateRemoveRule（advance_to 检测阈值穿越用，不进快照）
+        self.threshold_rules = list(threshold_rules)
+
+    @classmethod
+    def collect(cls, timer: Timer, *, operations=(), states=(), resources=(), meta_operations=(),
+                regen_rules=(), op_trigger_rules=(), character=None, state_manager=None):
+        """
+        从给定对象出发，收集所有可能被执行修改到的 Resource / State / Operation / 规则，
+        去重并保持首次出现的顺序。
+        """
+        res_list, res_seen = [], set()
+        st_list, st_seen = [], set()
+        op_list, op_seen = [], set()
+        rule_list, rule_seen = [], set()
+        remove_list = []
+
+        def add_res(r):
+            if r is not None and r not in res_seen:
+                res_seen.add(r)
+                res_list.append(r)
+
+        def add_state(st):
+            if st is None or st in st_seen:
+                return
+            st_seen.add(st)
+            st_list.append(st)
+            for eff in st.resource_effects:
+                add_res(eff.resource)
+
+        def add_op(op):
+            if op in op_seen:
+                return
+            op_seen.add(op)
+            op_list.append(op)
+            for r in op.resource_requirements:
+                add_res(r)
+            for r in op.resource_outputs:
+                add_res(r)
+            for st in op.statesoutput:
+                add_state(st)
+            for st, _ in op.state_requirements:
+                add_state(st)
+            for st in op.state_forbids:
+                add_state(st)
+            for eff in op.state_effects:
+                add_state(eff.state)
+            for rule in op.resource_state_rules:
+                add_res(rule.resource)
+                add_state(rule.state)
+                if rule not in rule_seen:
+                    rule_seen.add(rule)
+                    rule_list.append(rule)
+            for rule in op.resource_state_remove_rules:
+                add_res(rule.resource)
+                add_state(rule.state)
+                if rule not in rule_seen:
+                    rule_seen.add(rule)
+                    remove_list.append(rule)
+
+        for r in resources:
+            add_res(r)
+        for st in states:
+            add_state(st)
+        for op in operations:
+            add_op(op)
+        for mop in meta_operations:
+            for op in mop.operations:
+                add_op(op)
+            for st in mop.on_success_states:
+                add_state(st)
+        for rule in regen_rules:
+            add_res(rule.resource)
+        stochastic = False
+        for rule in op_trigger_rules:
+            add_state(rule.target_state)
+            stochastic = stochastic or getattr(rule, "probability", 1.0) < 1.0
+        stochastic = stochastic or any(getattr(op, "probability", 1.0) < 1.0 for op in op_list)
+
+        return cls(timer, res_list, st_list, op_list, rule_list, character=character, state_manager=state_manager,
+                   stochastic=stochastic, threshold_rules=rule_list + remove_list)
+
+    def capture(self) -> list:
+        """拍快照：返回扁平 list（调用方不要修改它）"""
+        snap = [self.timer.current_time]
+        append = snap.append
+        if self.character is not None:
+            append(self.character._last_tick_time)
+        if self.stochastic:
+            append(self.character.rng.getstate())
+        if self.resource_bank is not None:
+            append(self.resource_bank.capture())
+        else:
+            for r in self.resources:
+                append(r.current)
+                append(r.consume_total)
+                append(r.produce_total)
+        for st in self.states:
+            append(st.current)
+            if st.type == 2:
+                snap.extend(st.start_time)
+                append(tuple(st._slot_heap))
+                append(tuple(st._free_slots))
+            else:
+                append(st.start_time)
+            append(st._scheduled_at)
+        for op in self.operations:
+            append(op.charges)
+            append(op.charge_clock)
+            append(op.counter)
+        for rule in self.resource_state_rules:
+            append(rule.was_active)
+        if self.state_manager is not None:
+            append(tuple(self.state_manager._expiry_heap))
+        if self.character is not None:
+            append(self.character._capture_dirty())
+        return snap
+
+    def restore(self, snap: list):
+        """按 capture 的顺序把数值写回对象"""
+        self.timer.current_time = snap[0]
+        i = 1
+        if self.character is not None:
+            self.character._last_tick_time = snap[1]
+            i = 2
+        if self.stochastic:
+            self.character.rng.setstate(snap[i])
+            i += 1
+        if self.resource_bank is not None:
+            self.resource_bank.restore(snap[i])
+            i += 1
+        else:
+            for r in self.resources:
+                r.current = snap[i]
+                r.consume_total = snap[i + 1]
+                r.produce_total = snap[i + 2]
+                i += 3
+        for st in self.states:
+            st.current = snap[i]
+            i += 1
+            if st.type == 2:
+                n = st.length
+                st.start_time[:] = snap[i:i + n]
+                st._slot_heap[:] = snap[i + n]
+                st._free_slots[:] = snap[i + n + 1]
+                i += n + 2
+            else:
+                st.start_time = snap[i]
+                i += 1
+            st._scheduled_at = snap[i]
+            i += 1
+        for op in self.operations:
+            op.charges = snap[i]
+            op.charge_clock = snap[i + 1]
+            op.counter = snap[i + 2]
+            i += 3
+        for rule in self.resource_state_rules:
+            rule.was_active = snap[i]
+            i += 1
+        if self.state_manager is not None:
+            self.state_manager._expiry_heap[:] = snap[i]
+            i += 1
+        if self.character is not None:
+            self.character._restore_dirty(snap[i])
+
+
+class RotationRecord(NamedTuple):
+    """iter_rotation 产出的单条记录（NamedTuple，没有实例 __dict__）"""
+    op_id: Any
+    counter: int
+    time: float
+    consume: tuple  # ((资源id, 消耗量), ...)
+
+
+ROTATION_MODES = ("meta", "greedy_ops")
+
+
+def _check_rotation_mode(mode):
+    """循环模式只认 "meta" / "greedy_ops"，拼错时报错而不是悄悄按 meta 跑"""
+    if mode not in ROTATION_MODES:
+        raise ValueError(f"未知的循环模式 {mode!r}，可选: {', '.join(ROTATION_MODES)}")
+
+
+class RotationCycle(NamedTuple):
+    """
+    detect_cycle 找到的稳态循环：从 start_time 起，每隔 period_steps 步 / period_time 秒，
+    角色状态（相对时间下）完全重复一次。op_counts / consume / produce 为一个周期内的增量。
+    """
+    warmup_steps: int
+    warmup_time: float
+    start_time: float
+    period_steps: int
+    period_time: float
+    op_counts: dict  # {操作id: 次数}
+    consume: dict    # {资源id: 消耗量}
+    produce: dict    # {资源id: 获得量}
+
+    def per_second(self):
+        """稳态下的速率：{"count:<op>", "consume_per_sec:<res>", "produce_per_sec:<res>"}"""
+        t = self.period_time
+        row = {f"count:{op_id}": n / t for op_id, n in self.op_counts.items()}
+        row.update({f"consume_per_sec:{rid}": c / t for rid, c in self.consume.items()})
+        row.update({f"produce_per_sec:{rid}": p / t for rid, p in self.produce.items()})
+        return row
+
+
+class SkippedCycles(NamedTuple):
+    """simulate_window(extrapolate=True) 在 WindowRecorder 里用来代替被跳过的 cycles 个周期的记录"""
+    cycles: int
+    time: float  # 跳过之后的时刻
+    op_counts: dict  # {操作id: 次数}（cycles 个周期合计）
+
+
+class WindowRecorder:
+    """
+    循环记录的接收端（可代替 list 传给 build_rotation_*(record_list=...)）：
+    每追加一条记录，顺带拍下此刻各资源的累计获得 / 消耗量，
+    之后可以在任意时刻 t 上按相邻两个记录点线性插值，得到截止到 t 的累计量（window()）。
+
+    记录点：起点、每条记录（时间取记录里的当前时间）、finish() 时的终点。
+    外推跳过的若干周期记为一条 SkippedCycles（见 skip()）。
+    """
+    def __init__(self, character):
+        self.character = character
+        self.records = []
+        self.res_ids = list(character.resources.keys())
+        self._res = list(character.resources.values())
+        self.start_time = character.timer.current_time
+        self.times = []
+        self.produce = []
+        self.consume = []
+        self._mark(self.start_time)
+
+    def _mark(self, t):
+        self.times.append(t)
+        self.produce.append([r.produce_total for r in self._res])
+        self.consume.append([r.consume_total for r in self._res])
+
+    def append(self, rec):
+        self.records.append(rec)
+        self._mark(rec[2])
+
+    def skip(self, cycle: RotationCycle, n: int):
+        """记下被解析外推跳过的 n 个周期（角色已由 Character._skip_cycles 推进）"""
+        counts = {op_id: k * n for op_id, k in cycle.op_counts.items()}
+        t = self.character.timer.current_time
+        self.records.append(SkippedCycles(n, t, counts))
+        self._mark(t)
+
+    def finish(self):
+        """循环结束后调用一次：记下终点（包含最后一步之后的回复 / 触发 / 等待）"""
+        self._mark(self.character.timer.current_time)
+        return self
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def window(self, end):
+        """
+        截止到 end 的窗口聚合（扁平 dict，列名与 sweep.summarize 风格一致）：
+            duration, op_records, count:<op>, produce:<res>, consume:<res>,
+            produce_per_sec:<res>, consume_per_sec:<res>
+        跨越 end 的那一步按时间比例折算：累计量在相邻两个记录点之间线性插值，
+        该条记录的操作次数记为比例值。
+        """
+        times = self.times
+        a = 0
+        while a + 1 < len(times) and times[a + 1] <= end:
+            a += 1
+        produce, consume = list(self.produce[a]), list(self.consume[a])
+        frac = 0.0
+        if a + 1 < len(times):
+            b = a + 1
+            span = times[b] - times[a]
+            frac = (end - times[a]) / span if span > 0 else 0.0
+            for i in range(len(produce)):
+                produce[i] += frac * (self.produce[b][i] - produce[i])
+                consume[i] += frac * (self.consume[b][i] - consume[i])
+
+        duration = end - self.start_time
+        row = {"duration": duration}
+        counts = {}
+        # 记录点 i（i>=1）对应第 i-1 条记录
+        for rec in self.records[:a]:
+            self._count(counts, rec, 1)
+        if frac > 0 and a < len(self.records):
+            self._count(counts, self.records[a], frac)
+        row["op_records"] = sum(counts.values())
+        for op_id, n in counts.items():
+            row[f"count:{op_id}"] = n
+        p0, c0 = self.produce[0], self.consume[0]
+        for i, rid in enumerate(self.res_ids):
+            p = produce[i] - p0[i]
+            c = consume[i] - c0[i]
+            row[f"produce:{rid}"] = p
+            row[f"consume:{rid}"] = c
+            row[f"produce_per_sec:{rid}"] = p / duration if duration > 0 else 0.0
+            row[f"consume_per_sec:{rid}"] = c / duration if duration > 0 else 0.0
+        return row
+
+    @staticmethod
+    def _count(counts, rec, weight):
+        if isinstance(rec, SkippedCycles):
+            for op_id, n in rec.op_counts.items():
+                counts[op_id] = counts.get(op_id, 0) + weight * n
+        else:
+            counts[rec[0]] = counts.get(rec[0], 0) + weight
+
+
+_MISSING = object()
+
+
+class _PatchLayer:
+    """
+    _patch_attr 装到实例上的一层包装。
+    解除时如果上面还压着别人的包装，就只把自己变成直通（直接调用下一层），
+    等上面那层解除时再连同自己一起跳过，因此多层包装可以按任意顺序解除。
+    """
+    __slots__ = ("func", "inner", "old", "active")
+
+    def __init__(self, func, inner, old):
+        self.func = func
+        self.inner = inner    # 装上之前的可调用对象（包装函数内部调用的就是它）
+        self.old = old        # 装上之前实例字典里的值（_MISSING 表示原来没有）
+        self.active = True
+
+    def __call__(self, *args, **kwargs):
+        if self.active:
+            return self.func(*args, **kwargs)
+        return self.inner(*args, **kwargs)
+
+
+def _patch_attr(patched, obj, name, value):
+    """
+    在实例上覆盖一个方法（换成包装过的 value），记进 patched，之后用 _unpatch_attrs 恢复。
+    埋点 / 性能分析 / 记录器可以叠加，解除顺序不限（见 _PatchLayer）。
+    """
+    layer = _PatchLayer(value, getattr(obj, name), obj.__dict__.get(name, _MISSING))
+    patched.append((obj, name, layer))
+    setattr(obj, name, layer)
+
+
+def _unpatch_attrs(patched):
+    for obj, name, layer in reversed(patched):
+        layer.active = False
+        if obj.__dict__.get(name, _MISSING) is not layer:
+            continue  # 上面还有别的包装：先保持直通，由上层解除时跳过
+        old = layer.old
+        while isinstance(old, _PatchLayer) and not old.active:
+            old = old.old
+        if old is _MISSING:
+            obj.__dict__.pop(name, None)
+        else:
+            setattr(obj, name, old)
+    patched.clear()
+
+
+class _InstrumentMark(tuple):
+    """拍快照时附在快照末尾的事件日志位置（restore 按顺序读取，末尾多一项不影响）"""
+
+
+class Instrumentation:
+    """
+    可选的运行时埋点（Character.enable_instrumentation() 打开）：
+    - 状态层数变化：包装每个 State 实例的 add / remove / force_clear，记录 (时间, 状态, 新层数)
+    - 资源变化：包装 ResourceBank.update，记录 (时间, 资源, 新数值, 溢出量)；
+      溢出量 = 恢复时被上限截掉的部分（引擎本身直接丢弃）
+    事件存在定长环形缓冲（deque(maxlen=capacity)）里，满了丢最早的事件；
+    丢掉的事件折进对应状态 / 资源的起点，查询区间的起点相应后移到最后一个丢掉的事件。
+
+    关闭时实例上的包装全部移除，引擎热路径与未埋点时完全相同。
+    影子模拟 / 回滚：快照末尾带上日志位置，restore 时把之后的事件一并撤销，
+    因此 can_execute 的试算不会留在日志里。
+    （plan_rotation 会回滚到“比当前日志更新”的快照，这种情况下日志只保留到当时已有的事件。）
+    """
+    EPS = 1e-9
+
+    def __init__(self, character, capacity=100000):
+        self.character = character
+        self.capacity = int(capacity)
+        self.state_events = deque(maxlen=self.capacity)
+        self.resource_events = deque(maxlen=self.capacity)
+        self._n_state = 0
+        self._n_res = 0
+        self._patched = []
+        self.start_time = character.timer.current_time
+        # 起点：每个状态 / 资源的初始值（丢掉事件后为最后一个丢掉的值）
+        self._initial_states = {}
+        self._initial_res = {}
+        # 缓冲覆盖的起始时间：此前的事件已丢弃
+        self._state_from = self.start_time
+        self._res_from = self.start_time
+
+    # ---------- 挂接 / 解除 ----------
+    def _patch(self, obj, name, func):
+        _patch_attr(self._patched, obj, name, func)
+
+    def _attach(self):
+        """(重新)挂到角色当前的编译结果上；compile() 之后会自动调用"""
+        self._detach()
+        ch = self.character
+        layout = ch._get_snapshot_layout()
+        timer = ch.timer
+        now = timer.current_time
+        for st in layout.states:
+            self._initial_states.setdefault(st.id, (now, st.current))
+            self._patch_state(st, timer)
+        bank = ch.resource_bank
+        for r in bank.resources:
+            self._initial_res.setdefault(r.id, (now, r.current))
+        self._patch_bank(bank, timer)
+        self._patch_layout(layout)
+
+    def _detach(self):
+        _unpatch_attrs(self._patched)
+
+    def _log_state(self, t, st):
+        events = self.state_events
+        if events and len(events) == self.capacity:
+            t_old, sid, v = events[0]
+            self._initial_states[sid] = (t_old, v)
+            self._state_from = t_old
+        events.append((t, st.id, st.current))
+        self._n_state += 1
+
+    def _patch_state(self, st, timer):
+        add, remove, force_clear = st.add, st.remove, st.force_clear
+        log = self._log_state
+
+        def add_i(tm):
+            prev = st.current
+            add(tm)
+            if st.current != prev:
+                log(tm.current_time, st)
+
+        def remove_i(tm):
+            prev = st.current
+            remove(tm)
+            if st.current != prev:
+                log(tm.current_time, st)
+
+        def force_clear_i():
+            prev = st.current
+            force_clear()
+            if st.current != prev:
+                log(timer.current_time, st)
+
+        self._patch(st, "add", add_i)
+        self._patch(st, "remove", remove_i)
+        self._patch(st, "force_clear", force_clear_i)
+
+    def _patch_bank(self, bank, timer):
+        update = bank.update
+        cur = bank.current
+        ids = [r.id for r in bank.resources]
+        events = self.resource_events
+
+        upper = bank.upper
+
+        def update_i(i, amount):
+            prev = cur[i]
+            update(i, amount)
+            v = cur[i]
+            # 只有真的被上限截断时才算溢出（避免浮点误差记成微小的正负值）
+            wasted = amount - (v - prev) if amount > 0 and v >= upper[i] else 0.0
+            if v != prev or wasted > 0:
+                if events and len(events) == self.capacity:
+                    t_old, rid, v_old, _ = events[0]
+                    self._initial_res[rid] = (t_old, v_old)
+                    self._res_from = t_old
+                events.append((timer.current_time, ids[i], v, wasted))
+                self._n_res += 1
+
+        def apply_deltas_i(indices, amounts):
+            for i, a in zip(indices, amounts):
+                update_i(i, a)
+
+        self._patch(bank, "update", update_i)
+        self._patch(bank, "apply_deltas", apply_deltas_i)
+
+    def _patch_layout(self, layout):
+        capture, restore = layout.capture, layout.restore
+
+        def capture_i():
+            snap = capture()
+            snap.append(_InstrumentMark((self._n_state, self._n_res)))
+            return snap
+
+        def restore_i(snap):
+            restore(snap)
+            if snap and isinstance(snap[-1], _InstrumentMark):
+                self._rewind(*snap[-1])
+
+        self._patch(layout, "capture", capture_i)
+        self._patch(layout, "restore", restore_i)
+
+    @staticmethod
+    def _truncate(events, n, mark):
+        drop = n - mark
+        if drop <= 0:
+            return n
+        if drop >= len(events):
+            events.clear()
+        else:
+            for _ in range(drop):
+                events.pop()
+        return mark
+
+    def _rewind(self, n_state, n_res):
+        self._n_state = self._truncate(self.state_events, self._n_state, n_state)
+        self._n_res = self._truncate(self.resource_events, self._n_res, n_res)
+
+    # ---------- 查询 ----------
+    def _span(self, t0, t1, lo):
+        """查询区间；起点不早于 lo（缓冲覆盖的起始时间）"""
+        if t0 is None or t0 < lo:
+            t0 = lo
+        if t1 is None:
+            t1 = self.character.timer.current_time
+        return t0, t1
+
+    def state_timeline(self, state_id):
+        """[(时间, 层数), ...]（含起点）"""
+        pts = [self._initial_states[state_id]] if state_id in self._initial_states else []
+        pts.extend((t, v) for t, sid, v in self.state_events if sid == state_id)
+        return pts
+
+    def resource_timeline(self, resource_id):
+        """[(时间, 数值), ...]（含起点）"""
+        pts = [self._initial_res[resource_id]] if resource_id in self._initial_res else []
+        pts.extend((t, v) for t, rid, v, _ in self.resource_events if rid == resource_id)
+        return pts
+
+    @staticmethod
+    def _integrate(pts, t0, t1, f):
+        """分段常数序列 pts 上，对 f(值) 在 [t0, t1] 内按时间积分"""
+        total = 0.0
+        for k, (t, v) in enumerate(pts):
+            a = max(t, t0)
+            b = min(pts[k + 1][0] if k + 1 < len(pts) else t1, t1)
+            if b > a:
+                total += f(v) * (b - a)
+        return total
+
+    def uptime(self, state_id, t0=None, t1=None):
+        """[t0, t1] 内状态层数 > 0 的时间占比"""
+        t0, t1 = self._span(t0, t1, self._state_from)
+        if t1 <= t0:
+            return 0.0
+        return self._integrate(self.state_timeline(state_id), t0, t1, lambda v: 1.0 if v > 0 else 0.0) / (t1 - t0)
+
+    def average_stacks(self, state_id, t0=None, t1=None):
+        """[t0, t1] 内按时间加权的平均层数"""
+        t0, t1 = self._span(t0, t1, self._state_from)
+        if t1 <= t0:
+            return 0.0
+        return self._integrate(self.state_timeline(state_id), t0, t1, float) / (t1 - t0)
+
+    def time_at_cap(self, resource_id, t0=None, t1=None):
+        """[t0, t1] 内资源处于上限的总时间"""
+        t0, t1 = self._span(t0, t1, self._res_from)
+        upper = self.character.resources[resource_id].upper_limit
+        return self._integrate(self.resource_timeline(resource_id), t0, t1,
+                               lambda v: 1.0 if v >= upper - self.EPS else 0.0)
+
+    def wasted(self, resource_id, t0=None, t1=None):
+        """[t0, t1] 内因上限被截掉的恢复量"""
+        t0, t1 = self._span(t0, t1, self._res_from)
+        return sum(w for t, rid, _, w in self.resource_events if rid == resource_id and t0 <= t <= t1)
+
+
+class PhaseProfiler:
+    """
+    按阶段统计耗时（Character.enable_profiler() 打开）：
+    把角色 / 状态管理器 / 元操作 / 操作实例上的热路径方法换成计时包装，
+    记录每个阶段的调用次数、含子阶段的总耗时，以及按调用栈展开的自身耗时（perf_counter_ns）。
+
+    阶段名：
+    - build_rotation_from_meta / build_rotation_greedy_ops / plan_rotation / advance / wait
+    - candidates（_meta_candidates）、get_priority、interrupt_check（_has_higher_priority_meta_active）
+    - can_execute、shadow_simulation（_simulate_full）、execute
+    - test、operate、regen（_apply_time_regen）、triggers（_after_operation_executed 的自身部分）
+    - expiry（StateManager.update）
+
+    report() 输出文本表格；write_folded() 写出 flamegraph.pl / speedscope 可读的 folded stack 文件。
+    关闭后包装全部移除，未打开时没有任何额外开销。
+    """
+    CHARACTER_PHASES = (
+        ("build_rotation_from_meta", "build_rotation_from_meta"),
+        ("build_rotation_greedy_ops", "build_rotation_greedy_ops"),
+        ("plan_rotation", "plan_rotation"),
+        ("advance_to", "advance"),
+        ("_wait_step", "wait"),
+        ("_meta_candidates", "candidates"),
+        ("_has_higher_priority_meta_active", "interrupt_check"),
+        ("_apply_time_regen", "regen"),
+        ("_after_operation_executed", "triggers"),
+    )
+    META_PHASES = (
+        ("get_priority", "get_priority"),
+        ("can_execute", "can_execute"),
+        ("_simulate_full", "shadow_simulation"),
+        ("execute", "execute"),
+    )
+    OP_PHASES = (
+        ("test", "test"),
+        ("operate", "operate"),
+    )
+
+    def __init__(self, character):
+        self.character = character
+        self.calls = {}
+        self.total_ns = {}
+        self.folded = {}     # "阶段;子阶段;..." -> 自身耗时 ns
+        self._stack = []
+        self._child_ns = []
+        self._patched = []
+
+    def _wrap(self, name, func):
+        stack, child_ns = self._stack, self._child_ns
+        calls, total_ns, folded = self.calls, self.total_ns, self.folded
+
+        def wrapped(*args, **kwargs):
+            outermost = name not in stack
+            stack.append(name)
+            child_ns.append(0)
+            t0 = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                dt = perf_counter_ns() - t0
+                key = ";".join(stack)
+                folded[key] = folded.get(key, 0) + dt - child_ns.pop()
+                stack.pop()
+                if child_ns:
+                    child_ns[-1] += dt
+                calls[name] = calls.get(name, 0) + 1
+                if outermost:
+                    # 递归调用只按最外层计入总耗时
+                    total_ns[name] = total_ns.get(name, 0) + dt
+        return wrapped
+
+    def _patch_all(self, obj, phases):
+        for attr, name in phases:
+            _patch_attr(self._patched, obj, attr, self._wrap(name, getattr(obj, attr)))
+
+    def _attach(self):
+        ch = self.character
+        self._patch_all(ch, self.CHARACTER_PHASES)
+        self._patch_all(ch.state_manager, (("update", "expiry"),))
+        for mop in ch.meta_operations:
+            self._patch_all(mop, self.META_PHASES)
+        for op in ch._get_snapshot_layout().operations:
+            self._patch_all(op, self.OP_PHASES)
+
+    def _detach(self):
+        _unpatch_attrs(self._patched)
+
+    def reset(self):
+        """清空已累计的统计（保持挂接）"""
+        self.calls.clear()
+        self.total_ns.clear()
+        self.folded.clear()
+
+    def self_ns(self):
+        """{阶段: 自身耗时 ns}（不含子阶段）"""
+        out = {}
+        for key, ns in self.folded.items():
+            name = key.rsplit(";", 1)[-1]
+            out[name] = out.get(name, 0) + ns
+        return out
+
+    def report(self):
+        """按总耗时排序的文本报表：阶段 / 调用次数 / 总耗时 / 自身耗时 / 平均每次"""
+        own = self.self_ns()
+        lines = [f"{'phase':<26}{'calls':>10}{'total ms':>12}{'self ms':>12}{'avg us':>10}"]
+        for name in sorted(self.total_ns, key=self.total_ns.get, reverse=True):
+            n = self.calls[name]
+            total = self.total_ns[name]
+            lines.append(f"{name:<26}{n:>10}{total / 1e6:>12.3f}{own.get(name, 0) / 1e6:>12.3f}{total / n / 1e3:>10.2f}")
+        return "\n".join(lines)
+
+    def folded_lines(self):
+        """folded stack 格式的行：'阶段;子阶段 自身耗时(ns)'"""
+        return [f"{key} {ns}" for key, ns in sorted(self.folded.items()) if ns > 0]
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.folded_lines()) + "\n")
+        return path
+
+
 # ===================== Character（角色） =====================
 class Character:
     """
@@ -1610,8 +2604,12 @@ class Character:
     4. state_manager: StateManager
     5. operations: [Operation, ...] 可选，单个操作优先级用
     6. meta_operations: [MetaOperation, ...] 可选，按列表顺序作为优先级
+    7. rng: random.Random，probability < 1 的操作 / 触发规则用它掷骰子（seed() 可重置）
     """
 
+    # wait=True 时连续等待的事件数上限（防止只有周期性事件、永远无法执行时死循环）
+    MAX_IDLE_EVENTS = 10000
+
     def __init__(self, name, timer: Timer, resources=None, states=None):
         self.name = name
         self.timer = timer
@@ -1622,49 +2620,433 @@ class Character:
         self.resource_regen_rules = []
         self._last_tick_time = self.timer.current_time
         self.op_triggered_state_rules = []
+        self.rng = random.Random()
+        self._snapshot_layout = None  # 快照布局缓存，增删对象时失效
+        self._compiled = False
+        self._compiled_rules_version = -1
+        self.resource_bank = None  # compile() 后为角色的 ResourceBank
+        self.instrumentation = None  # enable_instrumentation() 后为 Instrumentation
+        self.profiler = None  # enable_profiler() 后为 PhaseProfiler
+        # type=2 元操作 can_execute 的结果缓存（LRU，键为 元操作 + 状态指纹），0 表示关闭
+        self.feasibility_cache_size = 4096
+        self.fingerprint_quantum = 1e-9
+        self._feasibility_cache = OrderedDict()
+        self._feasibility_hits = 0
+        self._feasibility_misses = 0
+        # 脏标记（compile() 填充，见 _build_dirty_tracking）：只重算受上一步影响的元操作
+        self._dirty_priority = None
+        self._dirty_feasible = None
+        self._meta_priority = {}
+        self._meta_feasible = {}
+        self._volatile_metas = frozenset()
+        self._dirty_states = ()
+        self._candidates_cache = None
+        self._cache_writes = 0  # 缓存写入次数，快照回滚时据此判断缓存是否仍然有效
+
+    def compile(self):
+        """
+        预编译角色结构，供热路径直接查表：
+        1. 资源库 ResourceBank + 快照布局（snapshot / restore / 影子模拟用）
+        2. 每个 Operation 的倒排索引：
+           - op._accelerate_index: [(State, OperationAccelerate), ...]
+           - op._efficiency_index: [(State, OperationResourceEfficiency), ...]
+           只包含“目标就是这个 op”的规则，热路径开销只与真正作用于它的规则数有关。
+           - op._kernel: 预编译的消耗/产出结算内核（_OperationKernel）
+        3. 每个 MetaOperation 的优先级索引：
+           - mop._priority_index: [(State, priority_delta, min_stack), ...]
+           （顺带把 State.meta_priority_rules 规范化为 MetaPriorityRule）
+        4. 脏标记依赖图（_build_dirty_tracking）：状态层数 / 资源数值变化时只让依赖它的元操作重算
+        5. 按各状态当前的计时字段重建过期堆（StateManager.reschedule_all）
+
+        通过 add_* / State.add_*_rule 增加对象或规则后会自动失效并在下次使用时重建；
+        直接修改列表后请手动调用 invalidate()。
+        """
+        self._release_compiled()
+        layout = SnapshotLayout.collect(
+            self.timer,
+            resources=self.resources.values(),
+            states=self.state_manager.states,
+            operations=self.operations,
+            meta_operations=self.meta_operations,
+            regen_rules=self.resource_regen_rules,
+            op_trigger_rules=self.op_triggered_state_rules,
+            character=self,
+            state_manager=self.state_manager,
+        )
+        # 所有涉及的资源收拢到同一个资源库，快照变成整条向量拷贝
+        self.resource_bank = ResourceBank(layout.resources)
+        layout.resource_bank = self.resource_bank
+        for op in layout.operations:
+            op._accelerate_index = []
+            op._efficiency_index = []
+        # 与未编译时一致：只有 state_manager 里的状态参与耗时/效率修正
+        for st in self.state_manager.states:
+            for acc in st.op_accelerate_rules:
+                idx = getattr(acc.operation, "_accelerate_index", None)
+                if idx is not None:
+                    idx.append((st, acc))
+            for rule in st.op_efficiency_rules:
+                idx = getattr(rule.operation, "_efficiency_index", None)
+                if idx is not None:
+                    idx.append((st, rule))
+
+        for op in layout.operations:
+            op._kernel = _OperationKernel(op, self.resource_bank)
+
+        for mop in self.meta_operations:
+            mop._priority_index = []
+        for st in self.state_manager.states:
+            # 直接 append 进来的 tuple 在这里统一规范化一次
+            rules = [r for r in map(MetaPriorityRule.normalize, st.meta_priority_rules) if r is not None]
+            st.meta_priority_rules = rules
+            for rule in rules:
+                idx = getattr(rule.meta_op, "_priority_index", None)
+                if idx is not None:
+                    idx.append((st, rule.priority_delta, rule.min_stack))
+
+        self._build_dirty_tracking()
+        # 计时字段可能在两次编译之间被直接修改（参数扫描等），按当前值重新登记过期时间
+        self.state_manager.reschedule_all()
+
+        self._snapshot_layout = layout
+        self._compiled = True
+        self._compiled_rules_version = State._rules_version
+        if getattr(self, "instrumentation", None) is not None:
+            self.instrumentation._attach()
+        cache = getattr(self, "_feasibility_cache", None)
+        if cache is not None:
+            cache.clear()
+        return self
+
+    def _ensure_compiled(self):
+        if (not self._compiled or self._compiled_rules_version != State._rules_version
+                or self.resource_bank.retired):
+            self.compile()
+
+    def _release_compiled(self):
+        layout = self._snapshot_layout
+        if layout is not None:
+            for op in layout.operations:
+                op._accelerate_index = None
+                op._efficiency_index = None
+                op._kernel = None
+        for mop in self.meta_operations:
+            mop._priority_index = None
+        for st in self._dirty_states:
+            st._dirty = None
+            st._priority_dependents = st._feasible_dependents = ()
+        self._dirty_states = ()
+        self._dirty_priority = self._dirty_feasible = None
+        self._candidates_cache = None
+        self._snapshot_layout = None
+        self._compiled = False
+
+    def _build_dirty_tracking(self):
+        """
+        建立“状态 / 资源 -> 元操作”的依赖图，供增量重算：
+        - 优先级依赖：meta_state_requirements / meta_state_forbids、作用于它的 meta_priority_rules 的状态
+        - 可执行性依赖（仅 type=1）：上述启用条件的状态，各操作的 state_requirements / state_forbids /
+          state_effects / 效率规则的状态，以及 resource_requirements 的资源
+        State.add / remove / force_clear 与 ResourceBank.update / apply_deltas 改变数值时，
+        把依赖它的元操作放进 _dirty_priority / _dirty_feasible，下一次选择时只重算这些元操作。
+
+        type=2 元操作（影子模拟，依赖整条链路上的一切）与含多段充能操作（充能随时间恢复）的元操作
+        视为易变，每次都重新判断可执行性（type=2 仍会走 _cached_feasibility 的指纹缓存）。
+        """
+        prio_deps, feas_deps, res_deps = {}, {}, {}
+        bank = self.resource_bank
+        volatile = set()
+        for mop in self.meta_operations:
+            gate = [st for st, _ in mop.meta_state_requirements] + list(mop.meta_state_forbids)
+            for st in gate + [st for st, _, _ in mop._priority_index]:
+                prio_deps.setdefault(st, []).append(mop)
+            if mop.type != 1 or any(op.max_charges > 1 for op in mop.operations):
+                volatile.add(mop)
+                continue
+            states = list(gate)
+            for op in mop.operations:
+                states.extend(st for st, _ in op.state_requirements)
+                states.extend(op.state_forbids)
+                states.extend(eff.state for eff in op.state_effects)
+                states.extend(st for st, _ in op._efficiency_index or ())
+                for res in op.resource_requirements:
+                    if res._bank is bank:
+                        res_deps.setdefault(res._idx, []).append(mop)
+            for st in states:
+                feas_deps.setdefault(st, []).append(mop)
+
+        dirty = (set(), set())
+        tracked = list(dict.fromkeys(list(prio_deps) + list(feas_deps)))
+        for st in tracked:
+            st._dirty = dirty
+            st._priority_dependents = tuple(dict.fromkeys(prio_deps.get(st, ())))
+            st._feasible_dependents = tuple(dict.fromkeys(feas_deps.get(st, ())))
+        bank._dependents = [tuple(dict.fromkeys(res_deps.get(i, ()))) for i in range(len(bank.resources))]
+        bank._dirty = dirty[1]
+
+        self._dirty_states = tracked
+        self._dirty_priority, self._dirty_feasible = dirty
+        self._volatile_metas = frozenset(volatile)
+        self._mark_all_dirty()
+
+    def _mark_all_dirty(self):
+        """丢弃全部缓存的优先级 / 可执行性（循环开始时调用，覆盖两次循环之间对数值的直接修改）"""
+        if self._dirty_priority is None:
+            return
+        self._dirty_priority.update(self.meta_operations)
+        self._dirty_feasible.update(self.meta_operations)
+        self._meta_priority = {}
+        self._meta_feasible = {}
+        self._candidates_cache = None
+
+    def _capture_dirty(self):
+        """快照用：只记缓存写入次数（不拷贝缓存本身）"""
+        return self._cache_writes
+
+    def _restore_dirty(self, saved):
+        """
+        快照之后没有写过缓存（例如影子模拟：只改数值、不查优先级）时什么都不用做——
+        期间的变化只会多标脏，缓存的值仍对应回滚后的数值；否则整体作废。
+        """
+        if saved != self._cache_writes:
+            self._mark_all_dirty()
+
+    def _priority(self, mop):
+        """mop.get_priority 的增量版本：只有依赖的状态变化过才重算"""
+        dirty = self._dirty_priority
+        if dirty is None:
+            return mop.get_priority(self.state_manager)
+        if mop in dirty:
+            self._meta_priority[mop] = mop.get_priority(self.state_manager)
+            self._cache_writes += 1
+            self._candidates_cache = None
+            dirty.discard(mop)
+        return self._meta_priority[mop]
+
+    def _can_execute(self, mop):
+        """mop.can_execute 的增量版本：type=1 元操作只有依赖的状态 / 资源变化过才重算"""
+        dirty = self._dirty_feasible
+        if dirty is None or mop in self._volatile_metas:
+            return mop.can_execute(timer=self.timer, state_manager=self.state_manager, character=self)
+        if mop in dirty:
+            self._meta_feasible[mop] = mop.can_execute(timer=self.timer, state_manager=self.state_manager,
+                                                       character=self)
+            self._cache_writes += 1
+            dirty.discard(mop)
+        return self._meta_feasible[mop]
+
+    def _get_snapshot_layout(self) -> SnapshotLayout:
+        self._ensure_compiled()
+        return self._snapshot_layout
+
+    def invalidate(self):
+        """
+        角色结构（资源/状态/操作/规则）被直接修改后调用，丢弃编译结果（快照布局、规则索引）。
+        通过 add_* 接口添加的对象会自动调用。
+        """
+        self._release_compiled()
+
+    def snapshot(self) -> list:
+        """
+        拍下角色当前全部可变数值（资源、状态层数与计时槽、充能、计数、
+        ResourceStateRule.was_active、回复结算时间、当前时间），返回扁平 list。
+        配合 restore() 可以低成本地“试算后回滚”。
+        """
+        return self._get_snapshot_layout().capture()
+
+    def restore(self, snapshot: list):
+        """回滚到 snapshot() 拍下的状态（快照需来自同一结构的角色）"""
+        self._get_snapshot_layout().restore(snapshot)
+
+    def enable_instrumentation(self, capacity=100000):
+        """
+        打开埋点：记录状态层数、资源数值的变化事件（环形缓冲，最多 capacity 条），
+        返回 Instrumentation，可查询 uptime / average_stacks / time_at_cap / wasted。
+        打开期间实例上挂着包装函数，角色不能 pickle（参数扫描 / 缓存前先 disable_instrumentation()）。
+        重复调用会先关闭之前的埋点。
+        """
+        self.disable_instrumentation()
+        self.instrumentation = Instrumentation(self, capacity)
+        self._ensure_compiled()
+        self.instrumentation._attach()
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        """关闭埋点并移除所有包装，返回之前的 Instrumentation（日志仍可查询）"""
+        inst = self.instrumentation
+        if inst is not None:
+            inst._detach()
+        self.instrumentation = None
+        return inst
+
+    def enable_profiler(self):
+        """
+        打开按阶段的性能统计（见 PhaseProfiler），返回 profiler；
+        之后新增的元操作 / 操作不会被统计，需要重新打开。打开期间角色不能 pickle。
+        """
+        self.disable_profiler()
+        self.profiler = PhaseProfiler(self)
+        self.profiler._attach()
+        return self.profiler
+
+    def disable_profiler(self):
+        """关闭性能统计并移除所有包装，返回之前的 profiler（统计结果仍可读取）"""
+        prof = getattr(self, "profiler", None)
+        if prof is not None:
+            prof._detach()
+        self.profiler = None
+        return prof
+
+    def seed(self, seed=None):
+        """重置随机数流（seed 相同则概率机制的掷骰序列相同）"""
+        self.rng.seed(seed)
+
+    def simulate_many(self, n_runs, seed=None, *, max_steps=9999, mode="meta", max_workers=None, chunksize=None,
+                      percentiles=(5, 95)):
+        """
+        蒙特卡洛：从当前角色出发独立跑 n_runs 次循环，每次使用独立的随机数流（由 seed 和序号派生），
+        多进程并行，返回各项汇总的分布统计：
+            {"runs": n, "seed": seed, "total_time": {"mean": .., "p5": .., "p95": ..}, "consume:<id>": {...}, ...}
+        本角色自身不会被修改。详见 sweep.run_monte_carlo。
+        """
+        from sweep import run_monte_carlo, distribution_stats
+        runs, seed = run_monte_carlo(self, n_runs, seed, max_steps=max_steps, mode=mode,
+                                     max_workers=max_workers, chunksize=chunksize)
+        stats = distribution_stats(runs, percentiles=percentiles)
+        stats["seed"] = seed
+        return stats
     
+    # ---------- 可执行性缓存 ----------
+    def _state_fingerprint(self):
+        """
+        影子模拟结果只取决于的那部分状态，量化后压成 tuple（量化步长 fingerprint_quantum）：
+        距上次回复结算的时间、会被读取的资源数值、状态层数与各计时槽的“已持续时间”（与绝对时间无关）、
+        充能与充能计时、ResourceStateRule.was_active。
+        """
+        layout = self._get_snapshot_layout()
+        plan = getattr(layout, "fingerprint_plan", None)
+        if plan is None:
+            plan = layout.fingerprint_plan = self._fingerprint_plan(layout)
+        res_idx, states, timed1, timed2, charge_ops, rules = plan
+        q = 1.0 / self.fingerprint_quantum
+        now = self.timer.current_time
+        cur = self.resource_bank.current
+        key = [round((now - self._last_tick_time) * q)]
+        key.extend([round(cur[i] * q) for i in res_idx])
+        key.extend([st.current for st in states])
+        for st in timed1:
+            key.append(round((now - st.start_time) * q) if st.current > 0 else None)
+        for st in timed2:
+            # 槽的下标不影响行为，只看活跃槽的已持续时间（排序后）
+            heap = st._slot_heap
+            key.append(tuple(sorted([round((now - t) * q) for t, _ in heap])) if heap else ())
+        for op in charge_ops:
+            key.append(op.charges)
+            key.append(round(op.charge_clock * q))
+        key.extend([rule.was_active for rule in rules])
+        return tuple(key)
+
+    def _fingerprint_plan(self, layout):
+        """指纹要读的对象，按布局预先分好类（每次编译算一次）"""
+        timed = [st for st in layout.states if st.expire_mode != "resource"]
+        return (
+            self._fingerprint_resources(layout),
+            list(layout.states),
+            [st for st in timed if st.type == 1],
+            [st for st in timed if st.type == 2],
+            # 上限 1 的操作没有充能逻辑，不影响可执行性
+            [op for op in layout.operations if op.max_charges > 1],
+            list(layout.resource_state_rules),
+        )
+
+    def _fingerprint_resources(self, layout):
+        """
+        会影响可执行性的资源在资源库里的下标：被操作消耗的、阈值规则 / 触发规则检查的、状态改动会扣减的。
+        只被产出、从不被读取的资源（例如伤害累计）不进指纹，否则每一步的指纹都不同。
+        """
+        used = set()
+        for op in layout.operations:
+            used.update(op.resource_requirements)
+        for rule in layout.threshold_rules:
+            used.add(rule.resource)
+        for rule in self.op_triggered_state_rules:
+            used.update(th.resource for th in rule.resource_thresholds)
+        for st in layout.states:
+            used.update(eff.resource for eff in st.resource_effects)
+        return [r._idx for r in self.resource_bank.resources if r in used]
+
+    def _cached_feasibility(self, mop, timer, state_manager):
+        """带 LRU 缓存的 type=2 影子模拟；含概率机制（结果取决于随机数）时不缓存"""
+        layout = self._get_snapshot_layout()
+        if timer is not self.timer or layout.stochastic:
+            return mop._simulate_full(timer, state_manager, character=self)
+        cache = self._feasibility_cache
+        key = (mop, self._state_fingerprint())
+        ok = cache.get(key)
+        if ok is not None:
+            cache.move_to_end(key)
+            self._feasibility_hits += 1
+            return ok
+        self._feasibility_misses += 1
+        ok = mop._simulate_full(timer, state_manager, character=self)
+        cache[key] = ok
+        if len(cache) > self.feasibility_cache_size:
+            cache.popitem(last=False)
+        return ok
+
+    def feasibility_cache_info(self):
+        """可执行性缓存的命中统计：{"hits", "misses", "size", "maxsize"}"""
+        return {"hits": self._feasibility_hits, "misses": self._feasibility_misses,
+                "size": len(self._feasibility_cache), "maxsize": self.feasibility_cache_size}
+
     def _has_higher_priority_meta_active(self, current_mop: MetaOperation) -> bool:
         """
         只要出现 priority > 当前元操作优先级 的元操作被激活（priority != None），就返回 True。
         """
-        cur_pr = current_mop.get_priority(self.state_manager)
+        cur_pr = self._priority(current_mop)
         if cur_pr is None:
             return True  # 当前都不该继续了
 
         for mop in self.meta_operations:
             if mop is current_mop:
                 continue
-            pr = mop.get_priority(self.state_manager)
+            pr = self._priority(mop)
             if pr is None:
                 continue
-            if pr > cur_pr and mop.can_execute(timer = self.timer, state_manager=self.state_manager, character=self):
+            if pr > cur_pr and self._can_execute(mop):
                 return True
         return False
     
     def add_op_trigger_rule(self, rule: OperationTriggeredStateRule):
-        self.op_triggered_state_rules.append(rule)   
+        self.op_triggered_state_rules.append(rule)
+        self.invalidate()
     
     def _after_operation_executed(self, op: Operation):
         # 在操作执行成功后触发规则
         for rule in self.op_triggered_state_rules:
-            rule.try_apply(op, self.timer)
+            rule.try_apply(op, self.timer, rng=self.rng)
         self.state_manager.update(self.timer)
 
     def add_resource(self, res: Resource):
         self.resources[res.id] = res
+        self.invalidate()
 
     def add_state(self, st: State):
         self.state_manager.add_state(st)
+        self.invalidate()
 
     def add_operation(self, op: Operation):
         self.operations.append(op)
+        self.invalidate()
 
     def add_meta_operation(self, mop: MetaOperation):
         self.meta_operations.append(mop)
+        self.invalidate()
     
     def add_regen_rule(self, rule: ResourceRegenRule):
         """为角色添加一个“随时间变化资源”的规则"""
         self.resource_regen_rules.append(rule)
+        self.invalidate()
 
     def _apply_time_regen(self):
         """
@@ -1681,9 +3063,221 @@ class Character:
             op.regen_charges(dt)
         self._last_tick_time = now
 
+    # ---------- 事件驱动的时间推进 ----------
+
+    def _regen_rates(self):
+        """当前状态下生效的回复规则，按资源合并成净速率 {Resource: rate_per_sec}"""
+        rates = {}
+        for rule in self.resource_regen_rules:
+            if rule.rate_per_sec and rule._check_states():
+                rates[rule.resource] = rates.get(rule.resource, 0.0) + rule.rate_per_sec
+        return rates
+
+    @staticmethod
+    def _regen_value(res, rate, dt):
+        """按 rate 回复 dt 之后的资源值（与 ResourceBank.update 的截断一致，衰减最多到 0）"""
+        cur = res.current
+        amount = rate * dt
+        if amount < 0:
+            v = cur + max(amount, -cur)
+            return v if v > 0 else 0.0
+        v = cur + amount
+        up = res.upper_limit
+        return v if v < up else up
+
+    @staticmethod
+    def _first_dt(ok, dt):
+        """从解析解 dt 出发，逐个 ulp 往后找第一个让 ok(dt) 成立的浮点数（消除舍入误差）"""
+        dt = max(dt, 0.0)
+        for _ in range(64):
+            if ok(dt):
+                break
+            dt = math.nextafter(dt, math.inf)
+        return dt
+
+    def _threshold_dt(self, rule, rate):
+        """按净速率 rate 回复时，阈值规则从“不满足”变为“满足”所需的时间；不会发生返回 None"""
+        res = rule.resource
+        cur = res.current
+        thr = rule.threshold
+        if rule._condition(cur):
+            return None
+        if rate > 0 and rule.mode in (">=", "==") and cur < thr <= res.upper_limit:
+            return self._first_dt(lambda d: self._regen_value(res, rate, d) >= thr, (thr - cur) / rate)
+        if rate < 0 and rule.mode in ("<=", "==") and 0 <= thr < cur:
+            return self._first_dt(lambda d: self._regen_value(res, rate, d) <= thr, (cur - thr) / -rate)
+        return None
+
+    def _next_event(self, rates):
+        """
+        下一个事件：(时刻, dt)，没有事件返回 None。
+        事件包括：状态过期、充能就绪、回复使资源进入 ResourceStateRule / ResourceStateRemoveRule 的条件。
+        """
+        now = self.timer.current_time
+        best = None
+        for st in self.state_manager.states:
+            t = st.next_expire_instant(now)
+            if t is not None and (best is None or t < best[0]):
+                best = (t, t - now)
+        for op in self.operations:
+            if op.max_charges > 1 and op.charge_cd > 0 and op.charges < op.max_charges:
+                cd, clock = op.charge_cd, op.charge_clock
+                dt = self._first_dt(lambda d: (clock + d) // cd >= 1, cd - clock)
+                if best is None or now + dt < best[0]:
+                    best = (now + dt, dt)
+        for rule in self._get_snapshot_layout().threshold_rules:
+            rate = rates.get(rule.resource)
+            if not rate:
+                continue
+            dt = self._threshold_dt(rule, rate)
+            if dt is not None and (best is None or now + dt < best[0]):
+                best = (now + dt, dt)
+        return best
+
+    def next_event_time(self):
+        """
+        当前时刻之后最早的事件时间（状态过期 / 充能就绪 / 回复触及阈值规则），没有则返回 None。
+        只看时间流逝本身，不考虑执行操作。
+        """
+        self._ensure_compiled()
+        ev = self._next_event(self._regen_rates())
+        return None if ev is None else ev[0]
+
+    def _apply_threshold_crossings(self, prev):
+        """对比区间前后的条件，只结算发生穿越的阈值规则；返回结算后的条件列表"""
+        rules = self._get_snapshot_layout().threshold_rules
+        for rule, was in zip(rules, prev):
+            now_active = rule._condition(rule.resource.current)
+            if now_active == was:
+                continue
+            if isinstance(rule, ResourceStateRule):
+                # 离开条件时也调用一次，让 once=True 的规则重置 was_active
+                rule.check_and_apply(self.timer)
+            elif now_active:
+                rule.check_and_apply()
+        return [rule._condition(rule.resource.current) for rule in rules]
+
+    def advance_to(self, t):
+        """
+        不执行任何操作，让时间直接推进到 t（空闲 / 等待）。
+
+        在两次事件之间，生效的回复规则、充能都是线性的，可以一次性按解析解结算；
+        每一段都跳到下一个事件为止：
+          1）状态过期（与 State.remove 的判断一致，精确到浮点数）
+          2）充能就绪
+          3）回复使资源跨过 ResourceStateRule / ResourceStateRemoveRule 的阈值（在穿越时刻立即触发）
+        事件处理后状态可能改变，回复规则的生效条件随之重新计算。
+        同一资源上的多条回复规则按净速率合并结算。
+
+        返回推进后的当前时间。
+        """
+        self._ensure_compiled()
+        timer = self.timer
+        if timer.current_time > self._last_tick_time:
+            # 之前未结算的时间先按原方式补上
+            self._apply_time_regen()
+        rules = self._get_snapshot_layout().threshold_rules
+        active = [rule._condition(rule.resource.current) for rule in rules]
+
+        while True:
+            self.state_manager.update(timer)
+            active = self._apply_threshold_crossings(active)
+            now = timer.current_time
+            if now >= t:
+                break
+            rates = self._regen_rates()
+            ev = self._next_event(rates)
+            end, dt = (t, t - now) if ev is None or ev[0] >= t else ev
+
+            for res, rate in rates.items():
+                amount = rate * dt
+                if amount < 0:
+                    amount = max(amount, -res.current)
+                if amount != 0:
+                    res.update(amount)
+            for op in self.operations:
+                op.regen_charges(dt)
+            timer.current_time = end
+            self._last_tick_time = end
+            active = self._apply_threshold_crossings(active)
+
+        self._last_tick_time = timer.current_time
+        return timer.current_time
+
+    def _requirement_time(self, op, rates):
+        """状态条件满足、只差资源时，回复使 op 的资源需求（消耗量 / consume_lower_limit）全部达到的时刻"""
+        if not op._check_state_conditions() or (op.max_charges > 1 and op.charges <= 0):
+            return None
+        needs = {}
+        for res, lower in zip(op.resource_requirements, op.consume_lower_limits):
+            if lower is not None:
+                needs[res] = lower
+        for res, need in op._calc_consume_amounts(state_manager=self.state_manager).items():
+            needs[res] = max(need, needs.get(res, need))
+        now = self.timer.current_time
+        ready = now
+        for res, need in needs.items():
+            if need <= res.current:
+                continue
+            rate = rates.get(res)
+            if not rate or rate < 0 or need > res.upper_limit:
+                return None
+            ok = lambda d: self._regen_value(res, rate, d) >= need
+            t = now + self._first_dt(ok, (need - res.current) / rate)
+            # advance_to 按 t - now 结算，按绝对时刻再校正一次舍入
+            while not ok(t - now):
+                t = math.nextafter(t, math.inf)
+            ready = max(ready, t)
+        return ready
+
+    def _wait_step(self, ops):
+        """
+        等待一步：推进到下一个可能让 ops 中某个操作变得可执行的时刻
+        （advance_to 的事件，或回复使某个操作的资源需求全部满足）。
+        不会越过 timer.total_time；没有事件或到达上限时返回 False。
+        """
+        self._ensure_compiled()
+        rates = self._regen_rates()
+        ev = self._next_event(rates)
+        now = self.timer.current_time
+        best = None if ev is None else ev[0]
+        for op in ops:
+            t = self._requirement_time(op, rates)
+            if t is not None and t > now and (best is None or t < best):
+                best = t
+        cap = self.timer.total_time
+        if cap is not None and (best is None or best > cap):
+            if now < cap:
+                self.advance_to(cap)
+            return False
+        if best is None:
+            return False
+        self.advance_to(best)
+        return True
+
+    def _meta_candidates(self):
+        """
+        当前状态下启用的元操作及其优先级：[(priority, MetaOperation), ...]
+        按优先级从大到小排序（同优先级保持 meta_operations 列表顺序）。
+        没有元操作的优先级变脏时直接复用上一次的列表（调用方不要修改它）。
+        """
+        cached = self._candidates_cache
+        if cached is not None and not self._dirty_priority:
+            return cached
+        candidate_list = []
+        for mop in self.meta_operations:
+            pr = self._priority(mop)
+            if pr is None:
+                continue  # 当前状态下禁用这个 meta
+            candidate_list.append((pr, mop))
+        candidate_list.sort(key=lambda x: x[0], reverse=True)
+        if self._dirty_priority is not None:
+            self._candidates_cache = candidate_list
+        return candidate_list
+
     # ---------- 逻辑 1：基于元操作的循环 ----------
 
-    def build_rotation_from_meta(self, max_steps=9999):
+    def build_rotation_from_meta(self, max_steps=9999, wait=False, record_list=None):
         """
         逻辑1：
         按“当前状态决定的优先级”来选择元操作：
@@ -1691,53 +3285,149 @@ class Character:
           2）过滤掉当前状态下不启用的 meta（priority is None）
           3）按优先级从高到低，找第一个 can_execute 的元操作执行
         重复上述过程，直到所有元操作都无法执行，或达到 max_steps 次元操作。
+
+        wait=True 时，没有可执行的元操作不会立即退出，而是推进时间到下一个可能让某个操作
+        变得可执行的事件（状态过期、充能就绪、回复达到资源需求 / 阈值），再重新选择；
+        没有任何事件，或到达 timer.total_time 时才退出。等待不记入 rotation_log。
+
+        timer.total_time 不为 None 时是硬上限：到达后不再开始新的元操作（tail 循环也会停下），
+        已开始的操作照常结算完（可能越过上限，见 simulate_window 的折算）。
+        record_list: 记录写入的目标（需要有 append），默认新建 list。
         """
-        rotation_log = []
+        rotation_log = [] if record_list is None else record_list
+        for _ in self._meta_steps(max_steps, wait, rotation_log):
+            pass
+        return rotation_log
+
+    def _meta_steps(self, max_steps, wait, rotation_log):
+        """build_rotation_from_meta 的循环体：每执行完一个元操作 yield 一次（记录已写入 rotation_log）"""
+        self._ensure_compiled()
+        self._mark_all_dirty()
+        timer = self.timer
         steps = 0
+        idle = 0
+        if wait:
+            wait_ops = list(dict.fromkeys(op for mop in self.meta_operations for op in mop.operations))
 
         while steps < max_steps:
+            if timer.total_time is not None and timer.current_time >= timer.total_time:
+                break
             # 先结算一次状态过期
             self.state_manager.update(self.timer)
 
-            # 计算当前状态下的“可用元操作 + 优先级”
-            candidate_list = []  # [(priority, MetaOperation), ...]
-            for mop in self.meta_operations:
-                pr = mop.get_priority(self.state_manager)
-                if pr is None:
-                    continue  # 当前状态下禁用这个 meta
-                candidate_list.append((pr, mop))
-
-            # 没有任何候选元操作了，退出
-            if not candidate_list:
-                break
-
-            # 按优先级从大到小排序
-            candidate_list.sort(key=lambda x: x[0], reverse=True)
+            # 计算当前状态下的“可用元操作 + 优先级”（已按优先级从大到小排序）
+            candidate_list = self._meta_candidates()
 
             executed = False
             for _, mop in candidate_list:
-                if mop.can_execute(timer = self.timer, state_manager = self.state_manager, character = self):
+                if self._can_execute(mop):
                     mop.execute(self.timer, self.state_manager, record_list=rotation_log, character=self)
                     steps += 1
                     executed = True
+                    idle = 0
                     break
 
             if not executed:
-                # 有候选，但没有任何一个能执行（资源不足等），退出
+                # 没有候选元操作，或有候选但都不能执行（资源不足等）：等待或退出
+                idle += 1
+                if wait and idle <= self.MAX_IDLE_EVENTS and self._wait_step(wait_ops):
+                    continue
                 break
+            yield
 
-        return rotation_log
+    # ---------- 逻辑 3：基于元操作的束搜索规划 ----------
+    def _make_objective(self, objective):
+        """
+        objective 可以是：
+        - 资源 id（str）：该资源在规划期间的累计获得量（produce_total）/ 经过时间
+        - callable(character, rotation_log, elapsed) -> float：自定义打分，越大越好
+        """
+        if callable(objective):
+            return objective
+        if objective not in self.resources:
+            raise ValueError(f"未知的规划目标资源: {objective}")
+        res = self.resources[objective]
+        start = res.produce_total
+
+        def score(character, rotation_log, elapsed):
+            gained = res.produce_total - start
+            return gained / elapsed if elapsed > 0 else gained
+        return score
+
+    def plan_rotation(self, horizon, beam_width, objective):
+        """
+        逻辑3：
+        在 build_rotation_from_meta 的基础上做束搜索（beam search）：
+          1）每一层对每个保留分支，展开所有当前可执行的元操作（快照 + 真实执行）
+          2）用 objective 给展开后的部分循环打分
+          3）只保留得分最高的 beam_width 个分支，继续展开，最多 horizon 层
+        没有可执行元操作、或已到达 timer.total_time 的分支视为已结束：原样带入下一层，
+        与其他分支一起按得分排名（不会因为走不下去就被丢掉）。同分时保持优先级顺序。
+
+        结束后角色停在最优分支的末状态（与 build_rotation_from_meta 一样会修改角色），
+        返回最优分支的记录列表。
+        """
+        self._ensure_compiled()
+        self._mark_all_dirty()
+        score_fn = self._make_objective(objective)
+        timer = self.timer
+        start_time = timer.current_time
+        beam_width = max(1, int(beam_width))
+
+        # [(score, snapshot, rotation_log, finished), ...]
+        beams = [(0.0, self.snapshot(), [], False)]
+        for _ in range(int(horizon)):
+            if all(done for _, _, _, done in beams):
+                break
+            children = []
+            for branch in beams:
+                _, snap, log, done = branch
+                if done:
+                    children.append(branch)
+                    continue
+                self.restore(snap)
+                expanded = False
+                if timer.total_time is None or timer.current_time < timer.total_time:
+                    self.state_manager.update(timer)
+                    base = self.snapshot()
+                    for _, mop in self._meta_candidates():
+                        self.restore(base)
+                        if not self._can_execute(mop):
+                            continue
+                        child_log = list(log)
+                        mop.execute(timer, self.state_manager, record_list=child_log, character=self)
+                        elapsed = timer.current_time - start_time
+                        children.append((score_fn(self, child_log, elapsed), self.snapshot(), child_log, False))
+                        expanded = True
+                if not expanded:
+                    children.append((branch[0], snap, log, True))
+            # sort 是稳定的：同分时保留展开顺序（即优先级顺序）
+            children.sort(key=lambda c: c[0], reverse=True)
+            beams = children[:beam_width]
+
+        _, best_snap, best_log, _ = beams[0]
+        self.restore(best_snap)
+        return best_log
 
     # ---------- 逻辑 2：基于单个 Operation 的贪心优先级 ----------
-    def build_rotation_greedy_ops(self, max_steps=9999, op_priority=None):
+    def build_rotation_greedy_ops(self, max_steps=9999, op_priority=None, wait=False, record_list=None):
         """
         逻辑2：
         对单个 Operation 做简单优先级排序，每次从优先级最高到最低，
         找到第一个 test() 为 True 的操作，立即执行并加入序列。
-        如果一轮中没有任何操作可以执行，则终止。
+        如果一轮中没有任何操作可以执行，则终止（wait=True 时先等待，规则同 build_rotation_from_meta）。
+        到达 timer.total_time 后不再开始新的操作；record_list 同 build_rotation_from_meta。
         返回：记录列表。
         """
-        rotation_log = []
+        rotation_log = [] if record_list is None else record_list
+        for _ in self._greedy_steps(max_steps, op_priority, wait, rotation_log):
+            pass
+        return rotation_log
+
+    def _greedy_steps(self, max_steps, op_priority, wait, rotation_log):
+        """build_rotation_greedy_ops 的循环体：每执行一个操作 yield 一次"""
+        self._ensure_compiled()
+        timer = self.timer
 
         if op_priority is not None:
             # op_priority 可以是 Operation.id 的列表
@@ -1747,18 +3437,262 @@ class Character:
             # 默认就按加入顺序
             ordered_ops = list(self.operations)
 
-        for _ in range(max_steps):
+        steps = 0
+        idle = 0
+        while steps < max_steps:
+            if timer.total_time is not None and timer.current_time >= timer.total_time:
+                break
             self.state_manager.update(self.timer)
             executed = False
             for op in ordered_ops:
                 if op.test(state_manager=self.state_manager):
-                    rec = op.operate(self.timer, self.state_manager)
+                    rec = op.operate(self.timer, self.state_manager, rng=self.rng)
                     rotation_log.append(rec)
                     self._apply_time_regen()
                     self._after_operation_executed(op)
+                    steps += 1
                     executed = True
+                    idle = 0
                     break
             if not executed:
+                idle += 1
+                if wait and idle <= self.MAX_IDLE_EVENTS and self._wait_step(ordered_ops):
+                    continue
                 break
+            yield
+
+    # ---------- 流式记录 ----------
+    def iter_rotation(self, mode="meta", *, max_steps=9999, op_priority=None, wait=False):
+        """
+        与 build_rotation_from_meta / build_rotation_greedy_ops 相同的循环，但不累积列表：
+        每产生一条记录就 yield 一个 RotationRecord(op_id, counter, time, consume)，
+        consume 为 ((资源id, 消耗量), ...)。资源 id 直接引用 Resource.id 本身，不会复制字符串。
+
+        可以边跑边写盘 / 聚合，也可以随时 break 提前结束（角色停在最后一步之后的状态）。
+        mode: "meta" 或 "greedy_ops"；其余参数同对应的构建函数。
+        """
+        buf = []
+        for _ in self._rotation_steps(mode, max_steps, op_priority, wait, buf):
+            # 元操作一次可能产生多条记录，逐条交出后清空缓冲
+            for rec in buf:
+                yield RotationRecord(rec[0], rec[1], rec[2], tuple(rec[3].items()))
+            buf.clear()
+
+    def _rotation_steps(self, mode, max_steps, op_priority, wait, rotation_log):
+        _check_rotation_mode(mode)
+        if mode == "greedy_ops":
+            return self._greedy_steps(max_steps, op_priority, wait, rotation_log)
+        return self._meta_steps(max_steps, wait, rotation_log)
+
+    # ---------- 固定时长窗口 ----------
+    def simulate_window(self, duration, mode="meta", *, max_steps=9999, op_priority=None, wait=True,
+                        extrapolate=False):
+        """
+        固定时长（DPS 窗口）模拟：从当前时刻起把 timer.total_time 临时设为 当前时间 + duration，
+        跑一次循环（默认 wait=True，资源不够时等待而不是提前结束），返回窗口内的聚合：
+            {"duration", "op_records", "count:<op>", "produce:<res>", "produce_per_sec:<res>", ...}
+        跨越窗口结束时刻的那一步按时间比例折算（见 WindowRecorder.window）。
+        mode: "meta"（build_rotation_from_meta）或 "greedy_ops"（build_rotation_greedy_ops）
+        extrapolate=True：边跑边检测稳态循环（见 detect_cycle），找到并真实验证一个周期后，把剩余时间里
+        能放下的整周期直接按周期增量推进（_skip_cycles），只真实模拟预热、两个周期和最后不足一个周期的部分。
+        max_steps 只计真实模拟的步数。
+        外推是近似：指纹按 fingerprint_quantum 量化，量化后相同、实际差一点点的状态（如充能恰好在
+        边界上就绪）在很多个周期之后可能走出不同的分支，而验证只覆盖一个周期；需要与逐步模拟
+        完全一致时不要开 extrapolate。
+        角色会停在循环结束后的状态。
+        """
+        _check_rotation_mode(mode)
+        self._ensure_compiled()
+        timer = self.timer
+        end = timer.current_time + duration
+        old_cap = timer.total_time
+        timer.total_time = end if old_cap is None else min(old_cap, end)
+        sink = WindowRecorder(self)
+        try:
+            if extrapolate:
+                self._run_extrapolated(mode, max_steps, op_priority, wait, sink)
+            elif mode == "greedy_ops":
+                self.build_rotation_greedy_ops(max_steps, op_priority, wait=wait, record_list=sink)
+            else:
+                self.build_rotation_from_meta(max_steps, wait=wait, record_list=sink)
+        finally:
+            timer.total_time = old_cap
+        return sink.finish().window(end)
+
+    # ---------- 稳态循环检测与外推 ----------
+    def _cycle_fingerprint(self):
+        """
+        循环检测用的状态指纹：_state_fingerprint 再加上有回复规则、但不影响可执行性的资源数值。
+        只被产出的累计量（伤害等）不进指纹，它们按周期增量外推。
+        """
+        layout = self._get_snapshot_layout()
+        extra = getattr(layout, "cycle_extra_idx", None)
+        if extra is None:
+            plan = getattr(layout, "fingerprint_plan", None)
+            if plan is None:
+                plan = layout.fingerprint_plan = self._fingerprint_plan(layout)
+            regen = {rule.resource for rule in self.resource_regen_rules}
+            extra = layout.cycle_extra_idx = [r._idx for r in self.resource_bank.resources
+                                              if r in regen and r._idx not in plan[0]]
+        key = self._state_fingerprint()
+        if extra:
+            q = 1.0 / self.fingerprint_quantum
+            cur = self.resource_bank.current
+            key = key + tuple(round(cur[i] * q) for i in extra)
+        return key
+
+    def _cycle_point(self, step):
+        """记录一个检测点：(步数, 时刻, 各操作 counter, 各资源 produce_total, consume_total)"""
+        bank = self.resource_bank
+        ops = self._get_snapshot_layout().operations
+        return (step, self.timer.current_time, [op.counter for op in ops],
+                bank.produce_total[:], bank.consume_total[:])
+
+    def _make_cycle(self, origin, first, last):
+        """由起点与周期首尾两个检测点组装 RotationCycle"""
+        ops = self._get_snapshot_layout().operations
+        resources = self.resource_bank.resources
+        k0, t0, n0, p0, c0 = first
+        k1, t1, n1, p1, c1 = last
+        counts = {}
+        for op, a, b in zip(ops, n0, n1):
+            if b != a:
+                counts[op.id] = counts.get(op.id, 0) + (b - a)
+        return RotationCycle(
+            warmup_steps=k0 - origin[0], warmup_time=t0 - origin[1], start_time=t0,
+            period_steps=k1 - k0, period_time=t1 - t0, op_counts=counts,
+            consume={r.id: c1[i] - c0[i] for i, r in enumerate(resources)},
+            produce={r.id: p1[i] - p0[i] for i, r in enumerate(resources)},
+        )
+
+    def _same_period(self, a, b, c):
+        """检测点 a→b 与 b→c 两段的增量是否一致（步数、操作次数相同，时间与资源累计量在量化精度内相等）"""
+        if b[0] - a[0] != c[0] - b[0]:
+            return False
+        if any(y - x != z - y for x, y, z in zip(a[2], b[2], c[2])):
+            return False
+        tol = self.fingerprint_quantum
+        if abs((c[1] - b[1]) - (b[1] - a[1])) > tol:
+            return False
+        for i in (3, 4):
+            if any(abs((z - y) - (y - x)) > tol * max(1.0, abs(y - x)) for x, y, z in zip(a[i], b[i], c[i])):
+                return False
+        return True
 
-        return rotation_log
\ No newline at end of file
+    def _find_cycle(self, steps):
+        """
+        逐步推进 steps（_rotation_steps 的生成器），直到找到一个经过真实模拟验证的周期：
+        指纹第一次重复时先不认，再真实跑一个周期，要求每一步的指纹都与上一周期同位置的一致、
+        整段增量也一致（_same_period），才返回 (起点, 周期首, 周期尾) 三个检测点，此时角色停在
+        第三个周期开始处。验证中途对不上就丢掉这个候选继续找；steps 跑完仍没有则返回 None。
+        """
+        origin = self._cycle_point(0)
+        keys = [self._cycle_fingerprint()]
+        seen = {keys[0]: origin}
+        cand = None  # (周期首, 周期尾)：待验证的候选周期
+        for k, _ in enumerate(steps, 1):
+            key = self._cycle_fingerprint()
+            keys.append(key)
+            if cand is not None:
+                first, mid = cand
+                offset = k - mid[0]
+                if key == keys[first[0] + offset]:
+                    if offset < mid[0] - first[0]:
+                        continue
+                    if self._same_period(first, mid, self._cycle_point(k)):
+                        return origin, first, mid
+                cand = None
+            first = seen.get(key)
+            point = self._cycle_point(k)
+            seen[key] = point
+            if first is not None and self.timer.current_time > first[1]:
+                cand = (first, point)
+        return None
+
+    def detect_cycle(self, mode="meta", *, max_steps=9999, op_priority=None, wait=False, record_list=None):
+        """
+        跑循环（mode / 参数同 iter_rotation），每步结束后记下状态指纹（_cycle_fingerprint，
+        只看相对时间，按 fingerprint_quantum 量化）；某一步的指纹与之前某一步相同时，再真实跑一个周期
+        确认确实按这段重复（见 _find_cycle），然后停下并返回 RotationCycle（预热步数 / 时间、
+        周期步数 / 时间、一个周期的各操作次数与资源消耗 / 获得）。
+
+        循环自然结束或到 max_steps 都没有找到时返回 None。
+        含概率机制（结果取决于随机数）的角色状态不会精确重复，直接返回 None，不运行。
+        角色停在验证完的那一步之后（即第三个周期开始时的状态）；记录写进 record_list（默认丢弃）。
+        """
+        layout = self._get_snapshot_layout()
+        if layout.stochastic:
+            return None
+        log = [] if record_list is None else record_list
+        steps = self._rotation_steps(mode, max_steps, op_priority, wait, log)
+        found = self._find_cycle(steps)
+        if found is None:
+            return None
+        steps.close()
+        return self._make_cycle(*found)
+
+    def _skip_cycles(self, cycle: RotationCycle, n: int, op_deltas) -> int:
+        """
+        把角色解析地推进 n 个周期（要求此刻正处在一个周期的起点）；
+        op_deltas 为一个周期内快照布局里各操作 counter 的增量（按 layout.operations 的顺序）。
+        所有绝对时间字段平移 n * period_time，各操作 counter 与资源 produce / consume_total
+        加上 n 倍周期增量；不进指纹的累计资源数值加上 n 倍净增量。
+        累计资源会在 n 个周期内碰到上限 / 下限时减少 n（截断不是线性的），返回实际推进的周期数。
+        """
+        if n <= 0:
+            return 0
+        bank = self.resource_bank
+        layout = self._get_snapshot_layout()
+        fixed = set(layout.fingerprint_plan[0]) | set(getattr(layout, "cycle_extra_idx", None) or ())
+        cur, up = bank.current, bank.upper
+        net = {}
+        for i, r in enumerate(bank.resources):
+            d = cycle.produce[r.id] - cycle.consume[r.id]
+            if i in fixed or d == 0:
+                continue
+            room = (up[i] - cur[i]) if d > 0 else cur[i]
+            n = min(n, int(room // abs(d)))
+            net[i] = d
+        if n <= 0:
+            return 0
+
+        dt = n * cycle.period_time
+        self.timer.current_time += dt
+        self._last_tick_time += dt
+        for st in layout.states:
+            if st.type == 2:
+                st.start_time[:] = [t if t is None else t + dt for t in st.start_time]
+                st._slot_heap[:] = [(t + dt, slot) for t, slot in st._slot_heap]
+            elif st.current > 0:
+                st.start_time += dt
+            if st._scheduled_at is not None:
+                st._scheduled_at += dt
+        heap = self.state_manager._expiry_heap
+        # 统一平移不改变堆序
+        heap[:] = [(key + dt, seq, st) for key, seq, st in heap]
+
+        for op, k in zip(layout.operations, op_deltas):
+            op.counter += n * k
+        for i, r in enumerate(bank.resources):
+            bank.produce_total[i] += n * cycle.produce[r.id]
+            bank.consume_total[i] += n * cycle.consume[r.id]
+        for i, d in net.items():
+            cur[i] += n * d
+        self._mark_all_dirty()
+        return n
+
+    def _run_extrapolated(self, mode, max_steps, op_priority, wait, sink):
+        """simulate_window(extrapolate=True) 的循环体：找到并验证循环后跳过能放下的整周期，再把余下的跑完"""
+        layout = self._get_snapshot_layout()
+        timer = self.timer
+        steps = self._rotation_steps(mode, max_steps, op_priority, wait, sink)
+        found = None if layout.stochastic else self._find_cycle(steps)
+        if found is not None:
+            origin, first, last = found
+            cycle = self._make_cycle(origin, first, last)
+            n = int((timer.total_time - timer.current_time) // cycle.period_time)
+            n = self._skip_cycles(cycle, n, [b - a for a, b in zip(first[2], last[2])])
+            if n:
+                sink.skip(cycle, n)
+        for _ in steps:
+            pass
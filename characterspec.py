@@ -0,0 +1,784 @@
+"""
+声明式角色配置 CharacterSpec：
+
+- 以“表名 → 行列表”的形式保存角色的全部配置（资源、状态、操作、元操作、回复/触发规则），
+  表结构与 character.xlsm 的各个 sheet 一一对应，对象之间只用 id 互相引用
+- 可以 JSON / msgpack 往返，可以 pickle，可以直接发给子进程或缓存到磁盘
+- build() 按 id 把对象图连起来，返回真正的 Character
+- from_xlsm() 用 openpyxl 直接读 .xlsm 文件，不需要启动 Excel
+- SpecCache 把解析结果和构建好的角色按内容哈希缓存到磁盘，只重新解析改动过的表
+
+    spec = CharacterSpec.from_xlsm("character.xlsm")
+    spec.to_json(path="character.json")
+    ch = CharacterSpec.from_json(path="character.json").build()
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+from character import (
+    Timer,
+    Character,
+    Resource,
+    State,
+    StateResourceEffect,
+    OperationAccelerate,
+    OperationResourceEfficiency,
+    Operation,
+    StateEffect,
+    ResourceStateRule,
+    ResourceStateRemoveRule,
+    ResourceRegenRule,
+    ResourceThreshold,
+    MetaOperation,
+    MetaPriorityRule,
+    OperationTriggeredStateRule,
+)
+
+# build() 读取的全部表（与 Excel sheet 名一致）
+SHEET_NAMES = (
+    "Resources",
+    "States",
+    "StateResourceEffects",
+    "StateMetaPriorityRules",
+    "StateOpAccelerateRules",
+    "StateOpEfficiencyRules",
+    "Operations（基础）",
+    "OperationConsumes",
+    "OperationProduces",
+    "OperationStatesOutput",
+    "OperationStateRequirements",
+    "OperationStateForbids",
+    "OperationStateEffects",
+    "ResourceStateRules",
+    "ResourceStateRemoveRules",
+    "RegenRules",
+    "RegenRuleStateRequirements",
+    "RegenRuleStateForbids",
+    "MetaOperations",
+    "MetaOpOperations",
+    "MetaOpOnSuccessStates",
+    "MetaOpStateRequirements",
+    "MetaOpStateForbids",
+    "OperationTriggeredStateRules",
+)
+
+
+# ===================== 单元格解析 =====================
+def _columns_from_values(vals):
+    """
+    二维单元格值 -> 列式表 {列名: [值, ...]}
+    第一行是表头；只保留有表头的列；第一列（id 列）为空的行视为空行
+    （sheet 里的“返回总表”等导航单元格、旁注都不会被当成数据）。
+    """
+    if not vals:
+        return {}
+    if not isinstance(vals[0], (list, tuple)):
+        vals = [vals]
+    header = [h.strip() if isinstance(h, str) else h for h in vals[0]]
+    cols = [(i, h) for i, h in enumerate(header) if h not in (None, "")]
+    body = [r for r in vals[1:] if r and r[0] not in (None, "")]
+    return {h: [(r[i] if i < len(r) else None) for r in body] for i, h in cols}
+
+
+def _as_columns(table):
+    """行式 [dict, ...] 或列式 {列名: [...]} -> 列式（拷贝）"""
+    if not table:
+        return {}
+    if isinstance(table, dict):
+        return {k: list(v) for k, v in table.items()}
+    keys = {}
+    for r in table:
+        for k in r:
+            keys.setdefault(k, None)
+    return {k: [r.get(k) for r in table] for k in keys}
+
+
+def _iter_rows(table):
+    """列式表逐行产出 dict"""
+    if not table:
+        return
+    keys = list(table)
+    for vals in zip(*table.values()):
+        yield dict(zip(keys, vals))
+
+
+def _rows_from_values(vals):
+    """二维单元格值 -> [dict, ...]"""
+    return list(_iter_rows(_columns_from_values(vals)))
+
+
+def _as_bool(v):
+    if v is None:
+        return False
+    if isinstance(v, bool):
+        return v
+    s = str(v).strip().lower()
+    if s in ("1", "true", "yes", "y", "t"):
+        return True
+    if s in ("0", "false", "no", "n", "f", ""):
+        return False
+    # 兜底：能转数字就按非0
+    try:
+        return bool(int(float(s)))
+    except Exception:
+        return False
+
+
+def _as_list(s):
+    if s is None or s == "":
+        return []
+    return [x.strip() for x in str(s).split(",") if x.strip()]
+
+
+def _parse_list(v):
+    if v is None or v == "":
+        return []
+    if isinstance(v, list):
+        return v
+    s = str(v).strip()
+    if s.startswith("["):
+        try:
+            return json.loads(s)
+        except Exception:
+            pass
+    return [x for x in s.split(";") if x]
+
+
+def _parse_required_states(val):
+    """"a:2;b" -> [("a", 2), ("b", 1)]"""
+    res = []
+    for item in _parse_list(val):
+        parts = str(item).split(":")
+        res.append((parts[0], int(parts[1]) if len(parts) > 1 else 1))
+    return res
+
+
+def _parse_forbidden_states(val):
+    return [str(item).split(":")[0] for item in _parse_list(val)]
+
+
+def _parse_resource_thresholds(val):
+    """"rage:50:>=" -> [("rage", 50.0, ">=")]"""
+    res = []
+    for item in _parse_list(val):
+        parts = str(item).split(":")
+        if len(parts) >= 2:
+            res.append((parts[0], float(parts[1]), parts[2] if len(parts) >= 3 else ">="))
+    return res
+
+
+def _opt_float(v):
+    return None if v in (None, "") else float(v)
+
+
+# ===================== 单表解析 =====================
+# 每张表解析成 tuple 列表：数值 / 布尔都已转好，引用别的表的 id 仍是字符串（连接时再查），
+# 因此解析结果只取决于本表内容，可以按单表内容哈希缓存（见 SpecCache.parsed_tables）。
+def _parse_resources(rows):
+    return [(r["id"], float(r["upper_limit"]), float(r["current"])) for r in rows]
+
+
+def _parse_states(rows):
+    return [(r["id"], float(r["current"]), float(r["upper_limit"]), float(r["time"]), int(r["type"]),
+             int(r["length"]), r.get("expire_mode", "time") or "time") for r in rows]
+
+
+def _parse_state_resource_effects(rows):
+    return [(r["state_id"], r["resource_id"], float(r.get("on_add", 0) or 0), float(r.get("on_remove", 0) or 0),
+             _as_bool(r.get("per_stack", 0)), _opt_float(r.get("ratio_on_add")), _opt_float(r.get("ratio_on_remove")))
+            for r in rows]
+
+
+def _parse_state_meta_priority_rules(rows):
+    return [(r["state_id"], r["meta_id"], float(r["delta"]), int(r.get("min_stack", 1) or 1)) for r in rows]
+
+
+def _parse_state_op_accelerate_rules(rows):
+    return [(r["state_id"], r["op_id"], float(r.get("ratio", 0) or 0), float(r.get("ratio_per_stack", 0) or 0),
+             _as_bool(r.get("by_current_stack", 1)), float(r.get("min_ratio", 0) or 0),
+             float(r.get("max_ratio", 0.95) or 0.95)) for r in rows]
+
+
+def _parse_state_op_efficiency_rules(rows):
+    return [(r["state_id"], r["op_id"], r.get("target", "both"),
+             None if r.get("resource_id") in (None, "") else r["resource_id"],
+             float(r.get("mul", 1) or 1), float(r.get("mul_per_stack", 0) or 0),
+             _as_bool(r.get("by_current_stack", 1)), float(r.get("min_mul", 0) or 0),
+             float(r.get("max_mul", 10) or 10)) for r in rows]
+
+
+def _parse_operations(rows):  # 列: op_id, base_time, max_charges?, charge_cd?, probability?
+    return [(r["op_id"], float(r["base_time"]), _opt_float(r.get("max_charges")), _opt_float(r.get("charge_cd")),
+             float(r["probability"]) if r.get("probability") not in (None, "") else 1.0) for r in rows]
+
+
+def _parse_operation_consumes(rows):  # op_id, resource_id, consume, consume_upper?, consume_lower?
+    return [(r["op_id"], r["resource_id"], float(r["consume"]), _opt_float(r.get("consume_upper")),
+             _opt_float(r.get("consume_lower"))) for r in rows]
+
+
+def _parse_operation_produces(rows):  # op_id, resource_id, produce
+    return [(r["op_id"], r["resource_id"], float(r["produce"])) for r in rows]
+
+
+def _parse_op_state_pairs(rows):
+    return [(r["op_id"], r["state_id"]) for r in rows]
+
+
+def _parse_operation_state_requirements(rows):
+    return [(r["op_id"], r["state_id"], int(r.get("min_stack", 1) or 1)) for r in rows]
+
+
+def _parse_operation_state_effects(rows):
+    return [(r["op_id"], r["state_id"], r.get("target", "both"),
+             None if r.get("resource_id") in (None, "") else r["resource_id"],
+             r.get("op", "mul"), float(r.get("value", 1) or 1), int(r.get("min_stack", 1) or 1),
+             None if r.get("max_stack") in (None, "") else int(r["max_stack"])) for r in rows]
+
+
+def _parse_resource_state_rules(rows):
+    return [(r["op_id"], r["resource_id"], float(r["threshold"]), r["state_id"], r.get("mode", ">="),
+             _as_bool(r.get("once", 1))) for r in rows]
+
+
+def _parse_resource_state_remove_rules(rows):
+    return [(r["op_id"], r["resource_id"], r["state_id"], float(r["threshold"]), r.get("mode", "<="),
+             _as_bool(r.get("require_active", 1))) for r in rows]
+
+
+def _parse_regen_rules(rows):  # rule_id, resource_id, rate_per_sec
+    return [(r["rule_id"], r["resource_id"], float(r["rate_per_sec"])) for r in rows]
+
+
+def _parse_regen_requirements(rows):
+    """子表按 rule_id 一次分组：{rule_id: [(state_id, min_stack), ...]}"""
+    groups = {}
+    for r in rows:
+        groups.setdefault(r.get("rule_id"), []).append((r["state_id"], int(r.get("min_stack", 1) or 1)))
+    return groups
+
+
+def _parse_regen_forbids(rows):
+    groups = {}
+    for r in rows:
+        groups.setdefault(r.get("rule_id"), []).append(r["state_id"])
+    return groups
+
+
+def _parse_meta_operations(rows):  # meta_id, type, base_priority, n
+    return [(r["meta_id"], int(r.get("type", 1) or 1), int(r.get("base_priority", 0) or 0),
+             None if r.get("n") in ("", None) else int(r["n"])) for r in rows]
+
+
+def _parse_meta_op_operations(rows):  # meta_id, order, op_id
+    """按 meta_id 分组并按 order 排序：{meta_id: [op_id, ...]}"""
+    groups = {}
+    for r in rows:
+        groups.setdefault(r.get("meta_id"), []).append(r)
+    return {meta_id: [r["op_id"] for r in sorted(rs, key=lambda x: int(x.get("order", 0) or 0))]
+            for meta_id, rs in groups.items()}
+
+
+def _parse_meta_state_pairs(rows):
+    return [(r["meta_id"], r["state_id"]) for r in rows]
+
+
+def _parse_meta_state_requirements(rows):
+    return [(r["meta_id"], r["state_id"], int(r.get("min_stack", 1) or 1)) for r in rows]
+
+
+def _parse_triggered_state_rules(rows):
+    # trigger_op_id, target_state_id, add_stacks, once_per_operation_call, required_states?, forbidden_states?, resource_thresholds?
+    return [(r["trigger_op_id"], r["target_state_id"], _parse_required_states(r.get("required_states", "")),
+             _parse_forbidden_states(r.get("forbidden_states", "")),
+             _parse_resource_thresholds(r.get("resource_thresholds", "")),
+             int(r.get("add_stacks", 1) or 1), _as_bool(r.get("once_per_operation_call", 1)),
+             float(r["probability"]) if r.get("probability") not in (None, "") else 1.0) for r in rows]
+
+
+SHEET_PARSERS = {
+    "Resources": _parse_resources,
+    "States": _parse_states,
+    "StateResourceEffects": _parse_state_resource_effects,
+    "StateMetaPriorityRules": _parse_state_meta_priority_rules,
+    "StateOpAccelerateRules": _parse_state_op_accelerate_rules,
+    "StateOpEfficiencyRules": _parse_state_op_efficiency_rules,
+    "Operations（基础）": _parse_operations,
+    "OperationConsumes": _parse_operation_consumes,
+    "OperationProduces": _parse_operation_produces,
+    "OperationStatesOutput": _parse_op_state_pairs,
+    "OperationStateRequirements": _parse_operation_state_requirements,
+    "OperationStateForbids": _parse_op_state_pairs,
+    "OperationStateEffects": _parse_operation_state_effects,
+    "ResourceStateRules": _parse_resource_state_rules,
+    "ResourceStateRemoveRules": _parse_resource_state_remove_rules,
+    "RegenRules": _parse_regen_rules,
+    "RegenRuleStateRequirements": _parse_regen_requirements,
+    "RegenRuleStateForbids": _parse_regen_forbids,
+    "MetaOperations": _parse_meta_operations,
+    "MetaOpOperations": _parse_meta_op_operations,
+    "MetaOpOnSuccessStates": _parse_meta_state_pairs,
+    "MetaOpStateRequirements": _parse_meta_state_requirements,
+    "MetaOpStateForbids": _parse_meta_state_pairs,
+    "OperationTriggeredStateRules": _parse_triggered_state_rules,
+}
+
+
+def parse_sheet(sheet, table):
+    """单张表（列式 / 行式 / None）-> 解析结果"""
+    return SHEET_PARSERS[sheet](_iter_rows(_as_columns(table)))
+
+
+def parse_tables(tables):
+    """{表名: 表} -> {表名: 解析结果}，缺失的表按空表解析"""
+    return {sheet: parse_sheet(sheet, tables.get(sheet)) for sheet in SHEET_NAMES}
+
+
+# ===================== 由表构建角色 =====================
+def build_character_from_tables(tables, name="xl_factory"):
+    """
+    tables: {表名: 列式表 {列名: [...]} 或 [行dict, ...]}，表名见 SHEET_NAMES；缺失的表视为空表。
+    返回按 id 连好对象图的 Character。
+    """
+    return build_character_from_parsed(parse_tables(tables), name=name)
+
+
+def build_character_from_parsed(parsed, name="xl_factory"):
+    """parsed: parse_tables() 的结果；按 id 把对象图连起来，返回 Character"""
+    # 资源
+    res_map = {}
+    for rid, upper, current in parsed["Resources"]:
+        res_map[rid] = Resource(rid, upper, current)
+
+    # 状态
+    state_map = {}
+    for sid, current, upper, time, type_, length, expire_mode in parsed["States"]:
+        state_map[sid] = State(id=sid, current=current, upper_limit=upper, time=time, type=type_, length=length,
+                               expire_mode=expire_mode)
+
+    # 状态↔资源
+    for sid, rid, on_add, on_remove, per_stack, ratio_on_add, ratio_on_remove in parsed["StateResourceEffects"]:
+        st = state_map[sid]
+        res = res_map[rid]
+        st.resource_effects.append(
+            StateResourceEffect(
+                resource=res,
+                on_add=on_add,
+                on_remove=on_remove,
+                per_stack=per_stack,
+                ratio_on_add=ratio_on_add,
+                ratio_on_remove=ratio_on_remove,
+            )
+        )
+
+    # 状态→元操作优先级
+    for sid, meta_id, delta, min_stack in parsed["StateMetaPriorityRules"]:
+        state_map[sid].meta_priority_rules.append(MetaPriorityRule(meta_id, delta, min_stack))
+
+    # 状态→操作加速
+    for sid, op_id, ratio, ratio_per_stack, by_current_stack, min_ratio, max_ratio in parsed["StateOpAccelerateRules"]:
+        state_map[sid].op_accelerate_rules.append(
+            OperationAccelerate(
+                operation=op_id,  # 先放 id，占位，稍后替换成对象
+                ratio=ratio,
+                ratio_per_stack=ratio_per_stack,
+                by_current_stack=by_current_stack,
+                min_ratio=min_ratio,
+                max_ratio=max_ratio,
+            )
+        )
+
+    # 状态→操作效率
+    for sid, op_id, target, rid, mul, mul_per_stack, by_current_stack, min_mul, max_mul in parsed["StateOpEfficiencyRules"]:
+        st = state_map[sid]
+        st.op_efficiency_rules.append(
+            OperationResourceEfficiency(
+                operation=op_id,  # 先放 id，占位，稍后替换成对象
+                target=target,
+                resource=None if rid is None else res_map[rid],
+                mul=mul,
+                mul_per_stack=mul_per_stack,
+                by_current_stack=by_current_stack,
+                min_mul=min_mul,
+                max_mul=max_mul,
+            )
+        )
+
+    # 操作
+    op_map = {}
+    for op_id, base_time, max_charges, charge_cd, probability in parsed["Operations（基础）"]:
+        op_map[op_id] = Operation(
+            id=op_id,
+            time=base_time,
+            resource_requirements=[],
+            resource_outputs=[],
+            resource_consumes=[],
+            resource_produces=[],
+            statesoutput=[],
+            consume_upper_limits=[],
+            consume_lower_limits=[],
+            max_charges=max_charges,
+            charge_cd=charge_cd,
+            probability=probability,
+        )
+
+    # 操作消耗
+    for op_id, rid, consume, upper, lower in parsed["OperationConsumes"]:
+        op = op_map[op_id]
+        op.resource_requirements.append(res_map[rid])
+        op.resource_consumes.append(consume)
+        op.consume_upper_limits.append(upper)
+        op.consume_lower_limits.append(lower)
+
+    # 操作产出
+    for op_id, rid, produce in parsed["OperationProduces"]:
+        op = op_map[op_id]
+        op.resource_outputs.append(res_map[rid])
+        op.resource_produces.append(produce)
+
+    # 操作施加状态
+    for op_id, sid in parsed["OperationStatesOutput"]:
+        op_map[op_id].statesoutput.append(state_map[sid])
+
+    # 操作状态需求/禁止
+    for op_id, sid, min_stack in parsed["OperationStateRequirements"]:
+        op_map[op_id].state_requirements.append((state_map[sid], min_stack))
+    for op_id, sid in parsed["OperationStateForbids"]:
+        op_map[op_id].state_forbids.append(state_map[sid])
+
+    # 操作状态修正
+    for op_id, sid, target, rid, op_name, value, min_stack, max_stack in parsed["OperationStateEffects"]:
+        op_map[op_id].state_effects.append(
+            StateEffect(
+                state=state_map[sid],
+                target=target,
+                resource=None if rid is None else res_map[rid],
+                op=op_name,
+                value=value,
+                min_stack=min_stack,
+                max_stack=max_stack,
+            )
+        )
+
+    # 资源→状态规则
+    for op_id, rid, threshold, sid, mode, once in parsed["ResourceStateRules"]:
+        op_map[op_id].resource_state_rules.append(
+            ResourceStateRule(
+                resource=res_map[rid],
+                threshold=threshold,
+                state=state_map[sid],
+                mode=mode,
+                once=once,
+            )
+        )
+
+    # 资源→移除状态规则
+    for op_id, rid, sid, threshold, mode, require_active in parsed["ResourceStateRemoveRules"]:
+        op_map[op_id].resource_state_remove_rules.append(
+            ResourceStateRemoveRule(
+                resource=res_map[rid],
+                state=state_map[sid],
+                threshold=threshold,
+                mode=mode,
+                require_active=require_active,
+            )
+        )
+
+    # 时间回复规则
+    regen_rules = []
+    req_by_rule = parsed["RegenRuleStateRequirements"]
+    forb_by_rule = parsed["RegenRuleStateForbids"]
+    for rule_id, rid, rate in parsed["RegenRules"]:
+        regen_rules.append(
+            ResourceRegenRule(
+                resource=res_map[rid],
+                rate_per_sec=rate,
+                state_requirements=[(state_map[sid], need) for sid, need in req_by_rule.get(rule_id, ())],
+                state_forbids=[state_map[sid] for sid in forb_by_rule.get(rule_id, ())],
+            )
+        )
+
+    # 元操作
+    meta_map = {}
+    for meta_id, type_, base_priority, n in parsed["MetaOperations"]:
+        meta_map[meta_id] = MetaOperation(
+            id=meta_id,
+            operations=[],
+            type=type_,
+            base_priority=base_priority,
+            on_success_states=[],
+            n=n,
+        )
+
+    # 元操作序列
+    for meta_id, op_ids in parsed["MetaOpOperations"].items():
+        meta_map[meta_id].operations.extend(op_map[op_id] for op_id in op_ids)
+
+    # 元操作成功施加状态
+    for meta_id, sid in parsed["MetaOpOnSuccessStates"]:
+        meta_map[meta_id].on_success_states.append(state_map[sid])
+
+    # 元操作状态需求/禁止
+    for meta_id, sid, min_stack in parsed["MetaOpStateRequirements"]:
+        meta_map[meta_id].meta_state_requirements.append((state_map[sid], min_stack))
+    for meta_id, sid in parsed["MetaOpStateForbids"]:
+        meta_map[meta_id].meta_state_forbids.append(state_map[sid])
+
+    for st in state_map.values():
+        fixed = []
+        for rule in st.meta_priority_rules:
+            if isinstance(rule.meta_op, str) and rule.meta_op in meta_map:
+                fixed.append(rule._replace(meta_op=meta_map[rule.meta_op]))
+            else:
+                fixed.append(rule)
+        st.meta_priority_rules = fixed
+
+    # 触发规则（单表，若有子表请自行拆分）；条件里引用了不存在的状态 / 资源时忽略该条件
+    trig_rules = []
+    for (op_id, sid, required, forbidden, thresholds, add_stacks, once,
+         probability) in parsed["OperationTriggeredStateRules"]:
+        trig_rules.append(
+            OperationTriggeredStateRule(
+                trigger_operation=op_map[op_id],
+                target_state=state_map[sid],
+                required_states=[(state_map[x], need) for x, need in required if x in state_map],
+                forbidden_states=[state_map[x] for x in forbidden if x in state_map],
+                resource_thresholds=[ResourceThreshold(res_map[x], thr, mode)
+                                     for x, thr, mode in thresholds if x in res_map],
+                add_stacks=add_stacks,
+                once_per_operation_call=once,
+                probability=probability,
+            )
+        )
+
+    # 将占位的 op_id 字符串替换成真正的对象（加速/效率规则）
+    for st in state_map.values():
+        for acc in getattr(st, "op_accelerate_rules", []):
+            if isinstance(acc.operation, str):
+                acc.operation = op_map[acc.operation]
+        for eff in getattr(st, "op_efficiency_rules", []):
+            if isinstance(eff.operation, str):
+                eff.operation = op_map[eff.operation]
+
+    # 组装角色
+    ch = Character(name, Timer(), resources=list(res_map.values()), states=list(state_map.values()))
+    ch.resource_regen_rules = regen_rules
+    for op in op_map.values():
+        ch.add_operation(op)
+    for m in meta_map.values():
+        ch.add_meta_operation(m)
+    for tr in trig_rules:
+        ch.add_op_trigger_rule(tr)
+    return ch
+
+
+def character_summary(ch):
+    """角色的可序列化摘要（Excel UDF 返回值用）"""
+    return {
+        "name": ch.name,
+        "resources": {k: {"cur": v.current, "upper": v.upper_limit} for k, v in ch.resources.items()},
+        "states": [st.id for st in ch.state_manager.states],
+        "operations": [op.id for op in ch.operations],
+        "meta_operations": {m.id: [op.id for op in m.operations] for m in ch.meta_operations},
+        "regen_rules": len(ch.resource_regen_rules),
+        "trigger_rules": len(ch.op_triggered_state_rules),
+    }
+
+
+# ===================== CharacterSpec =====================
+class CharacterSpec:
+    """
+    声明式角色配置：
+    - name: 角色名
+    - tables: {表名: {列名: [值, ...]}}（列式存储），值只有数字 / 字符串 / 布尔 / None，对象之间用 id 引用
+      构造时也接受行式 [行dict, ...]，会统一转成列式
+
+    不持有任何运行时对象，因此可以 JSON / msgpack / pickle，
+    每次 build() 都得到一个全新的、互不共享状态的 Character。
+    """
+    def __init__(self, tables=None, name="xl_factory"):
+        self.name = name
+        self.tables = {k: _as_columns(v) for k, v in (tables or {}).items()}
+
+    def build(self) -> Character:
+        return build_character_from_tables(self.tables, name=self.name)
+
+    def __repr__(self):
+        lens = {k: len(next(iter(v.values()), ())) for k, v in self.tables.items()}
+        sizes = ", ".join(f"{k}={n}" for k, n in lens.items() if n)
+        return f"<CharacterSpec name={self.name}, {sizes}>"
+
+    # ---------- 序列化 ----------
+    def to_dict(self) -> dict:
+        return {"name": self.name, "tables": self.tables}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CharacterSpec":
+        return cls(tables=data.get("tables"), name=data.get("name", "xl_factory"))
+
+    def to_json(self, path=None, **kwargs):
+        """返回 JSON 字符串；给了 path 时同时写入文件"""
+        kwargs.setdefault("ensure_ascii", False)
+        kwargs.setdefault("default", str)
+        text = json.dumps(self.to_dict(), **kwargs)
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+    @classmethod
+    def from_json(cls, text=None, path=None) -> "CharacterSpec":
+        if path is not None:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        return cls.from_dict(json.loads(text))
+
+    def to_msgpack(self) -> bytes:
+        import msgpack  # 可选依赖
+        return msgpack.packb(self.to_dict(), use_bin_type=True, default=str)
+
+    @classmethod
+    def from_msgpack(cls, data: bytes) -> "CharacterSpec":
+        import msgpack  # 可选依赖
+        return cls.from_dict(msgpack.unpackb(data, raw=False))
+
+    def content_hash(self) -> str:
+        """按表内容计算的摘要（同样的配置得到同样的值），用作已构建角色的缓存键"""
+        h = hashlib.sha1(f"{_CACHE_FORMAT}|{self.name}".encode("utf-8"))
+        for sheet in sorted(self.tables):
+            h.update(_hash_values(sheet, self.tables[sheet]).encode("ascii"))
+        return h.hexdigest()
+
+    # ---------- 读取 Excel ----------
+    @classmethod
+    def from_values(cls, raw, name="xl_factory") -> "CharacterSpec":
+        """raw: {表名: 二维单元格值}"""
+        return cls(tables={sheet: _columns_from_values(vals) for sheet, vals in raw.items()}, name=name)
+
+    @classmethod
+    def from_xlsm(cls, path, sheet_prefix="", name="xl_factory", cache=None) -> "CharacterSpec":
+        """
+        用 openpyxl 直接读取 .xlsx/.xlsm（只读、取公式计算后的值），不需要 Excel 进程。
+        给出 cache 时，文件内容完全没变则直接从缓存取 spec，连 openpyxl 都不打开。
+        """
+        book_key = None
+        if cache is not None:
+            book_key = cache.file_key(path, sheet_prefix, name)
+            spec = cache.load("book", book_key)
+            if spec is not None:
+                return spec
+
+        import openpyxl  # 可选依赖
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            raw = {}
+            for sheet in SHEET_NAMES:
+                full = f"{sheet_prefix}{sheet}"
+                if full not in wb.sheetnames:
+                    continue
+                raw[sheet] = list(wb[full].iter_rows(values_only=True))
+        finally:
+            wb.close()
+        spec = cls.from_values(raw, name=name)
+        if cache is not None:
+            cache.store("book", book_key, spec)
+        return spec
+
+    @classmethod
+    def from_xlwings_book(cls, wb, sheet_prefix="", name="xl_factory") -> "CharacterSpec":
+        """
+        从已经打开的 xlwings Book 读取（Excel UDF 场景）：
+        只枚举一次 sheet 集合，每张需要的表只做一次 used_range 取值（固定二维）
+        """
+        raw = {}
+        wanted = {f"{sheet_prefix}{sheet}": sheet for sheet in SHEET_NAMES}
+        for ws in wb.sheets:
+            sheet = wanted.get(ws.name)
+            if sheet is not None:
+                raw[sheet] = ws.used_range.options(ndim=2).value
+        return cls.from_values(raw, name=name)
+
+
+# ===================== 磁盘缓存 =====================
+# 缓存格式版本：解析规则或 Character 结构变化时递增，旧缓存自动失效
+_CACHE_FORMAT = 5
+
+
+def _hash_values(sheet, vals):
+    """单张表内容的摘要（表名 + 单元格值）"""
+    return hashlib.sha1(f"{_CACHE_FORMAT}|{sheet}|{vals!r}".encode("utf-8")).hexdigest()
+
+
+class SpecCache:
+    """
+    本地磁盘缓存，三层：
+    - book:      工作簿文件内容哈希 -> CharacterSpec（文件没变时跳过读取）
+    - sheet:     单表内容哈希 -> 该表的类型化解析结果（parse_sheet；只改了一张表时，其他表不重新解析）
+    - character: spec 内容哈希 -> 已 compile 的 Character（pickle）
+
+    单表解析结果里对其他表的引用都还是 id 字符串，只取决于本表内容，所以键只用本表的哈希。
+
+    缓存文件损坏或读取失败一律视为未命中。
+    """
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "character_spec")
+        self.directory = directory
+
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, f"{key}.pkl")
+
+    def load(self, kind, key):
+        try:
+            with open(self._path(kind, key), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def store(self, kind, key, obj):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免并发读到半个文件
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def file_key(self, path, sheet_prefix="", name="xl_factory"):
+        h = hashlib.sha1(f"{_CACHE_FORMAT}|{sheet_prefix}|{name}".encode("utf-8"))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def parsed_tables(self, spec):
+        """spec 各表的解析结果；按单表内容哈希取缓存，只解析未命中的表（空表不缓存）"""
+        parsed = {}
+        for sheet in SHEET_NAMES:
+            table = spec.tables.get(sheet)
+            if not table:
+                parsed[sheet] = parse_sheet(sheet, table)
+                continue
+            key = _hash_values(sheet, table)
+            result = self.load("sheet", key)
+            if result is None:
+                result = parse_sheet(sheet, table)
+                self.store("sheet", key, result)
+            parsed[sheet] = result
+        return parsed
+
+    def build(self, spec) -> Character:
+        """按 spec 内容取已构建的角色；未命中时用单表缓存的解析结果连接 + compile 后写入缓存"""
+        key = spec.content_hash()
+        ch = self.load("character", key)
+        if ch is None:
+            ch = build_character_from_parsed(self.parsed_tables(spec), name=spec.name)
+            ch.compile()
+            self.store("character", key, ch)
+        return ch
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,168 @@
+"""
+列式循环记录 RotationRecorder：把每条操作记录直接写进预分配、可扩容的 NumPy 结构化数组，
+代替 [op_id, counter, time, consume_by_id] 的 list + dict。
+
+    from recorder import RotationRecorder
+
+    rec = RotationRecorder(ch, state_ids=["overheat"])
+    rec.run("meta", max_steps=2000)          # 或 with rec: ch.build_rotation_from_meta(record_list=rec)
+    arr = rec.to_numpy()                      # 结构化数组视图（不拷贝）
+    dmg_per_op = np.bincount(arr["op"], weights=rec.column("produce:dmg"))
+    rec.to_parquet("rotation.parquet")        # 需要 pyarrow
+
+每条记录的字段：
+- op: 操作下标（对应 rec.op_ids）
+- counter: 操作累计执行次数
+- time: 执行结束时间；dt: 本次实际耗时（含加速）
+- consume: (资源数,) 本次消耗；produce: (资源数,) 本次实际获得（clamp 之后，不含时间回复）
+- stacks: (状态数,) 记录时各状态层数（仅当给了 state_ids）
+
+资源顺序即 rec.res_ids（= character.resources 的顺序）。
+produce / dt 需要在操作执行前后各读一次，因此记录期间会临时给每个 Operation 实例挂一个包装过的 operate，
+detach()（或 with 块结束）后恢复，角色本身不受影响。
+"""
+import numpy as np
+
+from character import _check_rotation_mode, _patch_attr, _unpatch_attrs
+
+
+class RotationRecorder:
+    def __init__(self, character, capacity=1024, state_ids=None):
+        self.character = character
+        self.res_ids = list(character.resources.keys())
+        self._res = list(character.resources.values())
+        self._res_col = {rid: k for k, rid in enumerate(self.res_ids)}
+        layout = character._get_snapshot_layout()
+        self._ops = list(layout.operations)
+        self.op_ids = [op.id for op in self._ops]
+        states = {st.id: st for st in layout.states}
+        self.state_ids = list(state_ids or [])
+        missing = [sid for sid in self.state_ids if sid not in states]
+        if missing:
+            raise ValueError(f"找不到状态: {missing}")
+        self._states = [states[sid] for sid in self.state_ids]
+
+        R, S = len(self.res_ids), len(self._states)
+        fields = [("op", "i4"), ("counter", "i8"), ("time", "f8"), ("dt", "f8"),
+                  ("consume", "f8", (R,)), ("produce", "f8", (R,))]
+        if S:
+            fields.append(("stacks", "f8", (S,)))
+        self.dtype = np.dtype(fields)
+        self._buf = np.zeros(max(1, int(capacity)), dtype=self.dtype)
+        self._n = 0
+        self._last = None
+        self._patched = []
+
+    # ---------- 挂接 ----------
+    def attach(self):
+        """给每个 Operation 实例挂上包装过的 operate（记录执行前的时间与累计获得量）"""
+        if self._patched:
+            return self
+        for j, op in enumerate(self._ops):
+            _patch_attr(self._patched, op, "operate", self._wrap(j, op.operate))
+        return self
+
+    def detach(self):
+        _unpatch_attrs(self._patched)
+        return self
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.detach()
+
+    def _wrap(self, j, operate):
+        res = self._res
+
+        def wrapped(timer, state_manager=None, **kwargs):
+            t0 = timer.current_time
+            before = [r.produce_total for r in res]
+            rec = operate(timer, state_manager, **kwargs)
+            # 影子模拟也会走到这里，只有紧接着被 append 的那一次才会写入
+            self._last = (j, t0, before)
+            return rec
+        return wrapped
+
+    # ---------- 写入 ----------
+    def _grow(self):
+        buf = np.zeros(len(self._buf) * 2, dtype=self.dtype)
+        buf[:self._n] = self._buf[:self._n]
+        self._buf = buf
+
+    def append(self, rec):
+        """作为 record_list 使用：接收 Operation.operate 返回的记录"""
+        if self._n == len(self._buf):
+            self._grow()
+        row = self._buf[self._n]
+        last = self._last
+        if last is not None:
+            j, t0, before = last
+            row["op"] = j
+            row["dt"] = rec[2] - t0
+            row["produce"] = [r.produce_total - b for r, b in zip(self._res, before)]
+            self._last = None
+        else:
+            # 未 attach 时只能按 id 查下标，拿不到 produce / dt
+            row["op"] = self.op_ids.index(rec[0])
+        row["counter"] = rec[1]
+        row["time"] = rec[2]
+        consume = row["consume"]
+        for rid, c in rec[3].items():
+            consume[self._res_col[rid]] = c
+        if self._states:
+            row["stacks"] = [st.current for st in self._states]
+        self._n += 1
+
+    def run(self, mode="meta", **kwargs):
+        """挂接 → 跑一次循环（参数同 build_rotation_* ）→ 解除挂接"""
+        _check_rotation_mode(mode)
+        with self:
+            if mode == "greedy_ops":
+                self.character.build_rotation_greedy_ops(record_list=self, **kwargs)
+            else:
+                self.character.build_rotation_from_meta(record_list=self, **kwargs)
+        return self
+
+    def __len__(self):
+        return self._n
+
+    # ---------- 导出 ----------
+    def to_numpy(self):
+        """已记录部分的结构化数组（视图，不拷贝；继续 append 扩容后视图不再同步）"""
+        return self._buf[:self._n]
+
+    def column(self, name):
+        """
+        单列视图：op / counter / time / dt / consume:<资源id> / produce:<资源id> / stacks:<状态id>
+        """
+        arr = self.to_numpy()
+        if ":" not in name:
+            return arr[name]
+        field, key = name.split(":", 1)
+        if field == "stacks":
+            return arr["stacks"][:, self.state_ids.index(key)]
+        return arr[field][:, self._res_col[key]]
+
+    def columns(self):
+        """{列名: 一维数组}，op 另附 op_id 文本列"""
+        cols = {"op": self.column("op"), "counter": self.column("counter"),
+                "time": self.column("time"), "dt": self.column("dt")}
+        cols["op_id"] = np.asarray(self.op_ids, dtype=object)[cols["op"]]
+        for rid in self.res_ids:
+            cols[f"consume:{rid}"] = self.column(f"consume:{rid}")
+            cols[f"produce:{rid}"] = self.column(f"produce:{rid}")
+        for sid in self.state_ids:
+            cols[f"stacks:{sid}"] = self.column(f"stacks:{sid}")
+        return cols
+
+    def to_arrow(self):
+        import pyarrow as pa  # 可选依赖
+        cols = self.columns()
+        cols["op_id"] = [str(x) for x in cols["op_id"]]
+        return pa.table(cols)
+
+    def to_parquet(self, path, **kwargs):
+        import pyarrow.parquet as pq  # 可选依赖
+        pq.write_table(self.to_arrow(), path, **kwargs)
+        return path
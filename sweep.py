@@ -0,0 +1,289 @@
+"""
+参数扫描：在多进程里批量跑循环，替代在 Excel 里逐个改数、逐个重算。
+
+用法示例：
+
+    from sweep import run_sweep
+
+    rows = run_sweep(
+        base,                                  # Character / 无参构建函数 / 带 build() 的对象
+        {
+            "op:heavy.base_time": [1.0, 1.2, 1.4],
+            "state:overheat.time": [4.0, 6.0],
+            "regen:energy.rate_per_sec": [3.0, 4.0],
+        },
+        max_steps=200,
+        max_workers=8,
+    )
+
+参数路径格式：  "<类别>:<id>.<属性>"
+- op:<op_id>           Operation（耗时请改 base_time；max_charges / charge_cd 会同步当前充能）
+- state:<state_id>     State（length 会同步 type=2 的计时槽；type 不支持修改）
+- res:<resource_id>    Resource
+- meta:<meta_id>       MetaOperation
+- regen:<序号或资源id>  ResourceRegenRule（资源 id 会命中该资源上的所有回复规则）
+
+每个参数点都会从同一份 base 重新构建一个全新的角色（Character 会先 pickle 一次，
+每个点各自反序列化），因此结果与进程数、执行顺序无关。
+
+蒙特卡洛（概率机制）：
+
+    runs, seed = run_monte_carlo(base, 10000, seed=42, max_steps=200)
+    stats = distribution_stats(runs)      # {"total_time": {"mean", "p5", "p95"}, ...}
+
+第 i 次运行的随机数流由 f"{seed}:{i}" 派生，同一个 seed 的结果与进程数无关、可复现。
+"""
+import itertools
+import math
+import os
+import pickle
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from character import Operation, State, _check_rotation_mode
+
+
+def expand_grid(grid):
+    """
+    grid 可以是：
+    - dict {参数路径: [取值, ...]}：做笛卡尔积
+    - list [dict {参数路径: 取值}, ...]：直接作为参数点列表
+    """
+    if isinstance(grid, dict):
+        keys = list(grid.keys())
+        return [dict(zip(keys, combo)) for combo in itertools.product(*(list(grid[k]) for k in keys))]
+    return [dict(p) for p in grid]
+
+
+def _parse_path(path):
+    try:
+        kind, rest = path.split(":", 1)
+        target, attr = rest.rsplit(".", 1)
+    except ValueError:
+        raise ValueError(f"参数路径格式应为 '<类别>:<id>.<属性>'：{path}")
+    return kind.strip(), target.strip(), attr.strip()
+
+
+def _resolve_targets(ch, kind, target):
+    if kind == "op":
+        found = [op for op in ch.operations if op.id == target]
+        if not found:
+            for mop in ch.meta_operations:
+                found.extend(op for op in mop.operations if op.id == target and op not in found)
+        return found
+    if kind == "state":
+        return [st for st in ch._get_snapshot_layout().states if st.id == target]
+    if kind == "res":
+        return [ch.resources[target]] if target in ch.resources else []
+    if kind == "meta":
+        return [m for m in ch.meta_operations if m.id == target]
+    if kind == "regen":
+        rules = ch.resource_regen_rules
+        if target.isdigit():
+            i = int(target)
+            return [rules[i]] if 0 <= i < len(rules) else []
+        return [r for r in rules if r.resource.id == target]
+    raise ValueError(f"未知的参数类别: {kind}")
+
+
+def _set_param(obj, path, attr, value):
+    """写一个属性，并同步由它派生的运行时字段（计时槽、当前充能）"""
+    if isinstance(obj, State):
+        if attr == "type":
+            raise ValueError(f"{path}: 不支持修改状态的计时模型 type，请直接构建新角色")
+        if attr == "length":
+            obj.resize(value)
+            return
+    elif isinstance(obj, Operation) and attr in ("max_charges", "charge_cd"):
+        full = obj.charges >= obj.max_charges
+        charges = {"max_charges": obj.max_charges, "charge_cd": obj.charge_cd, attr: value}
+        obj.configure_charges(init_charges=None if full else obj.charges, **charges)
+        return
+    setattr(obj, attr, value)
+
+
+def apply_params(ch, params):
+    """
+    把 {参数路径: 取值} 写到角色上，写完后让角色的编译结果失效
+    （重新编译时按新的计时字段重建过期堆，已经存在的状态也按新值过期）
+    """
+    for path, value in params.items():
+        kind, target, attr = _parse_path(path)
+        objs = _resolve_targets(ch, kind, target)
+        if not objs:
+            raise ValueError(f"参数路径找不到对象: {path}")
+        for obj in objs:
+            if not hasattr(obj, attr):
+                raise ValueError(f"{path}: {type(obj).__name__} 没有属性 {attr}")
+            _set_param(obj, path, attr, value)
+    ch.invalidate()
+    return ch
+
+
+def _make_builder(base):
+    """把 base 统一成可 pickle 的 (kind, payload)"""
+    if hasattr(base, "build_rotation_from_meta"):
+        return ("pickle", pickle.dumps(base, protocol=pickle.HIGHEST_PROTOCOL))
+    if hasattr(base, "build") and callable(base.build):
+        return ("spec", base)
+    if callable(base):
+        return ("call", base)
+    raise TypeError("base 需要是 Character、无参构建函数，或带 build() 方法的对象")
+
+
+def _build(builder):
+    kind, payload = builder
+    if kind == "pickle":
+        return pickle.loads(payload)
+    if kind == "spec":
+        return payload.build()
+    return payload()
+
+
+def summarize(ch, rotation_log):
+    """
+    一次循环的汇总行：总时间、步数、各操作次数、各资源的消耗/获得/剩余。
+    rotation_log 可以是列表，也可以是 ch.iter_rotation() 这样的生成器（边跑边统计，不保留记录）。
+    """
+    counts = {}
+    n_records = 0
+    for rec in rotation_log:
+        counts[rec[0]] = counts.get(rec[0], 0) + 1
+        n_records += 1
+    row = {
+        "total_time": ch.timer.current_time,
+        "op_records": n_records,
+    }
+    for op_id, n in counts.items():
+        row[f"count:{op_id}"] = n
+    for rid, res in ch.resources.items():
+        row[f"consume:{rid}"] = res.consume_total
+        row[f"produce:{rid}"] = res.produce_total
+        row[f"current:{rid}"] = res.current
+    return row
+
+
+def _run_point(builder, params, max_steps, mode, op_priority=None):
+    ch = apply_params(_build(builder), params)
+    row = dict(params)
+    row.update(summarize(ch, _run_rotation(ch, max_steps, mode, op_priority)))
+    return row
+
+
+def _run_chunk(args):
+    builder, points, max_steps, mode, op_priority = args
+    return [_run_point(builder, p, max_steps, mode, op_priority) for p in points]
+
+
+def _run_rotation(ch, max_steps, mode, op_priority=None):
+    """流式跑循环（只做汇总，不保留整条记录）"""
+    return ch.iter_rotation(mode, max_steps=max_steps, op_priority=op_priority)
+
+
+def _run_mc_chunk(args):
+    builder, run_ids, seed, max_steps, mode = args
+    rows = []
+    for i in run_ids:
+        ch = _build(builder)
+        ch.seed(f"{seed}:{i}")
+        row = {"run": i}
+        row.update(summarize(ch, _run_rotation(ch, max_steps, mode)))
+        rows.append(row)
+    return rows
+
+
+def _map_chunks(task, builder, items, extra, max_workers, chunksize):
+    """把 items 切块，用 task((builder, chunk, *extra)) 处理；max_workers<=1 时在当前进程顺序执行"""
+    if max_workers is not None and max_workers <= 1:
+        return task((builder, items) + extra)
+    n_workers = max_workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(items) // (n_workers * 4))
+    chunks = [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+    rows = []
+    with ProcessPoolExecutor(max_workers=n_workers) as ex:
+        for part in ex.map(task, [(builder, c) + extra for c in chunks]):
+            rows.extend(part)
+    return rows
+
+
+def run_sweep(base, grid, *, max_steps=9999, mode="meta", max_workers=None, chunksize=None, as_dataframe=True,
+              engine="process", op_priority=None):
+    """
+    对 grid 中的每个参数点：重建角色 → 写入参数 → 跑一次循环 → 汇总。
+
+    - mode: "meta"（build_rotation_from_meta）或 "greedy_ops"（build_rotation_greedy_ops）
+    - op_priority: 仅 mode="greedy_ops" 使用，同 build_rotation_greedy_ops
+    - max_workers: 进程数；0/1 表示在当前进程里顺序执行（便于调试）
+    - 返回：按参数点顺序排列的结果；安装了 pandas 且 as_dataframe=True 时返回 DataFrame，
+      否则返回 [dict, ...]
+    - engine="batch": 用 batchsim.BatchSim 在当前进程里把所有参数点按数组同步推进
+      （只支持 mode="greedy_ops"；结果多一列 error）
+
+    base 为构建函数时，它必须能被 pickle（模块顶层函数 / functools.partial 等）。
+    """
+    _check_rotation_mode(mode)
+    if engine == "batch":
+        if mode != "greedy_ops":
+            raise ValueError('engine="batch" 只支持 mode="greedy_ops"')
+        from batchsim import BatchSim
+        rows = BatchSim.from_grid(base, grid).run_greedy_ops(max_steps, op_priority).summaries()
+    else:
+        points = expand_grid(grid)
+        builder = _make_builder(base)
+        rows = _map_chunks(_run_chunk, builder, points, (max_steps, mode, op_priority), max_workers, chunksize)
+
+    if as_dataframe:
+        try:
+            import pandas as pd
+        except ImportError:
+            return rows
+        return pd.DataFrame(rows)
+    return rows
+
+
+def run_monte_carlo(base, n_runs, seed=None, *, max_steps=9999, mode="meta", max_workers=None, chunksize=None):
+    """
+    从同一份 base 独立跑 n_runs 次循环，第 i 次使用 f"{seed}:{i}" 派生的随机数流。
+    seed 为 None 时随机取一个。
+    返回 (按序号排列的 [汇总行, ...], 实际使用的 seed)
+    """
+    _check_rotation_mode(mode)
+    if seed is None:
+        seed = random.SystemRandom().randrange(1 << 63)
+    builder = _make_builder(base)
+    rows = _map_chunks(_run_mc_chunk, builder, list(range(n_runs)), (seed, max_steps, mode), max_workers, chunksize)
+    return rows, seed
+
+
+def _percentile(sorted_vals, q):
+    """线性插值分位数（与 numpy.percentile 默认方式一致），sorted_vals 需已排序"""
+    if not sorted_vals:
+        return math.nan
+    pos = (len(sorted_vals) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+def distribution_stats(rows, percentiles=(5, 95)):
+    """
+    对多次运行的汇总行做分布统计：每个数值列给出 mean / std / min / max / p<q>。
+    count:<op> 列在某次运行里缺失时按 0 计。
+    """
+    keys = {}
+    for row in rows:
+        for k, v in row.items():
+            if k != "run" and isinstance(v, (int, float)) and not isinstance(v, bool):
+                keys.setdefault(k, None)
+    n = len(rows)
+    stats = {"runs": n}
+    for k in keys:
+        vals = sorted(float(row.get(k, 0.0)) for row in rows)
+        mean = math.fsum(vals) / n
+        var = math.fsum((v - mean) ** 2 for v in vals) / (n - 1) if n > 1 else 0.0
+        entry = {"mean": mean, "std": math.sqrt(var), "min": vals[0], "max": vals[-1]}
+        for q in percentiles:
+            entry[f"p{q:g}"] = _percentile(vals, q)
+        stats[k] = entry
+    return stats
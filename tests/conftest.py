@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库里的模块都在根目录（没有包），测试直接按顶层模块导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,103 @@
+"""测试共用的角色夹具（按顶层模块导入：from fixtures import ...）"""
+from character import (Character, MetaOperation, Operation, OperationTriggeredStateRule, Resource, ResourceRegenRule,
+                       ResourceStateRemoveRule, ResourceStateRule, State, StateResourceEffect, Timer)
+
+
+def spec_tables():
+    """按 CharacterSpec 表格式写的贪心角色：回复、阈值规则、充能、效率 / 加速规则、触发规则都有"""
+    T = {}
+
+    def add(name, header, *rows):
+        T[name] = [list(header)] + [list(r) for r in rows]
+
+    add("Resources", ["id", "upper_limit", "current"], ["heat", 100, 0], ["energy", 100, 50], ["dmg", 1e9, 0])
+    add("States", ["id", "current", "upper_limit", "type", "time", "length", "expire_mode"],
+        ["overheat", 0, 1, 1, 0, 0, "resource"], ["buff", 0, 3, 1, 4, 3, "time"],
+        ["stacks", 0, 5, 2, 3, 5, "time"], ["enh", 0, 1, 1, 2, 1, "time"])
+    add("StateResourceEffects", ["state_id", "resource_id", "on_add", "on_remove", "per_stack", "ratio_on_add", "ratio_on_remove"],
+        ["overheat", "heat", 0, 0, 0, None, 0.2], ["stacks", "energy", 2, 0, 1, None, None])
+    add("StateOpAccelerateRules", ["state_id", "op_id", "ratio", "ratio_per_stack", "by_current_stack", "min_ratio", "max_ratio"],
+        ["buff", "shot", 0, 0.1, 1, 0, 0.5])
+    add("StateOpEfficiencyRules", ["state_id", "op_id", "target", "resource_id", "mul", "mul_per_stack", "by_current_stack", "min_mul", "max_mul"],
+        ["enh", "skill", "produce", "heat", 1.5, 0, 1, 0, 10])
+    add("Operations（基础）", ["op_id", "base_time", "max_charges", "charge_cd"],
+        ["shot", 0.5, None, None], ["skill", 1.0, 2, 5], ["vent", 1.5, None, None],
+        ["burst", 2.0, None, None], ["dodge", 0.3, 1, 3])
+    add("OperationConsumes", ["op_id", "resource_id", "consume", "consume_upper", "consume_lower"],
+        ["skill", "energy", 30, None, None], ["burst", "energy", 60, None, None], ["vent", "heat", 10, None, None])
+    add("OperationProduces", ["op_id", "resource_id", "produce"],
+        ["shot", "heat", 15], ["shot", "energy", 5], ["shot", "dmg", 10], ["dodge", "energy", 10],
+        ["skill", "heat", 20], ["skill", "dmg", 40], ["burst", "dmg", 150], ["vent", "energy", 3])
+    add("OperationStatesOutput", ["op_id", "state_id"], ["shot", "buff"], ["skill", "stacks"], ["dodge", "enh"])
+    add("OperationStateRequirements", ["op_id", "state_id", "min_stack"], ["burst", "stacks", 2], ["vent", "overheat", 1])
+    add("OperationStateForbids", ["op_id", "state_id"], ["shot", "overheat"], ["skill", "overheat"])
+    add("OperationStateEffects", ["op_id", "state_id", "target", "resource_id", "op", "value", "min_stack", "max_stack"],
+        ["skill", "enh", "consume", "energy", "mul", 0.5, 1, None])
+    add("ResourceStateRules", ["op_id", "resource_id", "threshold", "state_id", "mode", "once"],
+        ["shot", "heat", 100, "overheat", ">=", 1], ["skill", "heat", 100, "overheat", ">=", 1])
+    add("ResourceStateRemoveRules", ["op_id", "resource_id", "state_id", "threshold", "mode", "require_active"],
+        ["vent", "heat", "overheat", 15, "<=", 1])
+    add("RegenRules", ["rule_id", "resource_id", "rate_per_sec"], ["r1", "heat", -4], ["r2", "energy", 2], ["r3", "energy", 5])
+    add("RegenRuleStateRequirements", ["rule_id", "state_id", "min_stack"], ["r3", "buff", 2])
+    add("RegenRuleStateForbids", ["rule_id", "state_id"], ["r1", "enh"])
+    add("OperationTriggeredStateRules", ["trigger_op_id", "target_state_id", "required_states", "forbidden_states",
+                                         "resource_thresholds", "add_stacks", "once_per_operation_call"],
+        ["shot", "stacks", "buff:2", "", "", 1, 1])
+    return T
+
+
+SPEC_GREEDY_ORDER = ["burst", "vent", "skill", "shot", "dodge"]
+
+
+def meta_character():
+    """
+    type=1 / type=2 元操作、tail 循环、两种计时模型、资源型状态、充能、阈值规则、回复与触发规则都有的角色。
+    只用旧版也有的构造接口，GOLDEN 的数值由改成快照回滚之前的实现算出。
+    """
+    heat, energy, dmg = Resource("heat", 100, 0), Resource("energy", 100, 50), Resource("dmg", 1e9, 0)
+    overheat = State("overheat", 0, 1, 0, 1, 0, expire_mode="resource",
+                     resource_effects=[StateResourceEffect(heat, ratio_on_remove=0.2)])
+    buff = State("buff", 0, 3, 4, 1, 3)
+    stacks = State("stacks", 0, 5, 3, 2, 5, resource_effects=[StateResourceEffect(energy, on_add=2, per_stack=True)])
+    ch = Character("fixture", Timer(), [heat, energy, dmg], [overheat, buff, stacks])
+
+    shot = Operation("shot", 0.5, [], [heat, energy, dmg], [], [15, 5, 10], [buff],
+                     resource_state_rules=[ResourceStateRule(heat, 100, overheat)], state_forbids=[overheat])
+    skill = Operation("skill", 1.0, [energy], [heat, dmg], [30], [20, 40], [stacks],
+                      resource_state_rules=[ResourceStateRule(heat, 100, overheat)], state_forbids=[overheat],
+                      max_charges=2, charge_cd=5)
+    burst = Operation("burst", 2.0, [energy], [dmg], [60], [150], [], state_requirements=[(stacks, 1)])
+    vent = Operation("vent", 1.5, [heat], [energy], [10], [3], [], state_requirements=[(overheat, 1)],
+                     resource_state_remove_rules=[ResourceStateRemoveRule(heat, overheat, 15)])
+    for op in (shot, skill, burst, vent):
+        ch.add_operation(op)
+
+    m_combo = MetaOperation("m_combo", [shot, shot, skill], type=2, base_priority=1, meta_state_forbids=[overheat])
+    ch.add_meta_operation(MetaOperation("m_vent", [vent, vent], type=1, base_priority=5, n=1))
+    ch.add_meta_operation(MetaOperation("m_burst", [skill, burst], type=2, base_priority=3))
+    ch.add_meta_operation(m_combo)
+    ch.add_meta_operation(MetaOperation("m_shot", [shot], type=1, base_priority=0))
+    buff.meta_priority_rules.append((m_combo, 3, 2))
+
+    ch.add_regen_rule(ResourceRegenRule(heat, -4, state_forbids=[overheat]))
+    ch.add_regen_rule(ResourceRegenRule(energy, 2))
+    ch.add_op_trigger_rule(OperationTriggeredStateRule(trigger_operation=shot, target_state=stacks,
+                                                       required_states=[(buff, 2)]))
+    return ch
+
+
+GREEDY_ORDER = ["burst", "vent", "skill", "shot"]
+
+
+def proc_character(p=0.5):
+    """type=2 的 combo：roll 以概率 p 获得 1 点 charge，spend 消耗它；放不出时打 filler"""
+    charge, dmg = Resource("charge", 1, 0), Resource("dmg", 1e9, 0)
+    ch = Character("proc", Timer(), [charge, dmg])
+    roll = Operation("roll", 1.0, [], [charge], [], [1], [], probability=p)
+    spend = Operation("spend", 1.0, [charge], [dmg], [1], [100], [])
+    filler = Operation("filler", 1.0, [], [dmg], [], [10], [])
+    for op in (roll, spend, filler):
+        ch.add_operation(op)
+    ch.add_meta_operation(MetaOperation("combo", [roll, spend], type=2, base_priority=1))
+    ch.add_meta_operation(MetaOperation("filler", [filler]))
+    return ch
@@ -0,0 +1,48 @@
+"""LES_p 的 UDF（需要 xlwings）：sumup 与原双重循环一致，tj_attackloop_table 接受单行区域"""
+import random
+
+import pytest
+
+pytest.importorskip("xlwings")
+import LES_p  # noqa: E402
+
+
+def _sumup_loop(attack_loop, data_fetch, data_return):
+    """原实现"""
+    r = 0
+    for i in attack_loop:
+        for j in data_fetch:
+            if int(i) == int(j):
+                r += data_return[int(j)]
+    return r
+
+
+def test_sumup_matches_double_loop():
+    rng = random.Random(0)
+    for _ in range(2000):
+        n = rng.randint(1, 12)
+        dr = [rng.uniform(-5, 5) for _ in range(n)]
+        al = [rng.choice([rng.randint(-n, n - 1), rng.uniform(-n + 0.01, n - 1)]) for _ in range(rng.randint(0, 20))]
+        df = [rng.choice([rng.randint(-n, n - 1), rng.randint(n, n + 3)]) for _ in range(rng.randint(0, 20))]
+        try:
+            expected = _sumup_loop(al, df, dr)
+        except IndexError:
+            with pytest.raises(IndexError):
+                LES_p.sumup(al, df, dr)
+            continue
+        assert LES_p.sumup(al, df, dr) == pytest.approx(expected, abs=1e-9)
+
+
+def test_sumup_multi_matches_sumup():
+    al, df = [0, 1, 1, 3, 2.7], [1, 2, 3, 3]
+    cols = [[1.0, 2.0], [3.0, None], [5.0, 6.0], [7.0, 8.0]]
+    expected = [LES_p.sumup(al, df, [row[c] for row in cols]) for c in range(2)]
+    assert LES_p.sumup_multi(al, df, cols) == [expected]
+    # 单列区域 xlwings 给一维 list
+    assert LES_p.sumup_multi(al, df, [row[0] for row in cols]) == [expected[:1]]
+
+
+def test_tj_attackloop_table_single_row():
+    row = [100, 60, 3, 10, 8, 20, 1, 1, 2, 80, 1, 3, 1, 1]
+    assert LES_p.tj_attackloop_table(row) == LES_p.tj_attackloop_table([row])
+    assert len(LES_p.tj_attackloop_table([row, row])) == 3
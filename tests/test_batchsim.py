@@ -0,0 +1,40 @@
+"""BatchSim 与逐个角色 build_rotation_greedy_ops 的结果必须逐项一致"""
+import pytest
+
+from batchsim import BatchSim
+from characterspec import CharacterSpec
+from fixtures import spec_tables
+from sweep import apply_params, expand_grid, summarize
+
+
+GRID = {
+    "op:shot.base_time": [0.4, 0.7],
+    "state:buff.time": [2.0, 4.0],
+    "regen:energy.rate_per_sec": [0.0, 3.0],
+    "res:energy.current": [0.0, 50.0],
+}
+
+
+@pytest.mark.parametrize("op_priority", [
+    None,
+    ["burst", "vent", "skill", "shot", "dodge"],
+    ["burst", "vent", "skill", "dodge", "shot"],
+])
+def test_batch_matches_scalar(op_priority):
+    spec = CharacterSpec.from_values(spec_tables())
+    sim = BatchSim.from_grid(spec, GRID).run_greedy_ops(300, op_priority, record=True)
+    rows = sim.summaries()
+    points = expand_grid(GRID)
+    assert len(rows) == len(points)
+    for k, params in enumerate(points):
+        ch = apply_params(spec.build(), params)
+        try:
+            log = ch.build_rotation_greedy_ops(300, op_priority)
+        except ValueError:
+            assert rows[k]["error"]
+            continue
+        assert not rows[k]["error"]
+        assert sim.op_sequence(k) == [rec[0] for rec in log]
+        expected = dict(params)
+        expected.update(summarize(ch, log))
+        assert {key: v for key, v in rows[k].items() if key != "error"} == expected
@@ -0,0 +1,523 @@
+"""character.py 的单元测试：资源库、预编译结算内核、束搜索规划、快照回滚与影子模拟、空闲推进、埋点、循环外推、概率产出"""
+import hashlib
+import pickle
+
+import pytest
+
+from character import (Character, MetaOperation, Operation, Resource, ResourceBank, ResourceRegenRule,
+                       ResourceStateRemoveRule, ResourceStateRule, State, Timer)
+from characterspec import CharacterSpec
+from fixtures import GREEDY_ORDER, SPEC_GREEDY_ORDER, meta_character, proc_character, spec_tables
+from recorder import RotationRecorder
+
+
+def test_resource_values_are_float():
+    res = Resource("heat", 100, 3)
+    assert isinstance(res.current, float) and res.current == 3.0
+    assert isinstance(res.upper_limit, float) and res.upper_limit == 100.0
+    res.update(-1)
+    assert isinstance(res.consume_total, float) and res.consume_total == 1.0
+
+
+def test_bank_apply_deltas_clamps():
+    heat, energy = Resource("heat", 100, 90), Resource("energy", 50, 10)
+    bank = ResourceBank([heat, energy])
+    assert heat._bank is bank and energy._idx == 1
+    bank.apply_deltas([0, 1, 1], [25, -10, 70])
+    # 恢复截在上限，produce_total 只记实际加上的量
+    assert heat.current == 100 and heat.produce_total == 10
+    assert energy.current == 50 and energy.consume_total == 10 and energy.produce_total == 50
+    # 不足量在 EPS 以内的消耗按 0 截断，不报错
+    bank.apply_deltas([1], [-50 - ResourceBank.EPS / 2])
+    assert energy.current == 0.0
+
+
+def test_bank_shortage_raises():
+    energy = Resource("energy", 50, 10)
+    bank = ResourceBank([energy])
+    with pytest.raises(ValueError, match="energy"):
+        bank.apply_deltas([0], [-11])
+    with pytest.raises(ValueError, match="energy"):
+        energy.update(-11)
+    assert energy.current == 10 and energy.consume_total == 0
+
+
+def test_bank_adopt_keeps_values_and_retires_old_bank():
+    res = Resource("heat", 100, 40)
+    res.update(-5)
+    old = res._bank
+    bank = ResourceBank([res])
+    assert old.retired and not bank.retired
+    assert (res.current, res.upper_limit, res.consume_total) == (35, 100, 5)
+    snap = bank.capture()
+    res.update(30)
+    bank.restore(snap)
+    assert (res.current, res.produce_total) == (35, 0)
+
+
+def _burst_character():
+    energy, dmg = Resource("energy", 100, 76), Resource("dmg", 1e9, 0)
+    ch = Character("kernel", Timer(), [energy, dmg])
+    burst = Operation("burst", 2.0, [energy], [dmg], [60], [150], [])
+    ch.add_operation(burst)
+    ch.compile()
+    return ch, burst
+
+
+def test_kernel_follows_in_place_edits():
+    ch, burst = _burst_character()
+    assert burst._kernel is not None and burst.test()
+    burst.resource_consumes[0] = 1000
+    assert not burst.test(ch.state_manager)
+    burst.resource_consumes[0] = 60
+    burst.consume_upper_limits[0] = 50
+    assert burst._calc_consume_amounts(state_manager=ch.state_manager) == {ch.resources["energy"]: 50}
+    burst.resource_produces = [7]
+    rec = burst.operate(ch.timer, ch.state_manager)
+    assert rec[3] == {"energy": 50} and ch.resources["dmg"].current == 7
+    assert burst._kernel is not None and burst._kernel.bank is ch.resource_bank
+
+
+def test_kernel_falls_back_for_foreign_resource():
+    ch, burst = _burst_character()
+    other = Resource("mana", 10, 10)
+    burst.resource_requirements.append(other)
+    burst.resource_consumes.append(4)
+    burst.consume_upper_limits.append(None)
+    burst.consume_lower_limits.append(None)
+    assert burst.test(ch.state_manager)
+    assert burst._kernel is None
+    burst.operate(ch.timer, ch.state_manager)
+    assert other.current == 6 and ch.resources["energy"].current == 16
+
+
+def _big_small_character(total_time=None):
+    """big：100 伤害后留下 100 秒的 tired（禁止两个操作）；small：1 伤害"""
+    dmg = Resource("dmg", 1e9, 0)
+    tired = State("tired", 0, 1, 100, 1, 1)
+    ch = Character("plan", Timer(total_time), [dmg], [tired])
+    big = Operation("big", 1.0, [], [dmg], [], [100], [tired], state_forbids=[tired])
+    small = Operation("small", 1.0, [], [dmg], [], [1], [], state_forbids=[tired])
+    ch.add_operation(big)
+    ch.add_operation(small)
+    ch.add_meta_operation(MetaOperation("big", [big], base_priority=1))
+    ch.add_meta_operation(MetaOperation("small", [small]))
+    return ch
+
+
+def _plan_score(ch, horizon, beam_width):
+    log = ch.plan_rotation(horizon, beam_width, "dmg")
+    return [rec[0] for rec in log], ch.resources["dmg"].produce_total / ch.timer.current_time
+
+
+def test_plan_keeps_dead_end_branches():
+    scores = []
+    for width in (1, 2, 3, 4):
+        ops, score = _plan_score(_big_small_character(), 3, width)
+        assert ops == ["big"]
+        scores.append(score)
+    assert scores == sorted(scores) and scores[0] == 100
+
+
+def test_plan_stops_at_total_time():
+    ch = _big_small_character(total_time=3)
+    ch.meta_operations.pop(0)
+    ch.invalidate()
+    ops, _ = _plan_score(ch, 10, 2)
+    assert ops == ["small"] * 3 and ch.timer.current_time == 3
+
+
+def _digest(ch, log):
+    """(记录数, 记录序列摘要, 结束时间, 资源, 状态层数)"""
+    seq = [(r[0], round(r[2], 6), tuple(sorted((k, round(v, 6)) for k, v in r[3].items()))) for r in log]
+    return (len(log), hashlib.sha1(repr(seq).encode()).hexdigest()[:16], round(ch.timer.current_time, 6),
+            {k: round(r.current, 6) for k, r in ch.resources.items()},
+            {st.id: st.current for st in ch.state_manager.states})
+
+
+# 旧版（type=2 用影子对象模拟）在 meta_character 上跑出的结果
+GOLDEN = {
+    ("meta", 50): (177, "65a2d70e01addd60", 206.0, {"heat": 14, "energy": 100, "dmg": 2140},
+                   {"overheat": 0, "buff": 0, "stacks": 0}),
+    ("meta", 300): (1061, "eedad8d16c696395", 1240.5, {"heat": 56, "energy": 70, "dmg": 13280},
+                    {"overheat": 0, "buff": 2, "stacks": 2}),
+    ("meta", 2000): (7106, "a567ca8c52533f34", 8326.0, {"heat": 14, "energy": 82, "dmg": 88820},
+                     {"overheat": 0, "buff": 0, "stacks": 0}),
+    ("greedy", 50): (50, "b55af152407dd88d", 58.0, {"heat": 14, "energy": 52, "dmg": 690},
+                     {"overheat": 0, "buff": 0, "stacks": 0}),
+    ("greedy", 300): (300, "c98563c0516e392b", 354.5, {"heat": 30, "energy": 66, "dmg": 3990},
+                      {"overheat": 1, "buff": 0, "stacks": 0}),
+    ("greedy", 2000): (2000, "7f9b9c9d22599a06", 2373.0, {"heat": 30, "energy": 60, "dmg": 26750},
+                       {"overheat": 0, "buff": 0, "stacks": 1}),
+}
+
+
+@pytest.mark.parametrize("mode, steps", sorted(GOLDEN))
+def test_snapshot_shadow_matches_old_shadow_objects(mode, steps):
+    ch = meta_character()
+    if mode == "meta":
+        log = ch.build_rotation_from_meta(steps)
+    else:
+        log = ch.build_rotation_greedy_ops(steps, GREEDY_ORDER)
+    assert _digest(ch, log) == GOLDEN[mode, steps]
+
+
+def _mutable_state(ch):
+    bank = ch.resource_bank
+    states = [(st.current, list(st.start_time) if st.type == 2 else st.start_time,
+               list(st._slot_heap), list(st._free_slots), st._scheduled_at) for st in ch.state_manager.states]
+    ops = [(op.charges, op.charge_clock, op.counter) for op in ch.operations]
+    return (ch.timer.current_time, ch._last_tick_time, bank.current.tolist(), bank.consume_total.tolist(),
+            bank.produce_total.tolist(), states, list(ch.state_manager._expiry_heap), ops, ch.rng.getstate())
+
+
+def test_restore_snapshot_round_trip():
+    ch = meta_character()
+    ch.operations[0].probability = 0.5
+    ch.invalidate()
+    ch.seed(7)
+    ch.build_rotation_from_meta(40)
+    assert ch._get_snapshot_layout().stochastic
+    assert any(st._slot_heap for st in ch.state_manager.states) and ch.state_manager._expiry_heap
+
+    before = _mutable_state(ch)
+    snap = ch.snapshot()
+    first = ch.build_rotation_from_meta(60)
+    assert _mutable_state(ch) != before
+    ch.restore(snap)
+    assert _mutable_state(ch) == before
+    # 回滚后接着跑，结果（含掷骰）与第一次完全一样
+    assert ch.build_rotation_from_meta(60) == first
+
+
+def _idle_character():
+    """
+    shield：+7/s，约 7.14 秒回满后截断；energy：+4/s，hot 存在时才回复，到 40 时加 charged（5 秒）；
+    heat：-2/s，charged 存在时暂停，降到 60 时移除 hot。
+    事件依次为 t=10 加 charged、t=15 charged 过期、t=20 移除 hot（随后 energy 停止回复）。
+    阈值规则挂在一个不会执行的操作上。
+    """
+    shield, energy, heat = Resource("shield", 50, 0), Resource("energy", 100, 0), Resource("heat", 100, 90)
+    hot = State("hot", 1, 1, 0, 1, 1, expire_mode="resource")
+    charged = State("charged", 0, 1, 5, 1, 1)
+    ch = Character("idle", Timer(), [shield, energy, heat], [hot, charged])
+    ch.add_operation(Operation("never", 1.0, [], [], [], [], [], state_requirements=[(charged, 2)],
+                               resource_state_rules=[ResourceStateRule(energy, 40, charged)],
+                               resource_state_remove_rules=[ResourceStateRemoveRule(heat, hot, 60)]))
+    ch.add_regen_rule(ResourceRegenRule(shield, 7))
+    ch.add_regen_rule(ResourceRegenRule(energy, 4, state_requirements=[(hot, 1)]))
+    ch.add_regen_rule(ResourceRegenRule(heat, -2, state_forbids=[charged]))
+    ch.compile()
+    return ch
+
+
+def _tick_to(ch, t, dt=1 / 1024):
+    """参照实现：固定步长推进，每步结算回复、过期，并轮询所有阈值规则"""
+    op = ch.operations[0]
+    while ch.timer.current_time < t:
+        ch.timer.current_time += dt
+        ch._apply_time_regen()
+        ch.state_manager.update(ch.timer)
+        for rule in op.resource_state_rules:
+            rule.check_and_apply(ch.timer)
+        for rule in op.resource_state_remove_rules:
+            rule.check_and_apply()
+
+
+def _idle_state(ch):
+    return ({k: r.current for k, r in ch.resources.items()}, {st.id: st.current for st in ch.state_manager.states})
+
+
+@pytest.mark.parametrize("stops", [[30], [7, 12.5, 30], [10, 15, 20, 30]])
+def test_advance_to_matches_fixed_step_ticking(stops):
+    ticked = _idle_character()
+    _tick_to(ticked, 30)
+    ch = _idle_character()
+    for t in stops:
+        assert ch.advance_to(t) == t
+    res, states = _idle_state(ch)
+    assert res == {"shield": 50, "energy": 80, "heat": 40} and states == {"hot": 0, "charged": 0}
+    # 固定步长在每个事件上最多晚一步（状态在到期时刻之后的下一个浮点数才移除）
+    ticked_res, ticked_states = _idle_state(ticked)
+    assert ticked_states == states
+    assert ticked_res == pytest.approx(res, abs=0.02)
+
+
+def test_advance_to_fires_crossings_inside_interval():
+    ch = _idle_character()
+    assert ch.next_event_time() == 10
+    ch.advance_to(12)
+    # 区间内 t=10 穿越阈值：charged 从 10 开始，heat 只衰减了前 10 秒
+    charged = ch.state_manager.states[1]
+    assert charged.current == 1 and charged.start_time == 10
+    assert ch.resources["heat"].current == 70 and ch.resources["energy"].current == 48
+    assert ch.next_event_time() == pytest.approx(15)
+
+
+def test_wait_stops_after_max_idle_events():
+    ch = _idle_character()
+    log = ch.build_rotation_greedy_ops(10, ["never"], wait=True)
+    # 依次等过 t≈7.14（shield 回满不算事件）/ 10 / 15 / 20，之后没有事件
+    assert log == [] and ch.timer.current_time == pytest.approx(20)
+
+    ch = _idle_character()
+    ch.MAX_IDLE_EVENTS = 2
+    ch.build_rotation_greedy_ops(10, ["never"], wait=True)
+    assert ch.timer.current_time == pytest.approx(15) and ch.resources["energy"].current == pytest.approx(60)
+
+
+def _instrumented_greedy(capacity):
+    ch = CharacterSpec.from_values(spec_tables()).build()
+    ins = ch.enable_instrumentation(capacity=capacity)
+    ch.build_rotation_greedy_ops(200, ["shot", "skill", "burst", "vent", "dodge"])
+    return ins
+
+
+def test_instrumentation_overflow_keeps_timelines_consistent():
+    full, small = _instrumented_greedy(100000), _instrumented_greedy(20)
+    assert len(small.resource_events) == 20 and len(full.resource_events) > 20
+    t_res, t_st = small._res_from, small._state_from
+    assert t_res > full.start_time and t_st > full.start_time
+    assert full.time_at_cap("energy") > 0 and full.time_at_cap("heat") > 0
+    for rid in ("heat", "energy", "dmg"):
+        # 丢掉的事件折进起点：覆盖区间内与完整日志一致，默认区间从最后一个丢掉的事件开始
+        assert small.time_at_cap(rid) == pytest.approx(full.time_at_cap(rid, t0=t_res))
+        assert small.time_at_cap(rid, t0=0) == small.time_at_cap(rid)
+        assert small.wasted(rid) == pytest.approx(full.wasted(rid, t0=t_res))
+        start = small.resource_timeline(rid)[0]
+        assert start[0] <= t_res and start in full.resource_timeline(rid)
+    for sid in ("overheat", "buff", "stacks", "enh"):
+        assert small.uptime(sid) == pytest.approx(full.uptime(sid, t0=t_st))
+        assert small.average_stacks(sid) == pytest.approx(full.average_stacks(sid, t0=t_st))
+
+
+def test_enable_instrumentation_twice_detaches_the_previous_one():
+    ch = meta_character()
+    first = ch.enable_instrumentation()
+    second = ch.enable_instrumentation()
+    assert ch.disable_instrumentation() is second
+    assert not any(name in st.__dict__ for st in ch.state_manager.states for name in ("add", "remove", "force_clear"))
+    ch.build_rotation_greedy_ops(20, GREEDY_ORDER)
+    assert not first.state_events and not second.state_events
+    pickle.dumps(ch)
+
+
+def _spy_skip_cycles(ch):
+    skipped = []
+    skip = ch._skip_cycles
+
+    def spy(cycle, n, op_deltas):
+        skipped.append(skip(cycle, n, op_deltas))
+        return skipped[-1]
+
+    ch._skip_cycles = spy
+    return skipped
+
+
+@pytest.mark.parametrize("build, mode, op_priority", [
+    (lambda: CharacterSpec.from_values(spec_tables()).build(), "greedy_ops", SPEC_GREEDY_ORDER),
+    (meta_character, "meta", None),
+    (meta_character, "greedy_ops", GREEDY_ORDER),
+])
+def test_extrapolated_window_matches_stepwise(build, mode, op_priority):
+    expected = build().simulate_window(3000, mode, op_priority=op_priority)
+    ch = build()
+    skipped = _spy_skip_cycles(ch)
+    window = ch.simulate_window(3000, mode, op_priority=op_priority, extrapolate=True)
+    assert len(skipped) == 1 and skipped[0] > 0
+    assert window.keys() == expected.keys()
+    assert window == pytest.approx(expected, rel=1e-9)
+
+
+def test_find_cycle_backs_off_when_verification_fails(monkeypatch):
+    """指纹序列 A B C A B D A B C A B C ...：t=3 起的候选在第二周期对不上，t=8 起的也不行，最后认 C A B"""
+    ch = _idle_character()
+    key = [None]
+    monkeypatch.setattr(ch, "_cycle_fingerprint", lambda: key[0])
+
+    def run(script):
+        ch.timer.current_time = 0
+        key[0] = script[0]
+
+        def steps():
+            for k in script[1:]:
+                ch.timer.current_time += 1
+                key[0] = k
+                yield
+
+        return ch._find_cycle(steps())
+
+    origin, first, last = run("ABCABDABCABCABCABC")
+    assert (origin[0], first[0], last[0]) == (0, 8, 11)
+    # 第三个周期跑完验证才返回
+    assert ch.timer.current_time == 14
+    # 验证前就跑完了：不认未验证的候选
+    assert run("ABCABDABCABCA") is None
+
+
+@pytest.mark.parametrize("seed", range(1, 7))
+def test_failed_shadow_keeps_its_draws(seed):
+    ch = proc_character()
+    ch.seed(seed)
+    log = ch.build_rotation_from_meta(2000)
+    ops = [rec[0] for rec in log]
+    # 模拟失败不回滚随机数：每一步都重新掷骰子，combo 约占一半
+    assert 0.45 < ops.count("roll") / 2000 < 0.55
+    assert ops.count("roll") + ops.count("filler") == 2000
+    # 模拟成功时回滚随机数，真实执行掷出同样的命中，roll 后面总能接上 spend
+    assert all(ops[i + 1] == "spend" for i, op in enumerate(ops) if op == "roll")
+
+    again = proc_character()
+    again.seed(seed)
+    assert again.build_rotation_from_meta(2000) == log
+
+
+def _buff_character(time):
+    """buff 一开始就有 1 层；hit 需要 buff"""
+    dmg = Resource("dmg", 1e9, 0)
+    buff = State("buff", 1, 1, time, 1, 1)
+    ch = Character("buff", Timer(), [dmg], [buff])
+    ch.add_operation(Operation("hit", 1.0, [], [dmg], [], [1], [], state_requirements=[(buff, 1)]))
+    return ch, buff
+
+
+def test_compile_reschedules_edited_state_time():
+    ch, _ = _buff_character(2)
+    assert len(ch.build_rotation_greedy_ops(50)) == 3
+
+    ch, buff = _buff_character(10)
+    ch.compile()
+    buff.time = 2
+    ch.invalidate()
+    assert len(ch.build_rotation_greedy_ops(50)) == 3
+
+
+@pytest.mark.parametrize("order", ["lifo", "fifo"])
+def test_stacked_wrappers_unwind_in_any_order(order):
+    ch = meta_character()
+    ops = ch._get_snapshot_layout().operations
+    rec = RotationRecorder(ch).attach()
+    prof = ch.enable_profiler()
+    ins = ch.enable_instrumentation()
+    assert all("operate" in op.__dict__ for op in ops)
+    if order == "lifo":
+        ch.disable_instrumentation()
+        ch.disable_profiler()
+        rec.detach()
+    else:
+        rec.detach()
+        ch.disable_profiler()
+        ch.disable_instrumentation()
+    # 全部解除后实例上不留任何包装，之后的运行不再被记录
+    assert not any(name in op.__dict__ for op in ops for name in ("operate", "test"))
+    assert not any(name in st.__dict__ for st in ch.state_manager.states for name in ("add", "remove", "force_clear"))
+    n_rec, n_prof, n_ins = len(rec), dict(prof.calls), len(ins.state_events)
+    rec._last = None
+    ch.build_rotation_greedy_ops(20, GREEDY_ORDER)
+    assert rec._last is None and len(rec) == n_rec and len(ins.state_events) == n_ins
+    assert prof.calls == n_prof
+    pickle.dumps(ch)
+
+
+def test_wrapper_below_others_stays_transparent_after_detach():
+    ch = meta_character()
+    rec = RotationRecorder(ch).attach()
+    prof = ch.enable_profiler()
+    rec.detach()
+    ch.build_rotation_greedy_ops(20, GREEDY_ORDER)
+    # 记录器已解除：不再记录；性能分析仍在统计
+    assert len(rec) == 0 and rec._last is None
+    assert prof.calls["operate"] == 20
+    ch.disable_profiler()
+    assert "operate" not in ch.operations[0].__dict__
+
+
+def _meta_runs(ch):
+    """wait 模式的元操作循环，再从结束处做一次束搜索（快照 / 回滚路径）"""
+    log = ch.build_rotation_from_meta(80, wait=True)
+    plan = ch.plan_rotation(6, 3, "dmg")
+    return log, plan, _digest(ch, log + plan)
+
+
+def _count_calls(monkeypatch, cls, name):
+    calls = []
+    func = getattr(cls, name)
+
+    def counted(self, *args, **kwargs):
+        calls.append(self)
+        return func(self, *args, **kwargs)
+
+    monkeypatch.setattr(cls, name, counted)
+    return calls
+
+
+def test_dirty_tracking_matches_full_reevaluation(monkeypatch):
+    prio_calls = _count_calls(monkeypatch, MetaOperation, "get_priority")
+    feas_calls = _count_calls(monkeypatch, MetaOperation, "can_execute")
+    tracked = _meta_runs(meta_character())
+    n_prio, n_feas = len(prio_calls), len(feas_calls)
+    # 不建依赖图：_priority / _can_execute 每次都直接调用 get_priority / can_execute
+    monkeypatch.setattr(Character, "_build_dirty_tracking", lambda self: None)
+    ch = meta_character()
+    assert _meta_runs(ch) == tracked and ch._dirty_priority is None
+    assert n_prio < len(prio_calls) - n_prio and n_feas < len(feas_calls) - n_feas
+
+
+def test_feasibility_cache_matches_uncached_shadow_runs(monkeypatch):
+    shadows = _count_calls(monkeypatch, MetaOperation, "_simulate_full")
+    ch = meta_character()
+    cached = _meta_runs(ch)
+    info = ch.feasibility_cache_info()
+    assert info["hits"] > 0 and info["misses"] == len(shadows) and info["size"] <= info["maxsize"]
+    n_cached = len(shadows)
+    ch = meta_character()
+    ch.feasibility_cache_size = 0
+    assert _meta_runs(ch) == cached
+    assert ch.feasibility_cache_info()["hits"] == 0 and len(shadows) - n_cached > n_cached
+
+
+def _slow_character(mana=50):
+    """slow：2 秒，开始时消耗 4 mana，结束时 10 伤害"""
+    dmg, res = Resource("dmg", 1e9, 0), Resource("mana", 100, mana)
+    ch = Character("window", Timer(), [dmg, res])
+    slow = Operation("slow", 2.0, [res], [dmg], [4], [10], [])
+    ch.add_operation(slow)
+    ch.add_meta_operation(MetaOperation("slow", [slow]))
+    return ch
+
+
+@pytest.mark.parametrize("mode", ["meta", "greedy_ops"])
+def test_simulate_window_prorates_the_straddling_step(mode):
+    ch = _slow_character()
+    # 0-2、2-4 两步完整，4-6 这一步只有一半落在窗口内
+    window = ch.simulate_window(5, mode)
+    assert window == {"duration": 5, "op_records": 2.5, "count:slow": 2.5,
+                      "produce:dmg": 25.0, "consume:dmg": 0.0, "produce_per_sec:dmg": 5.0, "consume_per_sec:dmg": 0.0,
+                      "produce:mana": 0.0, "consume:mana": 10.0, "produce_per_sec:mana": 0.0,
+                      "consume_per_sec:mana": 2.0}
+    assert ch.timer.current_time == 6 and ch.timer.total_time is None
+    # 下一个窗口从 6 开始：6-8、8-10 完整，10-12 折半
+    assert ch.simulate_window(5, mode)["count:slow"] == 2.5
+    # 资源只够一步：循环在 2 秒结束，窗口剩下的时间不折算任何操作
+    short = _slow_character(mana=4).simulate_window(5, mode)
+    assert short["count:slow"] == 1 and short["produce:dmg"] == 10 and short["produce_per_sec:dmg"] == 2
+
+
+@pytest.mark.parametrize("mode, kwargs", [("meta", {"wait": True}), ("greedy_ops", {"op_priority": GREEDY_ORDER})])
+def test_iter_rotation_matches_build_rotation(mode, kwargs):
+    build = "build_rotation_from_meta" if mode == "meta" else "build_rotation_greedy_ops"
+    ref = meta_character()
+    log = getattr(ref, build)(max_steps=60, **kwargs)
+    ch = meta_character()
+    records = list(ch.iter_rotation(mode, max_steps=60, **kwargs))
+    assert [(r.op_id, r.counter, r.time, r.consume) for r in records] == [
+        (r[0], r[1], r[2], tuple(r[3].items())) for r in log]
+    assert _digest(ch, log) == _digest(ref, log)
+    # 提前 break：角色停在已交出的最后一步之后，与只跑这么多步的结果一致
+    short = meta_character()
+    short_log = getattr(short, build)(max_steps=20, **kwargs)
+    ch = meta_character()
+    for n, _ in enumerate(ch.iter_rotation(mode, max_steps=60, **kwargs), 1):
+        if n == len(short_log):
+            break
+    assert _digest(ch, short_log) == _digest(short, short_log)
@@ -0,0 +1,41 @@
+"""SpecCache：按单表内容哈希复用解析结果，只重新解析改动过的表"""
+import characterspec
+from characterspec import CharacterSpec, SpecCache
+from fixtures import SPEC_GREEDY_ORDER, spec_tables
+
+
+def _count_parses(monkeypatch):
+    calls = []
+    for sheet, parser in list(characterspec.SHEET_PARSERS.items()):
+        def counted(rows, sheet=sheet, parser=parser):
+            calls.append(sheet)
+            return parser(rows)
+        monkeypatch.setitem(characterspec.SHEET_PARSERS, sheet, counted)
+    return calls
+
+
+def _greedy_log(ch):
+    return ch.build_rotation_greedy_ops(200, SPEC_GREEDY_ORDER)
+
+
+def test_sheet_cache_reparses_only_edited_sheet(tmp_path, monkeypatch):
+    cache = SpecCache(str(tmp_path))
+    tables = spec_tables()
+    spec = CharacterSpec.from_values(tables)
+    calls = _count_parses(monkeypatch)
+    ch = cache.build(spec)
+    filled = {sheet for sheet in characterspec.SHEET_NAMES if spec.tables.get(sheet)}
+    assert set(calls) >= filled and len(calls) == len(characterspec.SHEET_NAMES)
+
+    tables["OperationConsumes"][1][2] = 20  # skill 的能量消耗 30 -> 20
+    edited = CharacterSpec.from_values(tables)
+    calls.clear()
+    ch2 = cache.build(edited)
+    # 有内容的表里只有被改的这张重新解析（空表不进缓存，总是直接解析）
+    assert [s for s in calls if s in filled] == ["OperationConsumes"]
+    assert _greedy_log(ch2) == _greedy_log(edited.build())
+    assert _greedy_log(ch) == _greedy_log(spec.build())
+
+    calls.clear()
+    cache.build(edited)
+    assert calls == []
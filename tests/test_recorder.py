@@ -0,0 +1,46 @@
+"""recorder.py：RotationRecorder 的逐条记录、扩容与影子模拟下的 produce / dt"""
+import numpy as np
+import pytest
+
+from character import Character, Operation, Resource, State, Timer
+from fixtures import meta_character
+from recorder import RotationRecorder
+
+DMG = {"shot": 10, "skill": 40, "burst": 150, "vent": 0}
+BASE_TIME = {"shot": 0.5, "skill": 1.0, "burst": 2.0, "vent": 1.5}
+
+
+def test_records_match_rotation_log_through_shadow_runs():
+    log = meta_character().build_rotation_from_meta(60)
+    ch = meta_character()
+    rec = RotationRecorder(ch, capacity=2, state_ids=["buff", "stacks"]).run("meta", max_steps=60)
+    # type=2 元操作做过影子模拟，但只有真实执行会落成记录
+    assert ch.feasibility_cache_info()["misses"] > 0
+    assert len(rec) == len(log) > 2 and len(rec._buf) >= len(rec)
+    arr = rec.to_numpy()
+    op_ids = [rec.op_ids[j] for j in arr["op"]]
+    assert op_ids == [r[0] for r in log]
+    assert list(arr["counter"]) == [r[1] for r in log]
+    assert list(arr["time"]) == [r[2] for r in log]
+    for row, r in zip(arr, log):
+        assert {rid: row["consume"][k] for k, rid in enumerate(rec.res_ids) if row["consume"][k]} == r[3]
+    # produce / dt 来自同一次真实执行
+    assert list(rec.column("produce:dmg")) == [DMG[op] for op in op_ids]
+    assert rec.column("produce:dmg").sum() == ch.resources["dmg"].produce_total
+    assert list(rec.column("dt")) == [BASE_TIME[op] for op in op_ids]
+    assert np.allclose(arr["time"][1:] - arr["dt"][1:], arr["time"][:-1])
+    # 跑完后包装已解除
+    assert not any("operate" in op.__dict__ for op in rec._ops)
+
+
+def test_stacks_column_keeps_float_current():
+    focus, dmg = State("focus", 2.5, 5, 100, 1, 1), Resource("dmg", 1e9, 0)
+    ch = Character("f", Timer(), [dmg], [focus])
+    ch.add_operation(Operation("tick", 1.0, [], [dmg], [], [1], []))
+    rec = RotationRecorder(ch, state_ids=["focus"]).run("greedy_ops", max_steps=3)
+    assert list(rec.column("stacks:focus")) == [2.5, 2.5, 2.5]
+
+
+def test_unknown_state_id_is_rejected():
+    with pytest.raises(ValueError, match="nope"):
+        RotationRecorder(meta_character(), state_ids=["nope"])
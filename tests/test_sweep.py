@@ -0,0 +1,103 @@
+"""sweep.py：参数写入（apply_params / run_sweep）与蒙特卡洛（run_monte_carlo / distribution_stats / Character.simulate_many）"""
+import math
+
+import pytest
+
+from character import (Character, MetaOperation, Operation, OperationTriggeredStateRule, Resource, State,
+                       StateResourceEffect, Timer)
+from fixtures import proc_character
+from sweep import apply_params, distribution_stats, run_monte_carlo, run_sweep, summarize
+
+
+def sweep_character(buff_time=10, stacks_length=3, max_charges=2):
+    """buff 一开始就有 1 层；strike 需要 buff、有充能；每次出手给 stacks 加一层，3 层时 finisher"""
+    dmg = Resource("dmg", 1e9, 0)
+    buff = State("buff", 1, 1, buff_time, 1, 1)
+    stacks = State("stacks", 0, 5, 4, 2, stacks_length)
+    ch = Character("sweep", Timer(), [dmg], [buff, stacks])
+    ch.add_operation(Operation("finisher", 1.0, [], [dmg], [], [100], [], state_requirements=[(stacks, 3)]))
+    ch.add_operation(Operation("strike", 1.0, [], [dmg], [], [50], [stacks], state_requirements=[(buff, 1)],
+                               max_charges=max_charges, charge_cd=3))
+    ch.add_operation(Operation("jab", 1.0, [], [dmg], [], [5], [stacks]))
+    return ch
+
+
+SWEEP_GRID = {"state:buff.time": [2, 10], "state:stacks.length": [2, 3, 5], "op:strike.max_charges": [1, 2, 3]}
+SWEEP_ARGS = {"state:buff.time": "buff_time", "state:stacks.length": "stacks_length",
+              "op:strike.max_charges": "max_charges"}
+
+
+def test_sweep_rows_match_directly_built_characters():
+    rows = run_sweep(sweep_character, SWEEP_GRID, max_steps=40, mode="greedy_ops", max_workers=1, as_dataframe=False)
+    assert len(rows) == 18
+    for row in rows:
+        params = {k: row[k] for k in SWEEP_GRID}
+        ch = sweep_character(**{SWEEP_ARGS[k]: v for k, v in params.items()})
+        expected = dict(params)
+        expected.update(summarize(ch, ch.build_rotation_greedy_ops(40)))
+        assert row == expected
+    # 参数确实改变了结果
+    assert len({(row.get("count:strike", 0), row.get("count:finisher", 0)) for row in rows}) > 3
+
+
+def test_apply_params_rejects_state_type():
+    with pytest.raises(ValueError, match="type"):
+        apply_params(sweep_character(), {"state:stacks.type": 1})
+
+
+def _mc_character():
+    """hit 以 0.3 的概率产出 10 点 dmg；每次 hit 后以 0.25 的概率给 mark 加一层（每层 +1 procs）"""
+    dmg, procs = Resource("dmg", 1e9, 0), Resource("procs", 1e9, 0)
+    mark = State("mark", 0, 10 ** 6, 1000, 1, 1, resource_effects=[StateResourceEffect(procs, on_add=1, per_stack=True)])
+    ch = Character("mc", Timer(), [dmg, procs], [mark])
+    hit = Operation("hit", 1.0, [], [dmg], [], [10], [], probability=0.3)
+    ch.add_operation(hit)
+    ch.add_meta_operation(MetaOperation("hit", [hit]))
+    ch.add_op_trigger_rule(OperationTriggeredStateRule(trigger_operation=hit, target_state=mark, probability=0.25))
+    return ch
+
+
+def test_monte_carlo_proc_rates():
+    rows, seed = run_monte_carlo(_mc_character(), 200, seed=42, max_steps=50, max_workers=1)
+    assert seed == 42 and [row["run"] for row in rows] == list(range(200))
+    assert all(row["count:hit"] == 50 for row in rows)
+    stats = distribution_stats(rows)
+    # 各 10000 次掷骰
+    assert stats["produce:dmg"]["mean"] / (10 * 50) == pytest.approx(0.3, abs=0.02)
+    assert stats["produce:procs"]["mean"] / 50 == pytest.approx(0.25, abs=0.02)
+    assert stats["produce:dmg"]["std"] > 0
+
+
+def test_monte_carlo_is_reproducible():
+    base = _mc_character()
+    rows, _ = run_monte_carlo(base, 40, seed="s", max_steps=30, max_workers=1)
+    again, _ = run_monte_carlo(base, 40, seed="s", max_steps=30, max_workers=1)
+    pooled, _ = run_monte_carlo(base, 40, seed="s", max_steps=30, max_workers=2, chunksize=7)
+    assert rows == again == pooled
+    other, _ = run_monte_carlo(base, 40, seed="t", max_steps=30, max_workers=1)
+    assert other != rows
+    # base 本身不跑
+    assert base.timer.current_time == 0 and base.resources["dmg"].current == 0
+
+
+def test_simulate_many_type2_proc_rate():
+    ch = proc_character()
+    stats = ch.simulate_many(20, seed=3, max_steps=200, max_workers=1)
+    rows, _ = run_monte_carlo(ch, 20, seed=3, max_steps=200, max_workers=1)
+    expected = distribution_stats(rows)
+    expected["seed"] = 3
+    assert stats == expected
+    # combo 约占一半的步数，且 roll 后面总跟着 spend
+    assert stats["count:roll"]["mean"] / 200 == pytest.approx(0.5, abs=0.05)
+    assert stats["count:spend"] == stats["count:roll"]
+    assert ch.timer.current_time == 0
+
+
+def test_distribution_stats():
+    rows = [{"run": 0, "a": 1, "count:x": 2, "flag": True, "name": "p"}, {"run": 1, "a": 3}]
+    stats = distribution_stats(rows, percentiles=(5, 50))
+    assert set(stats) == {"runs", "a", "count:x"} and stats["runs"] == 2
+    assert stats["a"] == {"mean": 2.0, "std": math.sqrt(2), "min": 1.0, "max": 3.0,
+                          "p5": pytest.approx(1.1), "p50": 2.0}
+    # 某次运行缺失的 count 列按 0 计
+    assert stats["count:x"]["mean"] == 1.0 and stats["count:x"]["min"] == 0.0
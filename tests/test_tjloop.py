@@ -0,0 +1,45 @@
+"""tj_attackloop_batch 与逐组调用 tj_attackloop_run 的汇总必须一致（含卡死 / 超步数 / 越界）"""
+import random
+
+import numpy as np
+
+from tjloop import BAD_INDEX, FINISHED, MAX_OPS, STUCK, SUMMARY_FIELDS, tj_attackloop_batch, tj_attackloop_run
+
+
+def _random_params(n, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        rows.append([
+            rng.choice([50, 80, 120, 200]), rng.choice([30, 60, 90]), rng.randint(0, 4),
+            rng.choice([5, 10, 15]), rng.choice([3, 8, 12]), rng.choice([10, 20, 25, 30]),
+            rng.choice([0, 1, 2]), rng.choice([0, 1, 3]), rng.choice([1, 2, 5]), rng.choice([40, 60, 80, 200]),
+            rng.randint(1, 5), rng.randint(1, 4), rng.randint(0, 2), rng.randint(0, 2),
+            rng.choice([1, 1, 2]), rng.choice([5, 5, 4]),
+        ])
+    return rows
+
+
+# 每种非正常结束方式各一组：不攒能量 / yj 上限低于重击消耗 / 普攻段位越界
+EDGE_CASES = [
+    [100, 60, 3, 10, 8, 20, 0, 0, 0, 80, 1, 3, 1, 1],
+    [100, 5, 3, 10, 8, 20, 1, 1, 2, 80, 1, 3, 1, 1],
+    [100, 60, 0, 10, 8, 20, 1, 1, 2, 80, 0, 3, 0, 0],
+]
+
+
+def test_batch_matches_scalar():
+    rows = _random_params(600) + [p + [1, 5] for p in EDGE_CASES]
+    max_ops = 2000
+    out = tj_attackloop_batch(np.array(rows, dtype=float), max_ops=max_ops)
+    for i, p in enumerate(rows):
+        _, summary = tj_attackloop_run(*p, max_ops=max_ops, trace=False)
+        assert {k: out[k][i] for k in SUMMARY_FIELDS} == summary, p
+    # 随机参数需要覆盖到所有结束方式
+    assert set(out["status"].tolist()) == {FINISHED, MAX_OPS, STUCK, BAD_INDEX}
+
+
+def test_trace_matches_summary():
+    for p in _random_params(50, seed=2) + EDGE_CASES:
+        trace, summary = tj_attackloop_run(*p, max_ops=2000)
+        assert len(trace) == summary["trace_length"]
@@ -0,0 +1,325 @@
+"""
+LES_p.tj_attackloop 的无界面内核：不 print、不依赖 xlwings，可以脱离 Excel 单独调用。
+
+    from tjloop import tj_attackloop_run, tj_attackloop_batch
+
+    trace, summary = tj_attackloop_run(100, 60, 3, 10, 8, 20, 1, 1, 2, 80, 1, 3, 1, 1)
+    out = tj_attackloop_batch({"energy_total": np.linspace(80, 200, 5000), "yj_total": 60, ...})
+    out["total_ops"], out["heavy"], out["bd"], out["normal"], out["revert_time"], out["status"]
+
+- tj_attackloop_run：标量版本，与原 UDF 的循环逐步一致，返回 (real_attack_loop, 汇总 dict)
+- tj_attackloop_batch：NumPy 锁步版本，一次跑成千上万组参数，只返回每组的汇总（不生成逐步记录）；
+  所有计算都是同样的 float64 加减 / 取 min / 比较，汇总与标量版本逐项相同
+
+汇总字段（SUMMARY_FIELDS）：
+- total_ops: 重击 + 拔刀斩 + 普通攻击次数；heavy / bd / normal: 各自次数
+- revert_time / final_attack_time / operation_change_time: 循环结束时的同名计数
+- trace_length: real_attack_loop 的长度（正常结束时比 total_ops 多一条大招记录）
+- energy: 结束时的能量
+- status: 0 正常结束（能量攒满）；1 到达 max_ops；2 卡死（yj < 重击消耗而 yj 已满，原循环会死循环）；
+  3 普通攻击段位越界（原循环会抛 IndexError）
+"""
+import numpy as np
+
+PARAM_NAMES = (
+    "energy_total", "yj_total", "bd_total", "attack_1_yj_add", "attack_2_yj_add", "heavy_attack_yj_cost",
+    "attack_1_energy_add", "attack_2_energy_add", "heavy_attack_energy_add", "yj_revert_threshold",
+    "normal_attack_time", "normal_attack_loop_bd_time", "bd_add_time", "three_heavy_bd_revert",
+    "bd_consume_ratio", "original_normal_attack_length",
+)
+PARAM_DEFAULTS = {"bd_consume_ratio": 1, "original_normal_attack_length": 5}
+SUMMARY_FIELDS = ("total_ops", "heavy", "bd", "normal", "revert_time", "final_attack_time",
+                  "operation_change_time", "trace_length", "energy", "status")
+
+HEAVY_ATTACK_IDS = (0, 1, 2)
+NORMAL_ATTACK_IDS = (4, 5, 6, 7, 8)
+BD_ID = 3
+ULT_ID = 9
+
+FINISHED, MAX_OPS, STUCK, BAD_INDEX = 0, 1, 2, 3
+
+
+def tj_attackloop_run(energy_total, yj_total, bd_total, attack_1_yj_add, attack_2_yj_add, heavy_attack_yj_cost,
+                      attack_1_energy_add, attack_2_energy_add, heavy_attack_energy_add, yj_revert_threshold,
+                      normal_attack_time, normal_attack_loop_bd_time, bd_add_time, three_heavy_bd_revert,
+                      bd_consume_ratio=1, original_normal_attack_length=5, *, max_ops=None, trace=True):
+    """
+    0,1,2 表示重击，3 表示拔刀斩，4~8 表示普通攻击，9 表示大招
+    优先级：重击>拔刀斩>普通攻击
+
+    返回 (real_attack_loop, summary)；trace=False 时不生成逐步记录（real_attack_loop 为空列表）。
+    与原循环的区别只在异常情况：卡死时停下并返回 status=2（原循环不会结束），
+    到达 max_ops（None 表示不限）时返回 status=1。
+    """
+    current_yj_consume = 0
+    current_yj = yj_total
+    current_bd = bd_total
+    real_attack_loop = []
+    current_energy = 0
+    normal_attack_loop_time_count = 0
+    revert_time = 0
+    final_attack_time = 0
+    heavy_attack_time = 0
+    bd_time = 0
+    normal_time = 0
+    operation_change_time = 0
+    n_normal_ids = len(NORMAL_ATTACK_IDS)
+    status = None
+
+    def record(op_id):
+        if trace:
+            real_attack_loop.append([op_id, current_yj, current_bd, current_energy, revert_time, final_attack_time,
+                                     heavy_attack_time, bd_time, operation_change_time])
+
+    def out_of_ops():
+        return max_ops is not None and heavy_attack_time + bd_time + normal_time >= max_ops
+
+    while status is None:
+        if current_yj < heavy_attack_yj_cost and not current_yj < yj_total:
+            # 重击段放不出、普攻段又不进入：原循环在这里空转
+            status = STUCK
+            break
+        heavy_attack_id = 0
+        while current_yj >= heavy_attack_yj_cost:
+            if out_of_ops():
+                status = MAX_OPS
+                break
+            record(HEAVY_ATTACK_IDS[heavy_attack_id])
+            heavy_attack_id += 1
+            if heavy_attack_id == len(HEAVY_ATTACK_IDS):
+                heavy_attack_id = 0
+                current_bd = min(current_bd + three_heavy_bd_revert, bd_total)
+            current_yj -= heavy_attack_yj_cost
+            current_yj_consume += heavy_attack_yj_cost
+            current_energy += heavy_attack_energy_add
+            heavy_attack_time += 1
+            if current_yj_consume >= yj_revert_threshold:
+                current_yj = yj_total
+                current_yj_consume = 0
+                revert_time += 1
+            if current_energy >= energy_total:
+                operation_change_time += 1
+                record(ULT_ID)
+                status = FINISHED
+                break
+
+        operation_change_time += 1
+
+        normal_attack_time_count = 0
+        while current_yj < yj_total and status is None:
+            if out_of_ops():
+                status = MAX_OPS
+                break
+            if current_bd >= 1:
+                record(BD_ID)
+                current_bd -= bd_consume_ratio
+                current_yj = min(current_yj + attack_1_yj_add, yj_total)
+                current_energy += attack_1_energy_add
+                bd_time += 1
+                normal_attack_loop_time_count += 1
+                if normal_attack_loop_time_count == normal_attack_loop_bd_time:
+                    current_bd = min(current_bd + bd_add_time, bd_total)  # bd_add_time 表示每n次最后一击的拔刀斩次数回复数量
+                    normal_attack_loop_time_count = 0
+            else:
+                k = int(original_normal_attack_length - normal_attack_time + normal_attack_time_count)
+                if not -n_normal_ids <= k < n_normal_ids:
+                    status = BAD_INDEX
+                    break
+                record(NORMAL_ATTACK_IDS[k])
+                current_yj = min(current_yj + attack_2_yj_add, yj_total)
+                current_energy += attack_2_energy_add
+                normal_time += 1
+                normal_attack_time_count += 1
+                if int(original_normal_attack_length - normal_attack_time + normal_attack_time_count) == n_normal_ids:
+                    normal_attack_loop_time_count += 1
+                    normal_attack_time_count = 0
+                    if normal_attack_loop_time_count == normal_attack_loop_bd_time:
+                        current_bd = min(current_bd + bd_add_time, bd_total)
+                        normal_attack_loop_time_count = 0
+                        final_attack_time += 1
+            if current_energy >= energy_total:
+                record(ULT_ID)
+                status = FINISHED
+                break
+        operation_change_time += 1
+
+    total = heavy_attack_time + bd_time + normal_time
+    summary = {
+        "total_ops": total, "heavy": heavy_attack_time, "bd": bd_time, "normal": normal_time,
+        "revert_time": revert_time, "final_attack_time": final_attack_time,
+        "operation_change_time": operation_change_time,
+        "trace_length": total + (status == FINISHED), "energy": current_energy, "status": status,
+    }
+    return real_attack_loop, summary
+
+
+def _param_arrays(params):
+    """
+    params: {参数名: 标量或一维数组}（按广播对齐），或 (N, 14~16) 的二维表（列顺序同 PARAM_NAMES，
+    缺的尾列用默认值）。返回 {参数名: float64 数组} 与变体数 N。
+    """
+    if isinstance(params, dict):
+        unknown = set(params) - set(PARAM_NAMES)
+        if unknown:
+            raise ValueError(f"未知参数: {sorted(unknown)}")
+        missing = [k for k in PARAM_NAMES if k not in params and k not in PARAM_DEFAULTS]
+        if missing:
+            raise ValueError(f"缺少参数: {missing}")
+        cols = [np.asarray(params.get(k, PARAM_DEFAULTS.get(k)), dtype=float) for k in PARAM_NAMES]
+    else:
+        table = np.atleast_2d(np.asarray(params, dtype=float))
+        width = table.shape[1]
+        if not len(PARAM_NAMES) - len(PARAM_DEFAULTS) <= width <= len(PARAM_NAMES):
+            raise ValueError(f"参数表需要 {len(PARAM_NAMES) - len(PARAM_DEFAULTS)}~{len(PARAM_NAMES)} 列，实际 {width} 列")
+        cols = [table[:, i] if i < width else np.asarray(float(PARAM_DEFAULTS[k]))
+                for i, k in enumerate(PARAM_NAMES)]
+    cols = np.broadcast_arrays(*cols)
+    n = cols[0].size if cols[0].ndim else 1
+    return {k: np.array(c, dtype=float).reshape(n) for k, c in zip(PARAM_NAMES, cols)}, n
+
+
+def tj_attackloop_batch(params, max_ops=100000):
+    """
+    一次跑 N 组参数（见 _param_arrays），所有变体同步推进：每一轮先处理段落切换（重击段 ↔ 普攻段），
+    再按各自所处的段落对所有变体同时结算一次重击 / 拔刀斩 / 普通攻击；结束的变体从活动集合里移除。
+    返回 {汇总字段: (N,) 数组}（见 SUMMARY_FIELDS），energy 为 float，其余为 int64。
+    """
+    p, n = _param_arrays(params)
+    out = {k: np.zeros(n, dtype=float if k == "energy" else np.int64) for k in SUMMARY_FIELDS}
+    n_ids = len(NORMAL_ATTACK_IDS)
+
+    live = np.arange(n)
+    # 各变体的参数与循环变量（只保留仍在运行的变体，结束后压缩）
+    P = {k: v.copy() for k, v in p.items()}
+    S = {
+        "yj": P["yj_total"].copy(), "bd": P["bd_total"].copy(), "energy": np.zeros(n),
+        "yj_consume": np.zeros(n),
+        "phase": np.zeros(n, dtype=np.int8),  # 0 重击段，1 普攻段
+        "heavy_id": np.zeros(n, dtype=np.int64), "ntc": np.zeros(n, dtype=np.int64),
+        "loop_count": np.zeros(n, dtype=np.int64),
+        "heavy": np.zeros(n, dtype=np.int64), "bd_n": np.zeros(n, dtype=np.int64),
+        "normal": np.zeros(n, dtype=np.int64), "revert": np.zeros(n, dtype=np.int64),
+        "final": np.zeros(n, dtype=np.int64), "opc": np.zeros(n, dtype=np.int64),
+    }
+
+    def finish(mask, status):
+        idx = live[mask]
+        out["heavy"][idx] = S["heavy"][mask]
+        out["bd"][idx] = S["bd_n"][mask]
+        out["normal"][idx] = S["normal"][mask]
+        total = S["heavy"][mask] + S["bd_n"][mask] + S["normal"][mask]
+        out["total_ops"][idx] = total
+        out["trace_length"][idx] = total + (status == FINISHED)
+        out["revert_time"][idx] = S["revert"][mask]
+        out["final_attack_time"][idx] = S["final"][mask]
+        out["operation_change_time"][idx] = S["opc"][mask]
+        out["energy"][idx] = S["energy"][mask]
+        out["status"][idx] = status
+
+    # 重击放不出、普攻段又进不去的变体原循环会空转（与标量版本一样在每轮外层循环开头检查）
+    stuck = (S["yj"] < P["heavy_attack_yj_cost"]) & ~(S["yj"] < P["yj_total"])
+    pending = stuck
+
+    while live.size:
+        yj, cost, yj_total = S["yj"], P["heavy_attack_yj_cost"], P["yj_total"]
+        done = np.zeros(live.size, dtype=bool)
+        if pending is not None:
+            if pending.any():
+                finish(pending, STUCK)
+                done |= pending
+            pending = None
+        else:
+            # 1. 段落切换（不消耗操作）：重击段 -> 普攻段 -> 下一轮外层循环的重击段
+            h2n = (S["phase"] == 0) & (yj < cost)
+            S["opc"][h2n] += 1
+            S["phase"][h2n] = 1
+            S["ntc"][h2n] = 0
+            n2h = (S["phase"] == 1) & ~(yj < yj_total)
+            S["opc"][n2h] += 1
+            S["phase"][n2h] = 0
+            S["heavy_id"][n2h] = 0
+            stuck = n2h & (yj < cost)
+            if stuck.any():
+                finish(stuck, STUCK)
+                done |= stuck
+
+        ops = S["heavy"] + S["bd_n"] + S["normal"]
+        capped = ~done & (ops >= max_ops)
+        if capped.any():
+            # 标量版本在段内停下后还会走完段尾的计数：重击段 +2，普攻段 +1
+            S["opc"][capped] += np.where(S["phase"][capped] == 0, 2, 1)
+            finish(capped, MAX_OPS)
+            done |= capped
+        act = ~done
+
+        # 2. 段落内结算一次操作
+        heavy = act & (S["phase"] == 0)
+        normal_phase = act & (S["phase"] == 1)
+        bd = normal_phase & (S["bd"] >= 1)
+        norm = normal_phase & ~bd
+        k = np.trunc(P["original_normal_attack_length"] - P["normal_attack_time"] + S["ntc"])
+        bad = norm & ~((k >= -n_ids) & (k < n_ids))
+        if bad.any():
+            S["opc"][bad] += 1
+            finish(bad, BAD_INDEX)
+            done |= bad
+            norm &= ~bad
+
+        if heavy.any():
+            h = heavy
+            S["heavy_id"][h] += 1
+            wrap = h & (S["heavy_id"] == len(HEAVY_ATTACK_IDS))
+            S["heavy_id"][wrap] = 0
+            S["bd"][wrap] = np.minimum(S["bd"][wrap] + P["three_heavy_bd_revert"][wrap], P["bd_total"][wrap])
+            S["yj"][h] -= cost[h]
+            S["yj_consume"][h] += cost[h]
+            S["energy"][h] += P["heavy_attack_energy_add"][h]
+            S["heavy"][h] += 1
+            rv = h & (S["yj_consume"] >= P["yj_revert_threshold"])
+            S["yj"][rv] = yj_total[rv]
+            S["yj_consume"][rv] = 0
+            S["revert"][rv] += 1
+            fin = h & (S["energy"] >= P["energy_total"])
+            # 大招记录前 +1，跳出重击段后 +1，普攻段不进入再 +1
+            S["opc"][fin] += 3
+
+        if bd.any():
+            b = bd
+            S["bd"][b] -= P["bd_consume_ratio"][b]
+            S["yj"][b] = np.minimum(S["yj"][b] + P["attack_1_yj_add"][b], yj_total[b])
+            S["energy"][b] += P["attack_1_energy_add"][b]
+            S["bd_n"][b] += 1
+            S["loop_count"][b] += 1
+            hit = b & (S["loop_count"] == P["normal_attack_loop_bd_time"])
+            S["bd"][hit] = np.minimum(S["bd"][hit] + P["bd_add_time"][hit], P["bd_total"][hit])
+            S["loop_count"][hit] = 0
+
+        if norm.any():
+            m = norm
+            S["yj"][m] = np.minimum(S["yj"][m] + P["attack_2_yj_add"][m], yj_total[m])
+            S["energy"][m] += P["attack_2_energy_add"][m]
+            S["normal"][m] += 1
+            S["ntc"][m] += 1
+            k2 = np.trunc(P["original_normal_attack_length"] - P["normal_attack_time"] + S["ntc"])
+            wrap = m & (k2 == n_ids)
+            S["loop_count"][wrap] += 1
+            S["ntc"][wrap] = 0
+            hit = wrap & (S["loop_count"] == P["normal_attack_loop_bd_time"])
+            S["bd"][hit] = np.minimum(S["bd"][hit] + P["bd_add_time"][hit], P["bd_total"][hit])
+            S["loop_count"][hit] = 0
+            S["final"][hit] += 1
+
+        fin_n = (bd | norm) & (S["energy"] >= P["energy_total"])
+        # 普攻段结束：跳出普攻段后 +1
+        S["opc"][fin_n] += 1
+        fin = ((heavy | bd | norm) & (S["energy"] >= P["energy_total"]))
+        if fin.any():
+            finish(fin, FINISHED)
+            done |= fin
+
+        if done.any():
+            keep = ~done
+            live = live[keep]
+            P = {key: v[keep] for key, v in P.items()}
+            S = {key: v[keep] for key, v in S.items()}
+    return out